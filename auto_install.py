@@ -30,6 +30,7 @@ from john import John
 from linux_requirements import install_requirements
 
 pkgs_names = ['pdsh', 'munge', 'pmix', 'slurm', 'pyslurm', 'openmpi']
+shared_pkgs_names = ['pdsh', 'munge', 'slurm', 'openmpi'] # packages that can be installed in a shared prefix
 tested_linux_distros = ['ubuntu', 'kali', 'arch', 'centos']
 
 def install_args():
@@ -45,6 +46,12 @@ def install_args():
     prefix_parser.add_argument("--pdsh-prefix", dest="pdsh_prefix", default='/usr/local/pdsh', 
                                 metavar='/usr/local/pdsh',
                                 help="Location to install pdsh")
+    prefix_parser.add_argument("--munge-prefix", dest="munge_prefix",
+                                metavar='/usr',
+                                help="Location to install Munge")
+    prefix_parser.add_argument("--slurm-prefix", dest="slurm_prefix", default='/usr',
+                                metavar='/usr',
+                                help="Location to install Slurm")
 
 
     installation_parser = parser.add_argument_group("Customized Installation")
@@ -62,11 +69,28 @@ def install_args():
                                      choices=pkgs_names,
                                      default=[],
                                      help="Do not uncompress package")
+    installation_parser.add_argument("--out-of-tree", dest='out_of_tree', action='store_true',
+                                     help="Compile each flavor (prefix and flags) in its own build directory")
+    installation_parser.add_argument("--tmpfs", nargs='?', const='/dev/shm', metavar='/dev/shm',
+                                     help="Uncompress and compile in a memory filesystem (spill to build directory if memory is short)")
+    installation_parser.add_argument("--shared-build-dir", dest='shared', action='store_true',
+                                     help="Build directory is shared by several nodes (NFS): prepare the source once and compile per host")
+    installation_parser.add_argument("--native-pkg", dest='native_pkg', metavar='REPO_DIR',
+                                     help="Also build distro-native packages (rpm, deb or pkg.tar) in REPO_DIR")
+    installation_parser.add_argument("--modules", action='store_true',
+                                     help="Install the environment of the packages as modulefiles instead of /etc/profile.d scripts")
     installation_parser.add_argument("--disable", nargs='*',
                                      choices=pkgs_names,
                                      default=[],
                                      help="Do not install selected packages (USE WITH CAUTION)")
 
+    shared_parser = parser.add_argument_group("Shared prefix (e.g. NFS /opt)")
+    shared_parser.add_argument("--role", choices=["installer", "node"],
+                               help=f"installer: install {', '.join(shared_pkgs_names)} in their shared prefixes, "
+                                    "node: only install their node-local files and setup (the other packages are installed as usual)")
+    shared_parser.add_argument("--warmup", action='store_true',
+                               help="Read the binaries and libraries of the shared prefixes into the page cache (node role)")
+
 
 
     # depends_parser = parser.add_argument_group("Optional Features")
@@ -121,7 +145,8 @@ if __name__ == "__main__":
             packages += [
                 BuildablePackage(name='munge', version='0.5.14',
                                  source='https://github.com/dun/munge/archive/refs/tags/munge-0.5.14.tar.gz',
-                                 pkg=Munge, build_path=build_path, uncompressed_dir='munge-munge-0.5.14')
+                                 pkg=Munge, build_path=build_path, uncompressed_dir='munge-munge-0.5.14',
+                                 prefix=args.munge_prefix)
             ]
 
         if "pmix" not in args.disable:
@@ -143,7 +168,8 @@ if __name__ == "__main__":
             packages += [
                 BuildablePackage(name='slurm', version='20.02.7',
                                  source='https://download.schedmd.com/slurm/slurm-20.02.7.tar.bz2',
-                                 pkg=Slurm, build_path=build_path, uncompressed_dir='slurm-20.02.7')
+                                 pkg=Slurm, build_path=build_path, uncompressed_dir='slurm-20.02.7',
+                                 prefix=args.slurm_prefix)
                 ]
             if "pyslurm" not in args.disable:
                 packages += [
@@ -175,6 +201,13 @@ if __name__ == "__main__":
             
             print_status(f"Installing {bpkg.name}-{bpkg.version}")
             PkgClass = bpkg.pkg
+            bpkg.options.update(out_of_tree=args.out_of_tree,
+                                tmpfs=args.tmpfs,
+                                shared=args.shared,
+                                native_pkg=args.native_pkg,
+                                modules=args.modules)
+            if bpkg.name in shared_pkgs_names:
+                bpkg.options.update(role=args.role, warmup=args.warmup)
             pkg = PkgClass(**bpkg.init_options())
 
 
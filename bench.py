@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+#
+# Common helpers to save and compare benchmark results
+#
+# Results are saved as JSON documents:
+#   {"benchmark": NAME, "host": HOST, "date": DATE, "metadata": {...}, "results": [{...}, ...]}
+# so a run can be compared against a previous one (baseline) to detect regressions.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import json
+import os
+import platform
+import tempfile
+import time
+from typing import List
+
+from sbash import Bash
+from fineprint.status import print_status, print_successful, print_failure
+from tabulate import tabulate
+
+
+def save_results(path:str, benchmark:str, results:List[dict], *, sudo:bool = False, **metadata):
+    """
+    Save benchmark results in path (JSON format)
+    If sudo is True the file is written using 'sudo install' (useful for system paths)
+    """
+    document = {
+        "benchmark": benchmark,
+        "host": platform.node(),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "metadata": metadata,
+        "results": results
+    }
+
+    path = os.path.abspath(os.path.expanduser(path))
+    if sudo:
+        with tempfile.NamedTemporaryFile('w', suffix=".json", delete=False) as tmp:
+            json.dump(document, tmp, indent=2)
+        Bash.exec(f"sudo install -D -m644 {tmp.name} {path}")
+        os.remove(tmp.name)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as results_file:
+            json.dump(document, results_file, indent=2)
+
+    print_successful(f"Results of {benchmark} benchmark were saved in {path}")
+    return document
+
+
+def load_results(path:str):
+    """
+    Load benchmark results saved with save_results
+    """
+    with open(os.path.expanduser(path), 'r') as results_file:
+        return json.load(results_file)
+
+
+def compare_results(baseline:dict, current:dict, *, key:List[str], metric:str,
+                    higher_is_better:bool = False, tolerance:float = 0.1):
+    """
+    Compare metric of current results against baseline results.
+    Results are matched using the fields listed in key.
+
+    Return a list with the regressions (results whose metric is worse than
+    the baseline by more than tolerance, e.g. 0.1 = 10%)
+    """
+    def result_key(result):
+        return tuple(result.get(field) for field in key)
+
+    baseline_results = {result_key(result): result for result in baseline["results"]}
+
+    table = []
+    regressions = []
+    for result in current["results"]:
+        base = baseline_results.get(result_key(result))
+        if base is None or not base.get(metric) or result.get(metric) is None:
+            continue
+
+        change = (result[metric] - base[metric]) / base[metric]
+        worse = -change if higher_is_better else change
+        status = "REGRESSION" if worse > tolerance else "ok"
+        if worse > tolerance:
+            regressions.append(result)
+
+        table.append([*result_key(result), base[metric], result[metric], f"{change:+.1%}", status])
+
+    print_status(f"Comparing {metric} of {current['benchmark']} against baseline ({baseline['date']}, {baseline['host']})")
+    print(tabulate(table, headers=[*key, "baseline", "current", "change", "status"], tablefmt="pretty"))
+
+    if regressions:
+        print_failure(f"{len(regressions)} regressions were detected (tolerance: {tolerance:.0%})")
+    else:
+        print_successful("No regressions were detected")
+
+    return regressions
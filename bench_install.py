@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+#
+# Benchmark of the installer pipeline (Package.prepare, build and install)
+#
+# Synthetic autotools-like packages (configurable size and number of files)
+# are generated and served by a local HTTP server, then they are installed
+# in a throwaway prefix with Package.doall under different modes:
+#   cold:     download, uncompress, build and install
+#   cached:   reuse the downloaded source (avoid download)
+#   serial:   install packages one after another
+#   parallel: install independent packages at the same time
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import http.server
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+
+from sbash import Bash
+from fineprint.status import print_status, print_successful, print_failure
+from tabulate import tabulate
+
+from pkg import Package
+from bench import save_results, load_results, compare_results
+
+
+CONFIGURE = """#!/bin/sh
+prefix=/usr/local
+for arg in "$@"; do
+    case "$arg" in
+        --prefix=*) prefix="${arg#--prefix=}" ;;
+    esac
+done
+srcdir=$(cd "$(dirname "$0")" && pwd)
+sed -e "s|@prefix@|$prefix|g" -e "s|@srcdir@|$srcdir|g" "$srcdir/Makefile.in" > Makefile
+echo "configure: prefix=$prefix srcdir=$srcdir"
+"""
+
+MAKEFILE_IN = """prefix = @prefix@
+srcdir = @srcdir@
+vpath %.c $(srcdir)/src
+CC ?= cc
+CFLAGS ?= -O2
+OBJS = {objs}
+
+all: lib{name}.a
+
+%.o: %.c
+\t$(CC) $(CFLAGS) -c $< -o $@
+
+lib{name}.a: $(OBJS)
+\t$(AR) rcs $@ $(OBJS)
+
+check: all
+
+install: all
+\tmkdir -p $(DESTDIR)$(prefix)/lib
+\tcp lib{name}.a $(DESTDIR)$(prefix)/lib/
+
+clean:
+\trm -f $(OBJS) lib{name}.a
+"""
+
+
+def synthetic_source(name:str, index:int, size:int):
+    """
+    Generate a C source file of (approximately) size bytes
+    """
+    functions = []
+    length = 0
+    count = 0
+    while length < size:
+        function = (f"int {name}_f{index}_{count}(int x)\n"
+                    f"{{\n    int y = x * {count + 3};\n"
+                    f"    for (int i = 0; i < {count % 17 + 1}; i++)\n"
+                    f"        y = (y << 1) ^ (x + i);\n"
+                    f"    return y;\n}}\n\n")
+        functions.append(function)
+        length += len(function)
+        count += 1
+
+    return "".join(functions)
+
+
+def make_synthetic_tarball(directory:str, name:str, version:str, *, nfiles:int, file_size:int):
+    """
+    Create a synthetic autotools-like tarball (name-version.tar.gz) in directory
+    Return the name of the generated tarball
+    """
+    uncompressed_dir = f"{name}-{version}"
+    tarball = f"{uncompressed_dir}.tar.gz"
+
+    files = {
+        "configure": CONFIGURE,
+        "Makefile.in": MAKEFILE_IN.format(name=name,
+                                          objs=" ".join(f"file{i}.o" for i in range(nfiles)))
+    }
+    for i in range(nfiles):
+        files[f"src/file{i}.c"] = synthetic_source(name, i, file_size)
+
+    with tarfile.open(os.path.join(directory, tarball), 'w:gz') as tar:
+        for path, content in files.items():
+            data = content.encode()
+            info = tarfile.TarInfo(os.path.join(uncompressed_dir, path))
+            info.size = len(data)
+            info.mode = 0o755 if path == "configure" else 0o644
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+
+    return tarball
+
+
+class SyntheticPackage(Package):
+    """
+    Synthetic package installed without root privileges (it records the time of each stage)
+    """
+    def __init__(self, pkgname, *, pkgver, source, build_path, prefix, **options):
+        super().__init__(pkgname,
+                         pkgver=pkgver,
+                         source=source,
+                         depends={},
+                         makedepends={},
+                         build_path=build_path,
+                         prefix=prefix,
+                         **options)
+        self.timings = {}
+        self.footprint = 64 # MB, synthetic packages are small
+
+    def timed(self, stage, method, *args, **kwargs):
+        start = time.perf_counter()
+        method(*args, **kwargs)
+        self.timings[stage] = time.perf_counter() - start
+
+    def prepare(self, **kwargs):
+        self.timed("prepare", super().prepare, **kwargs)
+
+    def configure_flags(self):
+        return [f"--prefix={self.prefix}"]
+
+    def build(self):
+        def build():
+            self.configure()
+            Bash.exec("make", where=self.objdir)
+        self.timed("build", build)
+
+    def install(self):
+        self.timed("install",
+                   Bash.exec, "make install", where=self.objdir)
+
+    def installed(self):
+        return os.path.isfile(os.path.join(self.prefix, "lib", f"lib{self.pkgname}.a"))
+
+
+class LocalHTTPServer:
+    """
+    Serve a directory through HTTP in a background thread (stand-in of the source mirrors)
+    """
+    def __init__(self, directory:str):
+        class QuietHandler(http.server.SimpleHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+        handler = functools.partial(QuietHandler, directory=directory)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def install_synthetic(pkg_options:dict, installation_options:dict):
+    """
+    Install a synthetic package and return its timings (run in worker processes)
+    """
+    pkg = SyntheticPackage(**pkg_options)
+    start = time.perf_counter()
+    pkg.doall(**installation_options)
+    pkg.timings["doall"] = time.perf_counter() - start
+    pkg.timings["installed"] = pkg.installed()
+    return pkg.pkgname, pkg.timings
+
+
+def run_mode(packages, *, url:str, work_dir:str, cache:str, parallel:bool, jobs:int,
+             out_of_tree:bool = False, tmpfs:str = None):
+    """
+    Install all the synthetic packages in a throwaway build directory and prefix
+    If cache is 'cached' the tarballs are copied to the build directory before (avoid download)
+    """
+    build_path = tempfile.mkdtemp(prefix="build-", dir=work_dir)
+    prefix = tempfile.mkdtemp(prefix="prefix-", dir=work_dir)
+
+    installation_options = {
+        'no_confirm': True,
+        'avoid_download': cache == "cached",
+        'avoid_uncompress': False,
+        'avoid_check': True
+    }
+
+    tasks = []
+    for name, version, tarball in packages:
+        if cache == "cached":
+            shutil.copy(os.path.join(work_dir, "mirror", tarball), build_path)
+        tasks.append({'pkgname': name, 'pkgver': version,
+                      'source': f"{url}/{tarball}",
+                      'build_path': build_path,
+                      'prefix': prefix,
+                      'out_of_tree': out_of_tree,
+                      'tmpfs': tmpfs})
+
+    start = time.perf_counter()
+    if parallel:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            timings = list(executor.map(install_synthetic, tasks,
+                                        [installation_options] * len(tasks)))
+    else:
+        timings = [install_synthetic(task, installation_options) for task in tasks]
+    wall = time.perf_counter() - start
+
+    shutil.rmtree(build_path, ignore_errors=True)
+    shutil.rmtree(prefix, ignore_errors=True)
+
+    return wall, dict(timings)
+
+
+def bench_args():
+    parser = argparse.ArgumentParser(description="Benchmark of the installer pipeline using synthetic packages")
+    parser.add_argument("-n", "--packages", type=int, default=4,
+                        help="Number of synthetic packages")
+    parser.add_argument("--files", type=int, default=50,
+                        help="Number of source files of each package")
+    parser.add_argument("--file-size", dest="file_size", type=int, default=20000,
+                        help="Size (bytes) of each source file")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of repetitions of each mode (the best time is reported)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Number of packages installed at the same time in parallel mode")
+    parser.add_argument("--modes", nargs='*', default=["serial", "parallel"],
+                        choices=["serial", "parallel"],
+                        help="Scheduling modes to benchmark")
+    parser.add_argument("--cache", nargs='*', default=["cold", "cached"],
+                        choices=["cold", "cached"],
+                        help="Source cache modes to benchmark")
+    parser.add_argument("--out-of-tree", dest="out_of_tree", action="store_true",
+                        help="Compile the synthetic packages out of tree")
+    parser.add_argument("--tmpfs", nargs='?', const='/dev/shm', metavar='/dev/shm',
+                        help="Uncompress and compile the synthetic packages in a memory filesystem")
+    parser.add_argument("-o", "--output", default="bench_install.json",
+                        help="File to save the results (JSON)")
+    parser.add_argument("--baseline",
+                        help="Results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Allowed slowdown against the baseline (0.1 = 10%%)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = bench_args()
+
+    work_dir = tempfile.mkdtemp(prefix="hpcluster-bench-")
+    mirror = os.path.join(work_dir, "mirror")
+    os.mkdir(mirror)
+
+    try:
+        print_status(f"Generating {args.packages} synthetic packages ({args.files} files of {args.file_size} bytes)")
+        packages = []
+        for i in range(args.packages):
+            name = f"synthetic{i}"
+            tarball = make_synthetic_tarball(mirror, name, "1.0",
+                                             nfiles=args.files, file_size=args.file_size)
+            packages.append((name, "1.0", tarball))
+
+        results = []
+        with LocalHTTPServer(mirror) as server:
+            for mode in args.modes:
+                for cache in args.cache:
+                    print_status(f"Benchmarking mode: {mode}, {cache}")
+                    best = None
+                    for _ in range(args.repeat):
+                        wall, timings = run_mode(packages, url=server.url, work_dir=work_dir,
+                                                 cache=cache, parallel=(mode == "parallel"),
+                                                 jobs=args.jobs, out_of_tree=args.out_of_tree,
+                                                 tmpfs=args.tmpfs)
+                        if not all(timing["installed"] for timing in timings.values()):
+                            raise Exception(f"Some synthetic packages weren't installed (mode: {mode}, {cache})")
+                        if best is None or wall < best[0]:
+                            best = (wall, timings)
+
+                    wall, timings = best
+                    result = {"mode": mode, "cache": cache, "wall": round(wall, 3)}
+                    for stage in ["prepare", "build", "install"]:
+                        result[stage] = round(sum(timing.get(stage, 0) for timing in timings.values()), 3)
+                    results.append(result)
+
+        print(tabulate([[result["mode"], result["cache"], result["prepare"], result["build"],
+                         result["install"], result["wall"]] for result in results],
+                       headers=["Mode", "Cache", "Prepare (s)", "Build (s)", "Install (s)", "Wall (s)"],
+                       tablefmt="pretty"))
+
+        current = save_results(args.output, "install-pipeline", results,
+                               packages=args.packages, files=args.files,
+                               file_size=args.file_size, jobs=args.jobs,
+                               out_of_tree=args.out_of_tree, tmpfs=args.tmpfs)
+
+        if args.baseline:
+            regressions = compare_results(load_results(args.baseline), current,
+                                          key=["mode", "cache"], metric="wall",
+                                          tolerance=args.tolerance)
+            if regressions:
+                exit(1)
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+#
+# Environment of the installed packages (PATH, LD_LIBRARY_PATH, ...)
+#
+# Each package gets an idempotent script in /etc/profile.d (hpcluster-PKG.sh,
+# rewritten on every install, directories are only added if they aren't in
+# the variable yet) or a modulefile for Lmod/Environment Modules
+# (/etc/modulefiles/PKG/VERSION, loaded with 'module load PKG'). Packages
+# installed in several flavors (e.g. OpenMPI prefixes and profiles) are only
+# available side by side as modulefiles (PKG/VERSION-FLAVOR): every login
+# shell sources all the profile.d scripts, so a package has a single one (the
+# last installed flavor). The blocks appended to ~/.bashrc by previous
+# versions of the installers are removed.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import glob
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from fineprint.status import print_status, print_successful, print_failure
+
+
+profile_dir = "/etc/profile.d"
+modulefiles_dir = "/etc/modulefiles"
+
+# headers of the blocks appended to ~/.bashrc by previous installers
+legacy_headers = [
+    "### exporting john to the PATH",
+    "### exporting openmpi to the PATH",
+    "# Adding PDSH to the PATH"
+]
+
+
+def profile_path(name:str):
+    return os.path.join(profile_dir, f"hpcluster-{name}.sh")
+
+
+def flavor_profiles(name:str):
+    """
+    profile.d scripts of the flavors of a package (hpcluster-PKG-FLAVOR.sh, saved by previous installers)
+    """
+    return glob.glob(os.path.join(profile_dir, f"hpcluster-{name}-*.sh"))
+
+
+def modulefile_path(name:str, version:str, flavor:str = None):
+    return os.path.join(modulefiles_dir, name, f"{version}-{flavor}" if flavor else version)
+
+
+def profile_script(name:str, version:str, *, variables:dict = None, paths:dict = None):
+    """
+    POSIX shell script that exports variables and appends the directories of paths
+    (e.g. {"PATH": ["/usr/local/openmpi/bin"]}) only once, without empty entries
+    """
+    lines = [f"# {name}-{version} environment (generated by hpcluster, don't edit)"]
+    lines += [f"export {variable}=\"{value}\"" for variable, value in (variables or {}).items()]
+    for variable, directories in (paths or {}).items():
+        for directory in directories:
+            lines.append(f"case \":${{{variable}}}:\" in *\":{directory}:\"*) ;; "
+                         f"*) export {variable}=\"${{{variable}:+${variable}:}}{directory}\" ;; esac")
+    return "\n".join(lines) + "\n"
+
+
+def modulefile(name:str, version:str, *, variables:dict = None, paths:dict = None):
+    """
+    Tcl modulefile (Lmod and Environment Modules) of a package
+    """
+    lines = ["#%Module1.0", f"## {name}-{version} (generated by hpcluster)",
+             f"module-whatis \"{name} {version}\"", f"conflict {name}"]
+    lines += [f"setenv {variable} {value}" for variable, value in (variables or {}).items()]
+    lines += [f"append-path {variable} {directory}"
+              for variable, directories in (paths or {}).items() for directory in directories]
+    return "\n".join(lines) + "\n"
+
+
+def install_file(content:str, path:str):
+    from sbash import Bash
+
+    with tempfile.NamedTemporaryFile('w', delete=False) as tmp:
+        tmp.write(content)
+    Bash.exec(f"sudo install -D -m644 {tmp.name} {path}")
+    os.remove(tmp.name)
+
+
+def clean_bashrc(bashrc:str = "~/.bashrc"):
+    """
+    Remove the blocks appended to bashrc by previous installers (a backup is kept in bashrc.hpcluster-DATE)
+    Return the number of removed blocks
+    """
+    bashrc = os.path.expanduser(bashrc)
+    if not os.path.isfile(bashrc):
+        return 0
+
+    with open(bashrc) as bashrc_file:
+        content = bashrc_file.read()
+
+    headers = "|".join(re.escape(header) for header in legacy_headers)
+    block = re.compile(rf"(?:^[ \t]*\n)?^[ \t]*(?:{headers})[ \t]*\n(?:^[ \t]*export [^\n]*\n)*[ \t]*\n?", re.M)
+    cleaned, removed = block.subn("", content)
+    if removed:
+        shutil.copy2(bashrc, f"{bashrc}.hpcluster-{time.strftime('%Y%m%d%H%M%S')}")
+        with open(bashrc, 'w') as bashrc_file:
+            bashrc_file.write(cleaned)
+        print_status(f"{removed} blocks of previous installations were removed from {bashrc}")
+    return removed
+
+
+def export_environ(*, variables:dict = None, paths:dict = None):
+    """
+    Apply the environment to the running process (e.g. to use the package in the next installations)
+    """
+    os.environ.update({variable: str(value) for variable, value in (variables or {}).items()})
+    for variable, directories in (paths or {}).items():
+        entries = [entry for entry in os.environ.get(variable, "").split(":") if entry]
+        entries += [directory for directory in directories if directory not in entries]
+        os.environ[variable] = ":".join(entries)
+
+
+def install_environment(name:str, version:str, *, variables:dict = None, paths:dict = None,
+                        modules:bool = False, flavor:str = None):
+    """
+    Install the environment of a package: a modulefile if modules is enabled (of a flavor,
+    if several flavors are installed side by side), otherwise the profile.d script of the
+    package (the other one and the profile.d scripts of flavors are removed)
+    """
+    from sbash import Bash
+
+    stale = flavor_profiles(name)
+    if modules:
+        path = modulefile_path(name, version, flavor)
+        module = f"{name}/{version}-{flavor}" if flavor else name
+        install_file(modulefile(name, os.path.basename(path), variables=variables, paths=paths), path)
+        stale.append(profile_path(name))
+        print_successful(f"Modulefile of {name} was saved in {path} (module load {module})")
+    else:
+        path = profile_path(name)
+        install_file(profile_script(name, version, variables=variables, paths=paths), path)
+        print_successful(f"Environment of {name} was saved in {path}")
+        if flavor:
+            print_status(f"{path} has only this flavor of {name}, install it with --modules "
+                         "to use several flavors side by side")
+
+    if stale:
+        Bash.exec(f"sudo rm -f {' '.join(stale)}")
+
+    clean_bashrc()
+    export_environ(variables=variables, paths=paths)
+    return path
+
+
+def environment_args():
+    parser = argparse.ArgumentParser(description="Remove the blocks appended to ~/.bashrc by previous installers")
+    parser.add_argument("--bashrc", default="~/.bashrc",
+                        help="bashrc file to clean")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = environment_args()
+
+    try:
+        if not clean_bashrc(args.bashrc):
+            print_successful(f"{args.bashrc} hasn't blocks of previous installations")
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+#
+# Hostlist expressions of Slurm and pdsh (e.g. node[01-03,07],master)
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import re
+
+
+def expand_hostlist(hostlist:str):
+    """
+    Expand a hostlist expression (e.g. node[01-03,07],master) into a list of hostnames
+    """
+    hosts = []
+    for expression in re.findall(r"[^,\[]+(?:\[[^\]]*\])?[^,]*", hostlist):
+        match = re.fullmatch(r"([^\[]*)\[([^\]]+)\](.*)", expression)
+        if not match:
+            hosts.append(expression)
+            continue
+
+        prefix, ranges, suffix = match.groups()
+        for interval in ranges.split(","):
+            if "-" in interval:
+                start, end = interval.split("-")
+                width = len(start)
+                hosts += [f"{prefix}{i:0{width}d}{suffix}" for i in range(int(start), int(end) + 1)]
+            else:
+                hosts.append(f"{prefix}{interval}{suffix}")
+    return hosts
+
+
+def compress_hostlist(hosts):
+    """
+    Compress a list of hostnames into a hostlist expression (e.g. node[01-03,07])
+    """
+    groups = {}
+    singles = []
+    for host in hosts:
+        match = re.fullmatch(r"(.*?)(\d+)", host)
+        if match:
+            prefix, number = match.groups()
+            groups.setdefault((prefix, len(number)), []).append(int(number))
+        else:
+            singles.append(host)
+
+    expressions = []
+    for (prefix, width), numbers in sorted(groups.items()):
+        numbers = sorted(set(numbers))
+        if len(numbers) == 1:
+            expressions.append(f"{prefix}{numbers[0]:0{width}d}")
+            continue
+
+        ranges = []
+        start = previous = numbers[0]
+        for number in numbers[1:] + [None]:
+            if number is not None and number == previous + 1:
+                previous = number
+                continue
+            if start == previous:
+                ranges.append(f"{start:0{width}d}")
+            else:
+                ranges.append(f"{start:0{width}d}-{previous:0{width}d}")
+            start = previous = number
+        expressions.append(f"{prefix}[{','.join(ranges)}]")
+
+    return ",".join(expressions + sorted(singles))
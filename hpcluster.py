@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+#
+# hpcluster: single entry point of the installers and tools
+#
+#   hpcluster PACKAGE [STAGE] -b BUILD_DIR [OPTIONS]   install a package (STAGE: prepare, build or install)
+#   hpcluster TOOL [OPTIONS]                           run a tool (setup, benchmarks, images, ...)
+#   hpcluster zipapp [-o hpcluster.pyz]                bundle hpcluster and its dependencies in a single file
+#
+# Only the module of the selected command is imported (and with it its
+# dependencies), so the other subsystems don't slow down its startup. The
+# zipapp (commands, dependencies installed with pip --target and their
+# bytecode) is copied to the nodes as a single file, e.g. with pdcp, and run
+# there with python3 hpcluster.pyz COMMAND.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import compileall
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipapp
+
+
+# command: (module, description)
+packages = {
+    "munge": ("munge", "Install Munge"),
+    "pdsh": ("pdsh", "Install pdsh"),
+    "pmix": ("pmix", "Install PMIx"),
+    "slurm": ("slurm", "Install Slurm"),
+    "pyslurm": ("pyslurm", "Install PySlurm"),
+    "openmpi": ("openmpi", "Install OpenMPI"),
+    "john": ("john", "Install John the Ripper"),
+    "auto": ("auto_install", "Install all the packages")
+}
+
+tools = {
+    "environment": ("environment", "Remove the environment blocks of previous installers from ~/.bashrc"),
+    "microarch": ("microarch", "CPU microarchitecture levels and artifact store"),
+    "shared-prefix": ("shared_prefix", "Node side of the shared-prefix mode (list, warmup)"),
+    "squashfs": ("squashfs_export", "Export the staged installations as a squashfs image"),
+    "munge-setup": ("munge_setup", "Munge key distribution and thread tuning"),
+    "slurm-conf": ("slurm_conf", "Generate slurm.conf from the hardware of the nodes"),
+    "slurm-plugins": ("slurm_plugins", "Plugin profile of Slurm configuration files"),
+    "slurmdbd": ("slurmdbd", "Slurm accounting (slurmdbd with a tuned MariaDB)"),
+    "slurm-emulate": ("slurm_emulate", "Emulate a Slurm cluster in a single host"),
+    "slurm-bench": ("slurm_bench", "Job submission throughput and scheduling latency benchmark"),
+    "mca-params": ("mca_params", "Generate openmpi-mca-params.conf from the node topology"),
+    "mpi-bench": ("mpi_bench", "MPI microbenchmarks"),
+    "pmix-bench": ("pmix_bench", "PMIx launch wire-up benchmark (time to MPI_Init)"),
+    "pdsh-bench": ("pdsh_bench", "pdsh fan-out benchmark"),
+    "john-bench": ("john_bench", "John the Ripper MPI scaling benchmark"),
+    "john-slurm": ("john_slurm", "John the Ripper session split across a Slurm job array"),
+    "bench-install": ("bench_install", "Benchmark of the installer pipeline")
+}
+
+commands = {**packages, **tools}
+
+# dependencies left out of the zipapp (compiled extensions can't be imported from a zip file)
+zipapp_exclude = ["cython"]
+
+
+def usage():
+    lines = ["usage: hpcluster COMMAND [OPTIONS] (hpcluster COMMAND --help for the options of COMMAND)", ""]
+    for title, group in [("packages", packages), ("tools", tools)]:
+        lines.append(f"{title}:")
+        lines += [f"  {command:<16}{description}" for command, (_, description) in group.items()]
+        lines.append("")
+    lines += ["other:", f"  {'zipapp':<16}Bundle hpcluster and its dependencies in a single file"]
+    return "\n".join(lines)
+
+
+def run_command(command:str, argv):
+    """
+    Run the command line of a module (imported only now) as the command
+    """
+    module, _ = commands[command]
+    sys.argv = [f"hpcluster {command}", *argv]
+    runpy.run_module(module, run_name="__main__", alter_sys=False)
+
+
+def zipapp_requirements(requirements:str):
+    with open(requirements) as requirements_file:
+        names = [line.split("#")[0].strip() for line in requirements_file]
+    return [name for name in names if name and name.lower() not in zipapp_exclude]
+
+
+def build_zipapp(output:str, *, requirements=None, interpreter:str = "/usr/bin/env python3"):
+    """
+    Bundle the modules of hpcluster and their dependencies (installed with pip --target)
+    in an executable zip file. Return its size
+    """
+    from fineprint.status import print_status, print_successful, print_failure
+
+    source = os.path.dirname(os.path.abspath(__file__))
+    if not os.path.isdir(source):
+        raise Exception("The zipapp is built from the hpcluster repository, not from another zipapp")
+
+    work_dir = tempfile.mkdtemp(prefix="hpcluster-zipapp-")
+    try:
+        for name in sorted(os.listdir(source)):
+            if name.endswith(".py"):
+                shutil.copy2(os.path.join(source, name), work_dir)
+
+        if requirements:
+            print_status(f"Installing {', '.join(requirements)} in the zipapp")
+            subprocess.run([sys.executable, "-m", "pip", "install", "--quiet", "--no-compile",
+                            "--target", work_dir, *requirements], check=True)
+            shutil.rmtree(os.path.join(work_dir, "bin"), ignore_errors=True)
+
+        extensions = [os.path.relpath(os.path.join(dirpath, name), work_dir)
+                      for dirpath, _, filenames in os.walk(work_dir)
+                      for name in filenames if name.endswith(".so")]
+        for extension in extensions:
+            print_failure(f"{extension} can't be imported from the zipapp")
+
+        with open(os.path.join(work_dir, "__main__.py"), 'w') as main_file:
+            main_file.write("import sys\nfrom hpcluster import main\nsys.exit(main())\n")
+
+        # bytecode next to the sources (the layout read by zipimport), used by the same python version
+        compileall.compile_dir(work_dir, quiet=1, legacy=True)
+
+        zipapp.create_archive(work_dir, output, interpreter=interpreter, compressed=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    size = os.path.getsize(output)
+    print_successful(f"{output} ({size / 2**20:.1f} MB) was built, run it with: python3 {os.path.basename(output)} COMMAND")
+    return size
+
+
+def zipapp_args(argv):
+    source = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(prog="hpcluster zipapp",
+                                     description="Bundle hpcluster and its dependencies in a single file")
+    parser.add_argument("-o", "--output", default="hpcluster.pyz",
+                        help="Zipapp file")
+    parser.add_argument("-r", "--requirements", default=os.path.join(source, "requirements.txt"),
+                        help="Dependencies to bundle (pip requirements file)")
+    parser.add_argument("--no-deps", dest="no_deps", action="store_true",
+                        help="Don't bundle the dependencies (they are installed in the nodes)")
+    parser.add_argument("--python", default="/usr/bin/env python3",
+                        help="Interpreter of the zipapp")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if not argv or argv[0] in ["-h", "--help"]:
+        print(usage())
+        return 0 if argv else 2
+
+    command, argv = argv[0], argv[1:]
+    if command == "zipapp":
+        args = zipapp_args(argv)
+        try:
+            build_zipapp(args.output, interpreter=args.python,
+                         requirements=None if args.no_deps else zipapp_requirements(args.requirements))
+        except Exception as error:
+            from fineprint.status import print_failure
+            print_failure(error)
+            return 1
+        return 0
+
+    if command not in commands:
+        print(f"hpcluster: unknown command {command}\n\n{usage()}", file=sys.stderr)
+        return 2
+
+    run_command(command, argv)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,18 +10,26 @@
 # Maintainer: glozanoa <glozanoa@uni.pe>
 
 import os
-import distro
-from tabulate import tabulate
-from sbash import Bash
+import shutil
 from fineprint.status import print_status, print_successful, print_failure
 from fineprint.color import ColorStr
 
-from pkg import Package, BuildablePackage
-from linux_requirements import install_requirements
+from pkg import Package, BuildablePackage, install_packages
+
+
+# formats of the training workload of the PGO build (and of the c/s report)
+pgo_formats = ["raw-md5", "nt", "raw-sha256", "raw-sha512", "md5crypt", "sha512crypt", "bcrypt"]
 
 
 class John(Package):
-    def __init__(self, *, pkgver, source, build_path, uncompressed_dir=None):
+    # configurations installed in /usr/share/john (from the run directory)
+    config_files = ["john.conf", "korelogic.conf", "hybrid.conf", "dumb16.conf", "dumb32.conf", "repeats32.conf",
+                    "repeats16.conf", "dynamic.conf", "dynamic_flat_sse_formats.conf", "regex_alphabets.conf",
+                    "password.lst", "ascii.chr", "lm_ascii.chr", "rules"]
+
+    def __init__(self, *, pkgver, source, build_path, uncompressed_dir=None,
+                 pgo:bool = False, formats=None, scaling:bool = False,
+                 mpi_prefix:str = "/usr/local/openmpi", launcher:str = "mpirun", **options):
         depends = {
             "MPI": {"Linux": "https://github.com/fpolit/ama-framework/blob/master/depends/cluster/openmpi.py"},
             "OpenSSL": {"Centos": "openssl-devel.x86_64"}
@@ -38,24 +46,147 @@ class John(Package):
                          depends=depends,
                          makedepends=makedepends,
                          build_path=build_path,
-                         uncompressed_dir=uncompressed_dir)
+                         uncompressed_dir=uncompressed_dir,
+                         **options)
+        self.pgo = pgo # profile-guided (and link-time) optimized build
+        self.formats = formats or pgo_formats
+        self.scaling = scaling # run the MPI scaling benchmark after the installation (see john_bench.py)
+        self.mpi_prefix = mpi_prefix
+        self.launcher = launcher
 
     #def set_prefix(self, prefix):
     #    self.build_path = os.path.abspath(os.path.expanduser(prefix))
     #    self.uncompressed_path = os.path.join(prefix, self.uncompressed_dir)
 
-    def build(self):
-        print_status(f"Building {self.pkgname}-{self.pkgver}")
-        print(ColorStr("It can take a while, so go for a coffee ...").StyleBRIGHT)
+    @property
+    def john(self):
+        return os.path.join(self.uncompressed_path, "run", "john")
+
+    @property
+    def profile_dir(self):
+        return os.path.join(self.uncompressed_path, "pgo-profile")
+
+    def compile(self, *, cflags:str = None, ldflags:str = None, clean:bool = False):
+        from microarch import march
 
         flags = [
             "--with-systemwide",
             "--enable-mpi"
         ]
-
+        if self.microarch is not None: # SIMD of the target microarch instead of the build host
+            flags.append("--disable-native-tests")
+            cflags = f"{cflags or '-O2'} -march={march(self.microarch)}"
+        if cflags:
+            flags.append(f"CFLAGS='{cflags}'")
+        if ldflags:
+            flags.append(f"LDFLAGS='{ldflags}'")
+
+        src = os.path.join(self.uncompressed_path, "src")
+        if clean:
+            self.run_step("make -s clean", where=src)
         configure = "./configure " + " ".join(flags)
-        Bash.exec(configure, where=os.path.join(self.uncompressed_path, "src"))
-        Bash.exec("make", where=os.path.join(self.uncompressed_path, "src"))
+        self.run_step(configure, where=src)
+        self.run_step("make", where=src)
+
+    def benchmark(self):
+        """
+        Candidates/second of each format of the training workload
+        (formats that fail are reported, but at least one of them must report its c/s)
+        """
+        from john_bench import john_speed
+
+        speeds = {}
+        for fmt in self.formats:
+            try:
+                speeds[fmt] = john_speed(self.john, fmt)
+            except Exception as error:
+                print_failure(error)
+                speeds[fmt] = None
+
+        if not any(speeds.values()):
+            raise Exception(f"No format of the training workload reported its c/s ({', '.join(self.formats)})")
+        return speeds
+
+    def install_config(self):
+        """
+        Install the configurations in /usr/share/john, where a --with-systemwide john reads them
+        """
+        from sbash import Bash
+
+        Bash.exec("sudo mkdir -p /usr/share/john")
+        Bash.exec(f"sudo cp -r {' '.join(self.config_files)} /usr/share/john/", where=os.path.join(self.uncompressed_path, "run"))
+
+    def build(self):
+        print_status(f"Building {self.pkgname}-{self.pkgver}")
+        print(ColorStr("It can take a while, so go for a coffee ...").StyleBRIGHT)
+
+        # microarch variants are compiled one by one in the same source tree, so objects aren't reused
+        clean = self.microarch is not None
+        if not self.pgo:
+            self.compile(clean=clean)
+            return
+
+        print_status("Plain build (reference of the PGO build)")
+        self.compile(clean=clean)
+        self.install_config() # john --test needs john.conf
+        plain = self.benchmark()
+
+        print_status("Instrumented build")
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        self.compile(cflags=f"-O2 -fprofile-generate={self.profile_dir}",
+                     ldflags=f"-fprofile-generate={self.profile_dir}", clean=True)
+
+        print_status(f"Training workload: john --test over {', '.join(self.formats)}")
+        self.benchmark()
+
+        print_status("Optimized build (profile and link-time optimization)")
+        self.compile(cflags=f"-O2 -flto -fprofile-use={self.profile_dir} -fprofile-correction -Wno-missing-profile",
+                     ldflags=f"-flto -fprofile-use={self.profile_dir}", clean=True)
+        optimized = self.benchmark()
+
+        self.report(plain, optimized)
+
+    def report(self, plain:dict, optimized:dict):
+        """
+        Report the c/s gain per format of the PGO build against the plain build
+        """
+        from tabulate import tabulate
+        from bench import save_results
+
+        results = []
+        for fmt in self.formats:
+            gain = None
+            if plain.get(fmt) and optimized.get(fmt):
+                gain = round((optimized[fmt] - plain[fmt]) / plain[fmt], 4)
+            results.append({"format": fmt, "plain": plain.get(fmt), "pgo": optimized.get(fmt), "gain": gain})
+
+        print(tabulate([[result["format"], result["plain"], result["pgo"],
+                         f"{result['gain']:+.1%}" if result["gain"] is not None else "-"]
+                        for result in results],
+                       headers=["Format", "Plain (c/s)", "PGO (c/s)", "Gain"], tablefmt="pretty"))
+        save_results(os.path.join(self.build_path, f"{self.pkgname}-{self.pkgver}-pgo.json"),
+                     "john-pgo", results, version=self.pkgver)
+
+    def stage(self):
+        """
+        Stage the run directory (john runs from JOHN_HOME/run) and the configurations
+        """
+        print_status(f"Staging {self.pkgname}-{self.pkgver} in {self.stage_path}")
+        if os.path.isdir(self.stage_path):
+            shutil.rmtree(self.stage_path)
+
+        run = os.path.join(self.uncompressed_path, "run")
+        shutil.copytree(run, self.stage_path + run, symlinks=True)
+        config_dir = os.path.join(self.stage_path, "usr", "share", "john")
+        os.makedirs(config_dir)
+        for name in self.config_files:
+            if os.path.isdir(os.path.join(run, name)):
+                shutil.copytree(os.path.join(run, name), os.path.join(config_dir, name))
+            else:
+                shutil.copy(os.path.join(run, name), config_dir)
+
+    def environment(self):
+        return {"JOHN_HOME": self.uncompressed_path}, {"PATH": [os.path.join(self.uncompressed_path, "run")]}
 
     def install(self):
         """
@@ -64,76 +195,50 @@ class John(Package):
         print_status(f"Installing {self.pkgname}-{self.pkgver}")
         #import pdb; pdb.set_trace()
 
-        Bash.exec("sudo make install", where=os.path.join(self.uncompressed_path, "src"))
+        self.run_step("sudo make install", where=os.path.join(self.uncompressed_path, "src"))
 
         # Configurations
-        Bash.exec("sudo mkdir -p /usr/share/john")
-        Bash.exec("sudo cp john.conf korelogic.conf hybrid.conf dumb16.conf dumb32.conf repeats32.conf repeats16.conf dynamic.conf dynamic_flat_sse_formats.conf regex_alphabets.conf password.lst ascii.chr lm_ascii.chr /usr/share/john/", where=os.path.join(self.uncompressed_path, "run"))
-        Bash.exec("sudo cp -r rules /usr/share/john/", where=os.path.join(self.uncompressed_path, "run"))
+        self.install_config()
 
 
         print_status("Adding john to you PATH")
-        john2path = f"""
-### exporting john to the PATH
-export JOHN_HOME={self.uncompressed_path}
-export PATH=$PATH:$JOHN_HOME/run
-        """
+        self.setup_environment()
 
-        with open(os.path.expanduser("~/.bashrc"), 'a') as bashrc:
-            bashrc.write(john2path)
+        if self.scaling:
+            from bench import save_results
+            from john_bench import scaling_bench, check_scaling
 
-        # exporting John to the PATH
-        john_bin = os.path.join(self.uncompressed_path, "run")
-        os.environ['PATH'] += f":{john_bin}"
+            results = scaling_bench(self.john, self.mpi_prefix, launcher=self.launcher)
+            save_results(os.path.join(self.build_path, f"{self.pkgname}-{self.pkgver}-scaling.json"),
+                         "john-scaling", results, launcher=self.launcher)
+            if check_scaling(results, launcher=self.launcher):
+                print_failure(f"{self.pkgname} doesn't scale with MPI (check the build and the placement of the ranks)")
 
 
 if __name__ == "__main__":
     parser = Package.cmd_parser()
     #parser.add_argument("--prefix", required=True,
     #                    help="Location to install John")
+    parser.add_argument("--pgo", action="store_true",
+                        help="Profile-guided and link-time optimized build (trained with john --test)")
+    parser.add_argument("--formats", default=",".join(pgo_formats),
+                        help="Formats of the training workload and the c/s report (comma separated)")
+    parser.add_argument("--scaling-bench", dest="scaling", action="store_true",
+                        help="Run the MPI scaling benchmark (john --test and a synthetic workload) after the installation")
+    parser.add_argument("--mpi-prefix", dest="mpi_prefix", default="/usr/local/openmpi",
+                        help="Location of OpenMPI (used by the scaling benchmark)")
+    parser.add_argument("--launcher", choices=["mpirun", "srun"], default="mpirun",
+                        help="Launch the scaling benchmark with mpirun or srun --mpi=pmix")
     args = parser.parse_args()
 
     build_path = os.path.abspath(os.path.expanduser(args.build_dir))
-    bpkg = BuildablePackage(name='john', version='1.9.0-Jumbo-1',
-                    source='https://github.com/openwall/john/archive/1.9.0-Jumbo-1.tar.gz',
-                    pkg=John, build_path=args.build_dir, uncompressed_dir='john-1.9.0-Jumbo-1')
-
-
-    pretty_name_distro = distro.os_release_info()['pretty_name']
-    print_status(f"Installing the following packages in {pretty_name_distro}")
-    bpkg_table = [[bpkg.name, bpkg.version, bpkg.source]]
-    print(tabulate(bpkg_table, headers=["Package", "Version", "Source"], tablefmt="pretty"))
-
-    while True:
-            short_answer = input("Proceed with installation? (y/n) ")
-            short_answer = short_answer.lower()
-            if short_answer in ['y', 'yes', 'n', 'no']:
-                if short_answer in ['n', 'no']:
-                    print_failure("Installation was canceled")
-                    exit(1)
-                else:
-                    break
-
-    install_requirements(distro.id(), pkgs=["john"])
-
-    PkgClass = bpkg.pkg
-    pkg = PkgClass(**bpkg.init_options())
-
-    installation_options = { # default installation options
-        'no_confirm': True,
-        'avoid_download': False,
-        'avoid_uncompress': False,
-        'avoid_check': True
-    }
-
-    if args.only_compile:
-        installation_options['avoid_download'] = True
-        installation_options['avoid_uncompress'] = True
-
-    if args.avoid_download:
-        installation_options['avoid_download'] = True
-
-    if args.avoid_uncompress:
-        installation_options['avoid_uncompress'] = True
-
-    pkg.doall(**installation_options)
+    bpkgs = [BuildablePackage(name='john', version='1.9.0-Jumbo-1',
+                              source='https://github.com/openwall/john/archive/1.9.0-Jumbo-1.tar.gz',
+                              pkg=John, build_path=args.build_dir, uncompressed_dir='john-1.9.0-Jumbo-1',
+                              options={'pgo': args.pgo, 'formats': args.formats.split(","),
+                                       'scaling': args.scaling, 'mpi_prefix': args.mpi_prefix,
+                                       'launcher': args.launcher, 'microarch': microarch,
+                                       'artifacts': args.artifacts, 'modules': args.modules})
+             for microarch in (args.microarch or [None])]
+
+    install_packages(bpkgs, args, requirements=["john"], in_tree=True)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+#
+# MPI scaling benchmark of John the Ripper
+#
+# john --test and a fixed synthetic workload (wordlist mode against raw
+# hashes generated with hashlib) are launched with mpirun -np N or srun for
+# increasing N. The candidates/second of each format and the scaling
+# efficiency against the smallest N are reported, so a john built without
+# MPI or an oversubscribed placement shows up as a flat curve.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from fineprint.status import print_status, print_successful, print_failure
+from tabulate import tabulate
+
+from bench import save_results
+from mpi_bench import launch_cmd
+
+
+speed_units = {"": 1, "K": 1e3, "M": 1e6, "G": 1e9}
+
+# formats of the synthetic workload (john format: hashlib algorithm)
+synthetic_formats = {"raw-md5": "md5", "raw-sha1": "sha1", "raw-sha256": "sha256"}
+
+test_formats = ["raw-md5", "nt", "raw-sha256", "sha512crypt", "bcrypt"]
+
+
+def parse_speed(output:str):
+    """
+    Candidates/second (real) of john --test output, e.g. 'Raw:  1234K c/s real, ...'
+    The first speed is used (e.g. 'Many salts'), summed if each MPI rank reports its own
+    """
+    speeds = {}
+    for label, value, unit in re.findall(r"^\s*([^:\n]+):\s*([\d.]+)([KMG]?) c/s real", output, re.M):
+        speeds.setdefault(label, []).append(float(value) * speed_units[unit])
+    if not speeds:
+        return None
+    return sum(next(iter(speeds.values())))
+
+
+def john_speed(john:str, fmt:str, *, seconds:int = 5):
+    """
+    Candidates/second (real) of a format measured by john --test
+    """
+    output = subprocess.run([john, f"--test={seconds}", f"--format={fmt}"],
+                            capture_output=True, text=True)
+    if output.returncode != 0:
+        raise Exception(f"john --test --format={fmt} failed: {(output.stderr or output.stdout).strip()}")
+    return parse_speed(output.stdout)
+
+
+def default_john():
+    john = shutil.which("john")
+    if john is None and "JOHN_HOME" in os.environ:
+        john = os.path.join(os.environ["JOHN_HOME"], "run", "john")
+    return john
+
+
+def synthetic_workload(work_dir:str, fmt:str, *, words:int = 2000000, hashes:int = 100):
+    """
+    Write a wordlist of words candidates and hashes raw hashes of fmt (none of them
+    is in the wordlist, so every run tries the whole wordlist)
+    Return the paths of the wordlist and the hashes
+    """
+    wordlist = os.path.join(work_dir, "words.lst")
+    if not os.path.isfile(wordlist):
+        with open(wordlist, 'w') as wordlist_file:
+            wordlist_file.writelines(f"hpc{index:09d}\n" for index in range(words))
+
+    hashes_path = os.path.join(work_dir, f"{fmt}.hashes")
+    with open(hashes_path, 'w') as hashes_file:
+        for index in range(hashes):
+            digest = hashlib.new(synthetic_formats[fmt], f"missing-{index}".encode()).hexdigest()
+            hashes_file.write(f"{digest}\n")
+
+    return wordlist, hashes_path
+
+
+def run_test(john:str, prefix:str, fmt:str, *, ranks:int, launcher:str = "mpirun", seconds:int = 5):
+    """
+    Candidates/second of john --test with ranks processes
+    """
+    cmd, env = launch_cmd(prefix, launcher, ranks)
+    output = subprocess.run(cmd + [john, f"--test={seconds}", f"--format={fmt}"],
+                            env=env, capture_output=True, text=True, check=True).stdout
+    return parse_speed(output)
+
+
+def run_synthetic(john:str, prefix:str, fmt:str, *, ranks:int, work_dir:str,
+                  launcher:str = "mpirun", words:int = 2000000):
+    """
+    Candidates/second of the synthetic workload (wall time of the whole wordlist) with ranks processes
+    """
+    wordlist, hashes = synthetic_workload(work_dir, fmt, words=words)
+    session = os.path.join(work_dir, f"{fmt}-{launcher}-{ranks}")
+
+    cmd, env = launch_cmd(prefix, launcher, ranks)
+    cmd += [john, f"--format={fmt}", f"--wordlist={wordlist}", f"--pot={session}.pot",
+            f"--session={session}", "--nolog", hashes]
+    start = time.monotonic()
+    subprocess.run(cmd, env=env, capture_output=True, text=True, check=True)
+    return words / (time.monotonic() - start)
+
+
+def scaling_bench(john:str, prefix:str, *, launcher:str = "mpirun", ranks=None, formats=None,
+                  synthetic=None, seconds:int = 5, words:int = 2000000):
+    """
+    Run john --test (formats) and the synthetic workload (synthetic formats) for each number of ranks
+    Return a list of results (workload, format, launcher, ranks, cps, speedup, efficiency)
+    """
+    formats = test_formats if formats is None else formats
+    synthetic = list(synthetic_formats) if synthetic is None else synthetic
+    if ranks is None:
+        ncpus = os.cpu_count() or 1
+        ranks = sorted({1, *[2**i for i in range(1, 10) if 2**i <= ncpus], ncpus})
+
+    work_dir = tempfile.mkdtemp(prefix="hpcluster-john-bench-")
+    try:
+        results = []
+        workloads = [("test", fmt) for fmt in formats] + [("synthetic", fmt) for fmt in synthetic]
+        for workload, fmt in workloads:
+            base = None
+            for nprocs in ranks:
+                print_status(f"john {workload} {fmt} with {nprocs} ranks ({launcher})")
+                if workload == "test":
+                    cps = run_test(john, prefix, fmt, ranks=nprocs, launcher=launcher, seconds=seconds)
+                else:
+                    cps = run_synthetic(john, prefix, fmt, ranks=nprocs, work_dir=work_dir,
+                                        launcher=launcher, words=words)
+                if cps is None:
+                    raise Exception(f"john didn't report the speed of {fmt} (is the format built?)")
+
+                base = base or (nprocs, cps)
+                speedup = cps / base[1]
+                results.append({
+                    "workload": workload,
+                    "format": fmt,
+                    "launcher": launcher,
+                    "ranks": nprocs,
+                    "cps": round(cps, 1),
+                    "speedup": round(speedup, 3),
+                    "efficiency": round(speedup * base[0] / nprocs, 3)
+                })
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def check_scaling(results, *, min_efficiency:float = 0.75, launcher:str = "mpirun"):
+    """
+    Print the scaling curves and return the results whose efficiency is below min_efficiency
+    """
+    ncpus = os.cpu_count() or 1
+    table = []
+    for result in results:
+        note = ""
+        if launcher == "mpirun" and result["ranks"] > ncpus:
+            note = "oversubscribed"
+        if result["efficiency"] < min_efficiency:
+            note = ", ".join(filter(None, [note, "poor scaling"]))
+        table.append([result["workload"], result["format"], result["ranks"], result["cps"],
+                      result["speedup"], f"{result['efficiency']:.0%}", note])
+    print(tabulate(table, headers=["Workload", "Format", "Ranks", "c/s", "Speedup", "Efficiency", ""],
+                   tablefmt="pretty"))
+
+    inefficient = [result for result in results if result["efficiency"] < min_efficiency]
+    for result in inefficient:
+        print_failure(f"john {result['workload']} {result['format']} with {result['ranks']} ranks: "
+                      f"{result['efficiency']:.0%} efficiency")
+    if not inefficient:
+        print_successful(f"john scales with at least {min_efficiency:.0%} efficiency")
+    return inefficient
+
+
+def john_bench_args():
+    parser = argparse.ArgumentParser(description="MPI scaling benchmark of John the Ripper")
+    parser.add_argument("--john", default=default_john(),
+                        help="john binary (default: john in the PATH or $JOHN_HOME/run/john)")
+    parser.add_argument("--prefix", default="/usr/local/openmpi",
+                        help="Location of OpenMPI (mpirun and libraries)")
+    parser.add_argument("--launcher", choices=["mpirun", "srun"], default="mpirun",
+                        help="Launch john with mpirun -np N or srun --mpi=pmix -n N")
+    parser.add_argument("-n", "--ranks", type=int, nargs="+",
+                        help="Numbers of ranks (default: 1 up to the number of CPUs)")
+    parser.add_argument("--formats", default=",".join(test_formats),
+                        help="Formats of john --test (comma separated, empty to skip)")
+    parser.add_argument("--synthetic", default=",".join(synthetic_formats),
+                        help=f"Formats of the synthetic workload ({', '.join(synthetic_formats)}; empty to skip)")
+    parser.add_argument("--seconds", type=int, default=5,
+                        help="Duration of each john --test")
+    parser.add_argument("--words", type=int, default=2000000,
+                        help="Candidates of the synthetic workload")
+    parser.add_argument("--min-efficiency", dest="min_efficiency", type=float, default=0.75,
+                        help="Fail if the scaling efficiency is below this value")
+    parser.add_argument("-o", "--output",
+                        help="File to save the results (JSON)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = john_bench_args()
+
+    try:
+        if args.john is None:
+            raise Exception("john wasn't found (use --john)")
+
+        synthetic = [fmt for fmt in args.synthetic.split(",") if fmt]
+        unknown = set(synthetic) - set(synthetic_formats)
+        if unknown:
+            raise Exception(f"Unsupported synthetic formats: {', '.join(unknown)}")
+
+        results = scaling_bench(args.john, args.prefix, launcher=args.launcher, ranks=args.ranks,
+                                formats=[fmt for fmt in args.formats.split(",") if fmt],
+                                synthetic=synthetic, seconds=args.seconds, words=args.words)
+        if args.output:
+            save_results(args.output, "john-scaling", results, john=args.john, launcher=args.launcher)
+
+        if check_scaling(results, min_efficiency=args.min_efficiency, launcher=args.launcher):
+            exit(1)
+
+    except subprocess.CalledProcessError as error:
+        print_failure(f"{' '.join(error.cmd)} failed: {error.stderr}")
+        exit(1)
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
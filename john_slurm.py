@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+#
+# Split a John the Ripper session across the cluster with a Slurm job array
+#
+# Each task of the array runs john with --node=MIN-MAX/TOTAL (and --fork
+# with the CPUs of the task), so the wordlist or keyspace is split in
+# balanced shards. Sessions, pot files and logs of the tasks are kept in a
+# (shared) session directory: pot files are merged and the progress of the
+# tasks is reported while they run, and a relaunch resumes the unfinished
+# tasks from their john session files (.rec).
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import glob
+import json
+import os
+import re
+import shlex
+import subprocess
+import time
+
+from fineprint.status import print_status, print_successful, print_failure
+from tabulate import tabulate
+
+from john_bench import default_john
+from slurm_bench import import_pyslurm, finished_states
+
+
+def state_path(session_dir:str):
+    return os.path.join(session_dir, "state.json")
+
+
+def task_session(session_dir:str, task):
+    return os.path.join(session_dir, f"task-{task}")
+
+
+def load_state(session_dir:str):
+    with open(state_path(session_dir)) as state_file:
+        return json.load(state_file)
+
+
+def save_state(session_dir:str, state:dict):
+    with open(state_path(session_dir), 'w') as state_file:
+        json.dump(state, state_file, indent=2)
+
+
+def task_script(state:dict):
+    """
+    Shell script of the array tasks: restore the john session of the task if it exists
+    (.rec file), otherwise start its shard. A task is done when john removes its .rec file
+    """
+    cpus, total = state["cpus_per_task"], state["tasks"] * state["cpus_per_task"]
+    session = shlex.quote(state["session_dir"]) + "/task-$SLURM_ARRAY_TASK_ID"
+    first = "$((SLURM_ARRAY_TASK_ID * CPUS + 1))"
+    node = f"{first}/{total}" if cpus == 1 else f"{first}-$((SLURM_ARRAY_TASK_ID * CPUS + CPUS))/{total}"
+    fork = f" --fork={cpus}" if cpus > 1 else ""
+    john = shlex.quote(state["john"])
+    mode = " ".join(shlex.quote(arg) for arg in state["john_args"])
+
+    return (f"CPUS={cpus}; S={session}; "
+            f"if [ -f $S.rec ]; then {john} --restore=$S; "
+            f"else {john} --session=$S --pot=$S.pot --node={node}{fork} {mode} {shlex.quote(state['hashes'])}; fi "
+            f"&& [ ! -f $S.rec ] && touch $S.done")
+
+
+def unfinished_tasks(state:dict):
+    return [task for task in range(state["tasks"])
+            if not os.path.isfile(f"{task_session(state['session_dir'], task)}.done")]
+
+
+def submit(pyslurm, state:dict, tasks):
+    """
+    Submit the tasks as a job array. Return the job id
+    """
+    options = {
+        'wrap': task_script(state),
+        'job_name': state["name"],
+        'output': os.path.join(state["session_dir"], "task-%a.out"),
+        'array_inx': ",".join(map(str, tasks)),
+        'cpus_per_task': state["cpus_per_task"]
+    }
+    if state.get("partition"):
+        options['partition'] = state["partition"]
+
+    job_id = pyslurm.job().submit_batch_job(options)
+    state["job_ids"].append(job_id)
+    save_state(state["session_dir"], state)
+    print_successful(f"Job array {job_id} submitted ({len(tasks)} tasks of {state['cpus_per_task']} CPUs)")
+    return job_id
+
+
+def merge_pots(session_dir:str):
+    """
+    Append the new cracked hashes of the tasks pot files to the session pot (john.pot)
+    Return the new cracked lines
+    """
+    merged = os.path.join(session_dir, "john.pot")
+    cracked = set()
+    if os.path.isfile(merged):
+        with open(merged, errors="replace") as pot:
+            cracked = set(pot.read().splitlines())
+
+    new = []
+    for path in sorted(glob.glob(os.path.join(session_dir, "task-*.pot"))):
+        with open(path, errors="replace") as pot:
+            for line in pot.read().splitlines():
+                if line and line not in cracked:
+                    cracked.add(line)
+                    new.append(line)
+
+    if new:
+        with open(merged, 'a') as pot:
+            pot.writelines(f"{line}\n" for line in new)
+    return new
+
+
+def task_progress(john:str, session:str):
+    """
+    Progress (%) of a john session according to john --status (None if unknown)
+    """
+    if not os.path.isfile(f"{session}.rec"):
+        return None
+    status = subprocess.run([john, f"--status={session}"], capture_output=True, text=True)
+    match = re.search(r"([\d.]+)%", status.stdout + status.stderr)
+    return float(match.group(1)) if match else None
+
+
+def array_states(pyslurm, job_ids):
+    """
+    State of the tasks of the job arrays (task: state), pending tasks aren't split yet
+    """
+    states = {}
+    for info in pyslurm.job().get().values():
+        if info.get('array_job_id') not in job_ids and info.get('job_id') not in job_ids:
+            continue
+        if info.get('array_task_id') is not None and info.get('array_task_str') is None:
+            states[info['array_task_id']] = info['job_state']
+        elif info.get('array_task_str'):
+            states[info['array_task_str']] = info['job_state']
+    return states
+
+
+def follow(pyslurm, state:dict, *, poll:float = 30):
+    """
+    Merge the pot files and report the status of the tasks until every task leaves the queue
+    Return the unfinished tasks
+    """
+    session_dir = state["session_dir"]
+    last_status = None
+    while True:
+        states = array_states(pyslurm, state["job_ids"])
+        for line in merge_pots(session_dir):
+            print_successful(f"Cracked: {line}")
+
+        table = []
+        for task in range(state["tasks"]):
+            session = task_session(session_dir, task)
+            if os.path.isfile(f"{session}.done"):
+                table.append([task, "DONE", "100%"])
+            elif task in states:
+                progress = task_progress(state["john"], session)
+                table.append([task, states[task], "-" if progress is None else f"{progress:.2f}%"])
+        table += [[tasks, job_state, "-"] for tasks, job_state in states.items() if isinstance(tasks, str)]
+
+        if table != last_status:
+            print(tabulate(table, headers=["Task", "State", "Progress"], tablefmt="pretty"))
+            last_status = table
+
+        if all(job_state in finished_states for job_state in states.values()):
+            break
+        time.sleep(poll)
+
+    for line in merge_pots(session_dir):
+        print_successful(f"Cracked: {line}")
+    return unfinished_tasks(state)
+
+
+def john_slurm_args():
+    parser = argparse.ArgumentParser(description="Split a John the Ripper session across the cluster with a Slurm job array")
+    parser.add_argument("hashes", nargs="?",
+                        help="File of hashes (in a shared filesystem)")
+    parser.add_argument("-d", "--session-dir", dest="session_dir", required=True,
+                        help="Directory of the sessions, pot files and logs of the tasks (in a shared filesystem)")
+    parser.add_argument("-N", "--tasks", type=int, default=4,
+                        help="Number of tasks of the job array")
+    parser.add_argument("-c", "--cpus-per-task", dest="cpus_per_task", type=int, default=1,
+                        help="CPUs of each task (john --fork)")
+    parser.add_argument("-p", "--partition",
+                        help="Partition where the tasks are submitted")
+    parser.add_argument("--john", default=default_john() or "john",
+                        help="john binary, the same path in every node (default: john in the PATH or $JOHN_HOME/run/john)")
+    parser.add_argument("--format",
+                        help="Format of the hashes")
+    parser.add_argument("--wordlist",
+                        help="Wordlist mode (in a shared filesystem)")
+    parser.add_argument("--rules",
+                        help="Rules of the wordlist mode")
+    parser.add_argument("--mask",
+                        help="Mask mode (e.g. ?u?l?l?l?d?d)")
+    parser.add_argument("--incremental", nargs="?", const="",
+                        help="Incremental mode (optionally its name)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resubmit the unfinished tasks of the session directory (restored from their .rec files)")
+    parser.add_argument("--follow", action="store_true",
+                        help="Only follow the submitted tasks (merge pot files and report their status)")
+    parser.add_argument("--poll", type=float, default=30,
+                        help="Seconds between status updates")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = john_slurm_args()
+
+    try:
+        session_dir = os.path.abspath(os.path.expanduser(args.session_dir))
+
+        if args.resume or args.follow:
+            state = load_state(session_dir)
+        else:
+            if args.hashes is None:
+                raise Exception("A file of hashes is required to start a session")
+            if os.path.isfile(state_path(session_dir)):
+                raise Exception(f"{session_dir} has a session already (use --resume or --follow)")
+
+            john_args = []
+            if args.format:
+                john_args.append(f"--format={args.format}")
+            if args.wordlist:
+                john_args.append(f"--wordlist={os.path.abspath(args.wordlist)}")
+                if args.rules:
+                    john_args.append(f"--rules={args.rules}")
+            if args.mask:
+                john_args.append(f"--mask={args.mask}")
+            if args.incremental is not None:
+                john_args.append(f"--incremental={args.incremental}" if args.incremental else "--incremental")
+            if len(john_args) - bool(args.format) != 1:
+                raise Exception("Select one mode: --wordlist, --mask or --incremental")
+
+            os.makedirs(session_dir, exist_ok=True)
+            state = {
+                "name": f"john-{os.path.basename(session_dir)}",
+                "session_dir": session_dir,
+                "hashes": os.path.abspath(args.hashes),
+                "john": args.john,
+                "john_args": john_args,
+                "tasks": args.tasks,
+                "cpus_per_task": args.cpus_per_task,
+                "partition": args.partition,
+                "job_ids": []
+            }
+            save_state(session_dir, state)
+
+        pyslurm = import_pyslurm()
+        if not args.follow:
+            tasks = unfinished_tasks(state)
+            if not tasks:
+                print_successful(f"Every task of {session_dir} is done")
+                exit(0)
+            submit(pyslurm, state, tasks)
+
+        unfinished = follow(pyslurm, state, poll=args.poll)
+        if unfinished:
+            print_failure(f"Unfinished tasks: {', '.join(map(str, unfinished))} "
+                          f"(resume them with --resume -d {session_dir})")
+            exit(1)
+        print_successful(f"Every task is done, cracked hashes are in {os.path.join(session_dir, 'john.pot')}")
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
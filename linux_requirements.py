@@ -8,7 +8,6 @@
 # Maintainer: glozanoa <glozanoa@uni.pe>
 
 from typing import List
-from sbash import Bash
 from fineprint.status import print_status
 
 requirements = {
@@ -45,6 +44,33 @@ requirements = {
     },
 }
 
+# requirements of optional features, only installed when they're asked for (pkgs of install_requirements)
+optional_requirements = {
+    'centos':{
+        "pdsh-genders": ["libgenders-devel.x86_64"], # pdsh --with genders
+        "pdsh-bench": ["openssh-server.x86_64"], # pdsh --bench
+        "slurmdbd": ["mariadb-server.x86_64"], # slurm --accounting
+        "squashfs": ["squashfs-tools.x86_64"] # squashfs_export
+    },
+    'kali':{
+        'pdsh-genders': ['libgenders0-dev'],
+        'pdsh-bench': ['openssh-server'],
+        'slurmdbd': ['mariadb-server'],
+        'squashfs': ['squashfs-tools']
+    },
+    'ubuntu':{
+        'pdsh-genders': ['libgenders0-dev'],
+        'pdsh-bench': ['openssh-server'],
+        'slurmdbd': ['mariadb-server'],
+        'squashfs': ['squashfs-tools']
+    },
+    'arch':{
+        "pdsh-bench": ['openssh'],
+        "slurmdbd": ['mariadb'],
+        "squashfs": ['squashfs-tools']
+    },
+}
+
 build_requirements = {
     'centos':{
         'group': ["'Development Tools'"],
@@ -64,6 +90,8 @@ build_requirements = {
 def install_requirements(distro_id, *, pkgs :List[str] = None, 
                         avoid_build_requirements:bool = False,
                         only_build_requirements:bool = False):
+    from sbash import Bash
+
     #import pdb; pdb.set_trace()
     if not avoid_build_requirements:
         print_status("Installing build requirements")
@@ -88,6 +116,7 @@ def install_requirements(distro_id, *, pkgs :List[str] = None,
         os_requirements = requirements[distro_id]
         pkgs_requirements = {}
         if pkgs:
+            os_requirements = {**os_requirements, **optional_requirements[distro_id]}
             for pkg in pkgs:
                 if pkg in os_requirements:
                     pkgs_requirements[pkg] = os_requirements[pkg]
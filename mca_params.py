@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+#
+# Generate openmpi-mca-params.conf from the node topology and interconnect
+#
+# Binding and mapping policy, transports (pml/btl/mtl), eager limits and the
+# collective components are selected from the detected hardware and the
+# components built in OpenMPI. With calibration, the shared-memory
+# parameters are chosen among candidate values running the microbenchmarks
+# of mpi_bench.py.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import ipaddress
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+
+from sbash import Bash
+from fineprint.status import print_status, print_successful, print_failure
+from tabulate import tabulate
+
+from mpi_bench import compile_bench, run_bench
+from slurm_conf import discover_node
+
+
+# values tried by calibrate (the first one is the default of OpenMPI)
+calibration_candidates = {
+    "btl_vader_eager_limit": [4096, 8192, 16384, 32768],
+    "btl_vader_single_copy_mechanism": ["cma", "none"]
+}
+
+virtual_interfaces = ("lo", "docker", "virbr", "veth", "br-", "tun", "tap")
+
+
+def detect_interconnect():
+    """
+    Detect the interconnect of this node: omnipath, infiniband or ethernet
+    Return the interconnect and the ethernet interfaces that are up
+    """
+    devices = os.listdir("/sys/class/infiniband") if os.path.isdir("/sys/class/infiniband") else []
+    if any(device.startswith("hfi1") for device in devices):
+        interconnect = "omnipath"
+    elif devices:
+        interconnect = "infiniband"
+    else:
+        interconnect = "ethernet"
+
+    interfaces = []
+    for interface in sorted(os.listdir("/sys/class/net")):
+        if interface.startswith(virtual_interfaces):
+            continue
+        try:
+            with open(f"/sys/class/net/{interface}/operstate") as operstate:
+                if operstate.read().strip() == "up":
+                    interfaces.append(interface)
+        except OSError:
+            pass
+
+    return interconnect, interfaces
+
+
+def interface_networks(interfaces):
+    """
+    IPv4 networks (CIDR, e.g. 10.0.0.0/24) of the interfaces. Unlike the names of the
+    interfaces, they are the same in all the nodes, so they can go in a shared prefix
+    """
+    output = subprocess.run(["ip", "-o", "-4", "addr", "show"], capture_output=True, text=True).stdout
+    networks = []
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) > 3 and fields[1] in interfaces and fields[2] == "inet":
+            network = str(ipaddress.ip_interface(fields[3]).network)
+            if network not in networks:
+                networks.append(network)
+    return networks
+
+
+def mca_parameters(topology:dict, interconnect:str, *, networks=None, components=None, mechanisms=None):
+    """
+    MCA parameters for the topology (see slurm_conf.parse_topology) and interconnect
+    networks: IPv4 networks used by btl/tcp (see interface_networks)
+    components: components built in OpenMPI (FRAMEWORK/NAME, see openmpi.ompi_components)
+    mechanisms: single-copy mechanisms of btl/vader (see openmpi.single_copy_mechanisms)
+    """
+    components = components or set()
+    mechanisms = mechanisms or set()
+
+    # one rank per core, ranks of a node packed by core (no binding if there is a single core)
+    cores = topology.get("sockets", 1) * topology.get("cores_per_socket", 1)
+    parameters = {
+        "rmaps_base_mapping_policy": "core",
+        "rmaps_base_ranking_policy": "core",
+        "hwloc_base_binding_policy": "core" if cores > 1 else "none"
+    }
+    if interconnect == "omnipath" and "mtl/psm2" in components:
+        parameters.update({"pml": "cm", "mtl": "psm2"})
+    elif interconnect == "infiniband" and "pml/ucx" in components:
+        parameters.update({"pml": "ucx", "btl": "^openib", "osc": "ucx"})
+    else:
+        parameters.update({"pml": "ob1", "btl": "self,vader,tcp"})
+        if networks:
+            parameters["btl_tcp_if_include"] = ",".join(networks)
+
+    # shared memory: single copy for large messages, eager limit of small ones
+    parameters["btl_vader_single_copy_mechanism"] = "cma" if "cma" in mechanisms else "none"
+    parameters["btl_vader_eager_limit"] = calibration_candidates["btl_vader_eager_limit"][0]
+    if parameters.get("pml") == "ob1":
+        parameters["btl_tcp_eager_limit"] = 65536
+
+    # hcoll/fca only help with their interconnect (and they are slow to initialize)
+    excluded = [name for name in ["hcoll", "fca"] if f"coll/{name}" in components]
+    if interconnect == "infiniband" and "coll/hcoll" in components:
+        excluded.remove("hcoll")
+    if excluded:
+        parameters["coll"] = "^" + ",".join(excluded)
+
+    return parameters
+
+
+def mca_conf(parameters:dict, *, description:str = ""):
+    lines = ["# openmpi-mca-params.conf generated by hpcluster"]
+    if description:
+        lines.append(f"# {description}")
+    lines += [f"{name} = {value}" for name, value in parameters.items()]
+    return "\n".join(lines) + "\n"
+
+
+def score(results):
+    """
+    Geometric mean of the latencies (every message size has the same weight)
+    """
+    latencies = [result["latency_us"] for result in results if result["latency_us"] > 0]
+    return math.exp(sum(math.log(latency) for latency in latencies) / len(latencies))
+
+
+def calibrate(prefix:str, parameters:dict, *, candidates:dict = None, launcher:str = "mpirun",
+              max_size:int = 1 << 20, iterations:int = 200, repeat:int = 2):
+    """
+    Choose each parameter among its candidates running a short local benchmark
+    (ping-pong and bandwidth with 2 ranks, best of repeat runs). Return the calibrated parameters
+    """
+    candidates = candidates or calibration_candidates
+    if parameters.get("pml") != "ob1": # shared memory is handled by UCX or PSM2
+        candidates = {name: values for name, values in candidates.items() if not name.startswith("btl_vader")}
+    if parameters.get("btl_vader_single_copy_mechanism") == "none":
+        candidates = {name: values for name, values in candidates.items()
+                      if name != "btl_vader_single_copy_mechanism"}
+
+    parameters = dict(parameters)
+    work_dir = tempfile.mkdtemp(prefix="hpcluster-mca-")
+    try:
+        binary = compile_bench(prefix, work_dir)
+        table = []
+        for name, values in candidates.items():
+            scores = {}
+            for value in values:
+                mca = {**parameters, name: value}
+                scores[value] = min(score(run_bench(binary, prefix, ranks=2, tests=["pingpong", "bandwidth"],
+                                                    launcher=launcher, max_size=max_size,
+                                                    iterations=iterations, mca=mca))
+                                    for _ in range(repeat))
+                table.append([name, value, f"{scores[value]:.3f}"])
+
+            parameters[name] = min(scores, key=scores.get)
+            print_status(f"Calibrated {name} = {parameters[name]}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(tabulate(table, headers=["Parameter", "Value", "Latency (geomean us)"], tablefmt="pretty"))
+    return parameters
+
+
+def install_mca_conf(prefix:str, parameters:dict, *, description:str = ""):
+    """
+    Install $prefix/etc/openmpi-mca-params.conf
+    """
+    path = os.path.join(prefix, "etc", "openmpi-mca-params.conf")
+    with tempfile.NamedTemporaryFile('w', suffix=".conf", delete=False) as conf:
+        conf.write(mca_conf(parameters, description=description))
+    Bash.exec(f"sudo install -D -m644 {conf.name} {path}")
+    os.remove(conf.name)
+    print_successful(f"MCA parameters were saved in {path}")
+    return path
+
+
+def tune_openmpi(prefix:str, *, components=None, mechanisms=None,
+                 calibration:bool = False, launcher:str = "mpirun"):
+    """
+    Generate and install the MCA parameters of an OpenMPI installation in this node
+    """
+    topology = discover_node("localhost")
+    interconnect, interfaces = detect_interconnect()
+    parameters = mca_parameters(topology, interconnect, networks=interface_networks(interfaces),
+                                components=components, mechanisms=mechanisms)
+    if calibration:
+        parameters = calibrate(prefix, parameters, launcher=launcher)
+
+    description = (f"{topology['sockets']} sockets, {topology['cores_per_socket']} cores per socket, "
+                   f"{topology['threads_per_core']} threads per core, {topology['numa_nodes']} NUMA nodes, "
+                   f"{interconnect}{' (calibrated)' if calibration else ''}")
+    install_mca_conf(prefix, parameters, description=description)
+    return parameters
+
+
+def mca_params_args():
+    parser = argparse.ArgumentParser(description="Generate openmpi-mca-params.conf from the node topology")
+    parser.add_argument("--prefix", default="/usr/local/openmpi",
+                        help="Location of OpenMPI")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="Choose the shared-memory parameters running a short local benchmark")
+    parser.add_argument("--launcher", choices=["mpirun", "srun"], default="mpirun",
+                        help="Launch the calibration benchmark with mpirun or srun --mpi=pmix")
+    parser.add_argument("--print", dest="print_only", action="store_true",
+                        help="Only print the parameters (don't install them)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from openmpi import ompi_components, single_copy_mechanisms
+
+    args = mca_params_args()
+
+    try:
+        ompi_info = os.path.join(args.prefix, "bin", "ompi_info")
+        components = ompi_components(ompi_info)
+        mechanisms = single_copy_mechanisms(ompi_info)
+
+        if args.print_only:
+            interconnect, interfaces = detect_interconnect()
+            parameters = mca_parameters(discover_node("localhost"), interconnect,
+                                        networks=interface_networks(interfaces),
+                                        components=components, mechanisms=mechanisms)
+            if args.calibrate:
+                parameters = calibrate(args.prefix, parameters, launcher=args.launcher)
+            print(mca_conf(parameters, description=interconnect), end="")
+        else:
+            tune_openmpi(args.prefix, components=components, mechanisms=mechanisms,
+                         calibration=args.calibrate, launcher=args.launcher)
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+#
+# CPU microarchitecture levels and per-microarch build variants
+#
+# The level of a node (x86-64 psABI levels: x86-64, x86-64-v2, v3 and v4)
+# is detected from the flags of /proc/cpuinfo. Packages built with
+# --microarch LEVEL... are compiled once per level (-march) and, with
+# --artifacts DIR, their staged installations are kept in an artifact store:
+#   DIR/PKGNAME-PKGVER/LEVEL/root           staged files (all the prefixes)
+#   DIR/PKGNAME-PKGVER/LEVEL/manifest.json  flavors, host, date and node setup
+# Each node installs the best variant it can run (microarch.py install).
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import json
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import time
+
+from fineprint.status import print_status, print_successful, print_failure
+
+
+# levels (ascending): flags of /proc/cpuinfo added by the level and -march of compilers without psABI levels
+microarch_levels = [
+    ("x86-64", ["lm", "cmov", "cx8", "fpu", "fxsr", "mmx", "syscall", "sse", "sse2"], "x86-64"),
+    ("x86-64-v2", ["cx16", "lahf_lm", "popcnt", "pni", "sse4_1", "sse4_2", "ssse3"], "nehalem"),
+    ("x86-64-v3", ["avx", "avx2", "bmi1", "bmi2", "f16c", "fma", "abm", "movbe", "xsave"], "haswell"),
+    ("x86-64-v4", ["avx512f", "avx512bw", "avx512cd", "avx512dq", "avx512vl"], "skylake-avx512")
+]
+
+level_names = [name for name, _, _ in microarch_levels]
+
+microarch_cmd = "grep -m1 '^flags' /proc/cpuinfo"
+
+
+def cpu_flags(node:str = "localhost", *, ssh_args:str = "-o BatchMode=yes -o ConnectTimeout=10"):
+    """
+    Flags of /proc/cpuinfo of a node (locally if node is this host, otherwise through ssh)
+    """
+    if node in ["localhost", platform.node(), platform.node().split(".")[0]]:
+        cmd = ["sh", "-c", microarch_cmd]
+    else:
+        cmd = ["ssh", *ssh_args.split(), node, microarch_cmd]
+
+    output = subprocess.run(cmd, capture_output=True, text=True, timeout=60).stdout
+    return set(output.split(":", 1)[1].split()) if ":" in output else set()
+
+
+def detect_microarch(flags=None):
+    """
+    Highest level supported by the CPU flags (default: flags of this host)
+    None if the CPU isn't x86-64
+    """
+    flags = cpu_flags() if flags is None else flags
+    detected = None
+    required = set()
+    for name, level_flags, _ in microarch_levels:
+        required.update(level_flags)
+        if not required <= flags:
+            break
+        detected = name
+    return detected
+
+
+def can_run(microarch:str, host_microarch:str):
+    """
+    Check if a variant (None: generic build) runs in a host of host_microarch
+    """
+    if microarch is None:
+        return True
+    if host_microarch is None:
+        return False
+    return level_names.index(microarch) <= level_names.index(host_microarch)
+
+
+def best_variant(variants, host_microarch:str):
+    """
+    Best variant (microarch level or None for a generic build) that runs in the host
+    """
+    runnable = [variant for variant in variants if can_run(variant, host_microarch)]
+    if not runnable:
+        return False
+    return max(runnable, key=lambda variant: -1 if variant is None else level_names.index(variant))
+
+
+def march(microarch:str, *, cc:str = "gcc"):
+    """
+    -march of a level (compilers without psABI levels, e.g. gcc < 11, use an equivalent CPU)
+    """
+    fallback = dict((name, cpu) for name, _, cpu in microarch_levels)[microarch]
+    supported = subprocess.run([cc, f"-march={microarch}", "-E", "-x", "c", os.devnull, "-o", os.devnull],
+                               capture_output=True).returncode == 0
+    return microarch if supported else fallback
+
+
+def microarch_flags(flags, microarch:str):
+    """
+    Add -march of microarch to the compiler flags of a configure command line
+    (CFLAGS='...', CXXFLAGS='...' and FCFLAGS='...' are extended or added)
+    """
+    option = f"-march={march(microarch)}"
+    flags = list(flags)
+    for variable in ["CFLAGS", "CXXFLAGS", "FCFLAGS"]:
+        for index, flag in enumerate(flags):
+            if flag.startswith(f"{variable}="):
+                value = flag.split("=", 1)[1].strip("'\"")
+                flags[index] = f"{variable}='{value} {option}'"
+                break
+        else:
+            flags.append(f"{variable}='-O2 {option}'")
+    return flags
+
+
+def select_variants(pkgs, host_microarch:str = None):
+    """
+    Packages to install in this host: for each flavor (prefix and configure flags) of
+    the packages the best variant that runs in this host
+    """
+    host_microarch = detect_microarch() if host_microarch is None else host_microarch
+    groups = {}
+    for pkg in pkgs:
+        groups.setdefault((pkg.pkgname, str(pkg.prefix), tuple(pkg.configure_flags())), []).append(pkg)
+
+    selected = []
+    for variants in groups.values():
+        best = best_variant([pkg.microarch for pkg in variants], host_microarch)
+        selected += [pkg for pkg in variants if pkg.microarch == best]
+    return selected
+
+
+def artifact_path(store:str, pkgname:str, pkgver:str, microarch:str = None):
+    return os.path.join(store, f"{pkgname}-{pkgver}", microarch or "generic")
+
+
+def store_artifact(pkg, store:str):
+    """
+    Add the staged installation of a package (see Package.stage) to the artifact store
+    The staged files of the flavors (prefixes) of the same microarch share the variant
+    """
+    path = artifact_path(store, pkg.pkgname, pkg.pkgver, pkg.microarch)
+    manifest_path = os.path.join(path, "manifest.json")
+    manifest = {"pkgname": pkg.pkgname, "pkgver": pkg.pkgver, "microarch": pkg.microarch,
+                "flavors": {}, "node_setup": []}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+
+    shutil.copytree(pkg.stage_path, os.path.join(path, "root"), symlinks=True, dirs_exist_ok=True)
+    manifest["flavors"][pkg.flavor()] = {"prefix": pkg.prefix, "host": platform.node(),
+                                         "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+    manifest["node_setup"] += [cmd for cmd in pkg.node_setup() if cmd not in manifest["node_setup"]]
+
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    print_successful(f"{pkg.pkgname}-{pkg.pkgver} ({pkg.microarch or 'generic'}) was saved in {path}")
+    return path
+
+
+def stored_variants(store:str, pkgname:str, pkgver:str):
+    """
+    Variants (microarch level or None for a generic build) of a package in the artifact store
+    """
+    path = os.path.join(store, f"{pkgname}-{pkgver}")
+    if not os.path.isdir(path):
+        return []
+    return [None if name == "generic" else name for name in sorted(os.listdir(path))
+            if os.path.isfile(os.path.join(path, name, "manifest.json"))]
+
+
+def install_artifact(store:str, pkgname:str, pkgver:str, *, host_microarch:str = None):
+    """
+    Install in this node the best variant of a package it can run, then run its node setup
+    """
+    from sbash import Bash
+
+    host_microarch = detect_microarch() if host_microarch is None else host_microarch
+    best = best_variant(stored_variants(store, pkgname, pkgver), host_microarch)
+    if best is False:
+        raise Exception(f"{store} hasn't a variant of {pkgname}-{pkgver} for {host_microarch or platform.machine()}")
+
+    path = artifact_path(store, pkgname, pkgver, best)
+    print_status(f"Installing {pkgname}-{pkgver} ({best or 'generic'}) from {path}")
+    Bash.exec(f"sudo cp -a {os.path.join(path, 'root')}/. /")
+
+    with open(os.path.join(path, "manifest.json")) as manifest_file:
+        manifest = json.load(manifest_file)
+    for cmd in manifest["node_setup"]:
+        Bash.exec(f"sudo sh -c {shlex.quote(cmd)}")
+
+    print_successful(f"{pkgname}-{pkgver} ({best or 'generic'}) was installed")
+    return best
+
+
+def microarch_args():
+    parser = argparse.ArgumentParser(description="CPU microarchitecture levels and per-microarch build variants")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    detect_parser = subparsers.add_parser("detect", help="Microarch level of the nodes")
+    detect_parser.add_argument("nodes", nargs="*", default=["localhost"],
+                               help="Nodes (through ssh)")
+
+    list_parser = subparsers.add_parser("list", help="Variants in the artifact store")
+    list_parser.add_argument("--artifacts", required=True,
+                             help="Artifact store")
+
+    install_parser = subparsers.add_parser("install", help="Install the best variant this node can run")
+    install_parser.add_argument("--artifacts", required=True,
+                                help="Artifact store")
+    install_parser.add_argument("packages", nargs="+", metavar="PKGNAME-PKGVER",
+                                help="Packages to install (e.g. openmpi-4.1.1)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # only needed by the command line, so importing this module (e.g. pkg.py) doesn't load it
+    from tabulate import tabulate
+
+    args = microarch_args()
+
+    try:
+        if args.command == "detect":
+            table = [[node, detect_microarch(cpu_flags(node)) or platform.machine()] for node in args.nodes]
+            print(tabulate(table, headers=["Node", "Microarch"], tablefmt="pretty"))
+
+        elif args.command == "list":
+            host_microarch = detect_microarch()
+            table = []
+            for package in sorted(os.listdir(args.artifacts)):
+                pkgname, pkgver = package.split("-", 1)
+                variants = stored_variants(args.artifacts, pkgname, pkgver)
+                best = best_variant(variants, host_microarch)
+                table.append([package, ", ".join(variant or "generic" for variant in variants),
+                              "-" if best is False else best or "generic"])
+            print(tabulate(table, headers=["Package", "Variants", "Best in this node"], tablefmt="pretty"))
+
+        else:
+            for package in args.packages:
+                pkgname, pkgver = package.split("-", 1)
+                install_artifact(args.artifacts, pkgname, pkgver)
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+#
+# MPI microbenchmarks (ping-pong latency, bandwidth, allreduce and alltoall)
+#
+# The benchmark source is bundled below, compiled with the mpicc of an
+# OpenMPI installation and run locally with mpirun (or srun --mpi=pmix)
+# across message sizes. The results of the first run are saved as the
+# baseline of the installation ($prefix/share/hpcluster/mpi-bench.json),
+# so a bad rebuild shows up as a regression.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+
+from fineprint.status import print_status, print_successful, print_failure
+
+from bench import save_results, load_results, compare_results
+
+
+MICROBENCH_SOURCE = r"""
+#include <mpi.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#define WINDOW 64
+
+typedef double (*bench_fn)(char *sbuf, char *rbuf, int size, int iters, int rank, int nprocs);
+
+static double pingpong(char *sbuf, char *rbuf, int size, int iters, int rank, int nprocs)
+{
+    double start = MPI_Wtime();
+    for (int i = 0; i < iters; i++) {
+        if (rank == 0) {
+            MPI_Send(sbuf, size, MPI_CHAR, 1, 0, MPI_COMM_WORLD);
+            MPI_Recv(rbuf, size, MPI_CHAR, 1, 0, MPI_COMM_WORLD, MPI_STATUS_IGNORE);
+        } else if (rank == 1) {
+            MPI_Recv(rbuf, size, MPI_CHAR, 0, 0, MPI_COMM_WORLD, MPI_STATUS_IGNORE);
+            MPI_Send(sbuf, size, MPI_CHAR, 0, 0, MPI_COMM_WORLD);
+        }
+    }
+    return (MPI_Wtime() - start) / (2.0 * iters); /* one-way latency */
+}
+
+static double bandwidth(char *sbuf, char *rbuf, int size, int iters, int rank, int nprocs)
+{
+    MPI_Request requests[WINDOW];
+    char ack = 0;
+    double start = MPI_Wtime();
+    for (int i = 0; i < iters; i++) {
+        if (rank == 0) {
+            for (int w = 0; w < WINDOW; w++)
+                MPI_Isend(sbuf, size, MPI_CHAR, 1, 1, MPI_COMM_WORLD, &requests[w]);
+            MPI_Waitall(WINDOW, requests, MPI_STATUSES_IGNORE);
+            MPI_Recv(&ack, 1, MPI_CHAR, 1, 2, MPI_COMM_WORLD, MPI_STATUS_IGNORE);
+        } else if (rank == 1) {
+            for (int w = 0; w < WINDOW; w++)
+                MPI_Irecv(rbuf, size, MPI_CHAR, 0, 1, MPI_COMM_WORLD, &requests[w]);
+            MPI_Waitall(WINDOW, requests, MPI_STATUSES_IGNORE);
+            MPI_Send(&ack, 1, MPI_CHAR, 0, 2, MPI_COMM_WORLD);
+        }
+    }
+    return (MPI_Wtime() - start) / ((double) WINDOW * iters); /* time per message */
+}
+
+static double allreduce(char *sbuf, char *rbuf, int size, int iters, int rank, int nprocs)
+{
+    int count = size / sizeof(double) > 0 ? size / sizeof(double) : 1;
+    double start = MPI_Wtime();
+    for (int i = 0; i < iters; i++)
+        MPI_Allreduce(sbuf, rbuf, count, MPI_DOUBLE, MPI_SUM, MPI_COMM_WORLD);
+    return (MPI_Wtime() - start) / iters;
+}
+
+static double alltoall(char *sbuf, char *rbuf, int size, int iters, int rank, int nprocs)
+{
+    double start = MPI_Wtime();
+    for (int i = 0; i < iters; i++)
+        MPI_Alltoall(sbuf, size, MPI_CHAR, rbuf, size, MPI_CHAR, MPI_COMM_WORLD);
+    return (MPI_Wtime() - start) / iters;
+}
+
+static void run(const char *name, bench_fn fn, char *sbuf, char *rbuf, int min_size,
+                int max_size, int iterations, int rank, int nprocs)
+{
+    for (int size = min_size; size <= max_size; size *= 2) {
+        int iters = size <= 8192 ? iterations : iterations / (size / 8192);
+        if (iters < 10)
+            iters = 10;
+
+        MPI_Barrier(MPI_COMM_WORLD);
+        fn(sbuf, rbuf, size, iters / 10 + 1, rank, nprocs); /* warm up */
+        MPI_Barrier(MPI_COMM_WORLD);
+        double elapsed = fn(sbuf, rbuf, size, iters, rank, nprocs), slowest;
+        MPI_Reduce(&elapsed, &slowest, 1, MPI_DOUBLE, MPI_MAX, 0, MPI_COMM_WORLD);
+
+        if (rank == 0)
+            printf("RESULT %s %d %d %.9f\n", name, nprocs, size, slowest);
+    }
+}
+
+int main(int argc, char **argv)
+{
+    int rank, nprocs;
+    MPI_Init(&argc, &argv);
+    MPI_Comm_rank(MPI_COMM_WORLD, &rank);
+    MPI_Comm_size(MPI_COMM_WORLD, &nprocs);
+
+    const char *tests = argc > 1 ? argv[1] : "pingpong,bandwidth,allreduce,alltoall";
+    int max_size = argc > 2 ? atoi(argv[2]) : 1 << 22;
+    int iterations = argc > 3 ? atoi(argv[3]) : 1000;
+    int alltoall_size = max_size < (1 << 20) ? max_size : 1 << 20;
+
+    size_t buffer = (size_t) max_size > (size_t) alltoall_size * nprocs ? (size_t) max_size
+                                                                        : (size_t) alltoall_size * nprocs;
+    char *sbuf = malloc(buffer), *rbuf = malloc(buffer);
+    memset(sbuf, 1, buffer);
+    memset(rbuf, 0, buffer);
+
+    if (nprocs >= 2 && strstr(tests, "pingpong"))
+        run("pingpong", pingpong, sbuf, rbuf, 1, max_size, iterations, rank, nprocs);
+    if (nprocs >= 2 && strstr(tests, "bandwidth"))
+        run("bandwidth", bandwidth, sbuf, rbuf, 1, max_size, iterations / 10 + 1, rank, nprocs);
+    if (strstr(tests, "allreduce"))
+        run("allreduce", allreduce, sbuf, rbuf, 8, max_size, iterations, rank, nprocs);
+    if (strstr(tests, "alltoall"))
+        run("alltoall", alltoall, sbuf, rbuf, 1, alltoall_size, iterations, rank, nprocs);
+
+    free(sbuf);
+    free(rbuf);
+    MPI_Finalize();
+    return 0;
+}
+"""
+
+point_to_point = ["pingpong", "bandwidth"]
+collectives = ["allreduce", "alltoall"]
+
+
+def baseline_path(prefix:str):
+    return os.path.join(prefix, "share", "hpcluster", "mpi-bench.json")
+
+
+def compile_bench(prefix:str, work_dir:str):
+    """
+    Compile the microbenchmarks with the mpicc of prefix
+    Return the path of the binary
+    """
+    source = os.path.join(work_dir, "hpcluster_mpi_bench.c")
+    binary = os.path.join(work_dir, "hpcluster_mpi_bench")
+    with open(source, 'w') as source_file:
+        source_file.write(MICROBENCH_SOURCE)
+
+    subprocess.run([os.path.join(prefix, "bin", "mpicc"), "-O2", "-std=c99", "-o", binary, source],
+                   check=True, capture_output=True, text=True)
+    return binary
+
+
+def launch_cmd(prefix:str, launcher:str, ranks:int, *, mca:dict = None):
+    """
+    Command (and environment) to launch ranks processes with mpirun or srun --mpi=pmix
+    """
+    env = dict(os.environ)
+    env["LD_LIBRARY_PATH"] = f"{os.path.join(prefix, 'lib')}:{env.get('LD_LIBRARY_PATH', '')}"
+
+    if launcher == "srun":
+        # MCA parameters are read from the environment under srun
+        env.update({f"OMPI_MCA_{name}": str(value) for name, value in (mca or {}).items()})
+        return ["srun", "--mpi=pmix", "-n", str(ranks)], env
+
+    cmd = [os.path.join(prefix, "bin", "mpirun"), "-np", str(ranks), "--oversubscribe"]
+    for name, value in (mca or {}).items():
+        cmd += ["--mca", name, str(value)]
+    return cmd, env
+
+
+def run_bench(binary:str, prefix:str, *, ranks:int, tests, launcher:str = "mpirun",
+              max_size:int = 1 << 22, iterations:int = 1000, mca:dict = None):
+    """
+    Run the microbenchmarks with ranks processes
+    Return a list of results (test, ranks, size, latency_us, bandwidth_mbs)
+    """
+    cmd, env = launch_cmd(prefix, launcher, ranks, mca=mca)
+    cmd += [binary, ",".join(tests), str(max_size), str(iterations)]
+    output = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True).stdout
+
+    results = []
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 5 and fields[0] == "RESULT":
+            test, nprocs, size, seconds = fields[1], int(fields[2]), int(fields[3]), float(fields[4])
+            results.append({
+                "test": test,
+                "ranks": nprocs,
+                "size": size,
+                "latency_us": round(seconds * 1e6, 3),
+                "bandwidth_mbs": round(size / seconds / 1e6, 2) if seconds > 0 else None
+            })
+    return results
+
+
+def run_suite(prefix:str, *, launcher:str = "mpirun", ranks=None, max_size:int = 1 << 22,
+              iterations:int = 1000, tests=None, mca:dict = None):
+    """
+    Compile and run the microbenchmarks: point to point tests with 2 ranks and
+    collectives with each number of ranks (default: 2 up to the number of CPUs)
+    """
+    tests = tests or point_to_point + collectives
+    if ranks is None:
+        ncpus = os.cpu_count() or 2
+        ranks = sorted({2, *[2**i for i in range(2, 8) if 2**i <= ncpus], ncpus})
+
+    work_dir = tempfile.mkdtemp(prefix="hpcluster-mpi-bench-")
+    try:
+        binary = compile_bench(prefix, work_dir)
+        results = []
+        for nprocs in ranks:
+            selected = [test for test in tests if test in collectives or nprocs == 2]
+            if selected:
+                print_status(f"Running {', '.join(selected)} with {nprocs} ranks ({launcher})")
+                results += run_bench(binary, prefix, ranks=nprocs, tests=selected, launcher=launcher,
+                                     max_size=max_size, iterations=iterations, mca=mca)
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def check_against_baseline(prefix:str, *, launcher:str = "mpirun", tolerance:float = 0.2,
+                           save_baseline:bool = False, output:str = None, **options):
+    """
+    Run the microbenchmarks and compare them against the baseline of the installation
+    (the baseline is saved if it doesn't exist or save_baseline is enabled)
+    Return the regressions
+    """
+    results = run_suite(prefix, launcher=launcher, **options)
+    if output:
+        current = save_results(output, "mpi-microbench", results, prefix=prefix, launcher=launcher)
+    else:
+        current = {"benchmark": "mpi-microbench", "results": results}
+
+    baseline = baseline_path(prefix)
+    if save_baseline or not os.path.isfile(baseline):
+        save_results(baseline, "mpi-microbench", results, sudo=True, prefix=prefix, launcher=launcher)
+        return []
+
+    return compare_results(load_results(baseline), current, key=["test", "ranks", "size"],
+                           metric="latency_us", tolerance=tolerance)
+
+
+def mpi_bench_args():
+    parser = argparse.ArgumentParser(description="MPI microbenchmarks (latency, bandwidth, allreduce and alltoall)")
+    parser.add_argument("--prefix", default="/usr/local/openmpi",
+                        help="Location of OpenMPI")
+    parser.add_argument("--launcher", choices=["mpirun", "srun"], default="mpirun",
+                        help="Launch the benchmarks with mpirun or srun --mpi=pmix")
+    parser.add_argument("-n", "--ranks", type=int, nargs="+",
+                        help="Numbers of ranks of the collectives (default: 2 up to the number of CPUs)")
+    parser.add_argument("--tests", default=",".join(point_to_point + collectives),
+                        help="Tests to run (comma separated)")
+    parser.add_argument("--max-size", dest="max_size", type=int, default=1 << 22,
+                        help="Largest message size (bytes)")
+    parser.add_argument("-i", "--iterations", type=int, default=1000,
+                        help="Iterations of small messages")
+    parser.add_argument("-o", "--output",
+                        help="File to save the results (JSON)")
+    parser.add_argument("--save-baseline", dest="save_baseline", action="store_true",
+                        help="Save the results as the baseline of the installation")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed degradation against the baseline (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = mpi_bench_args()
+
+    try:
+        regressions = check_against_baseline(args.prefix, launcher=args.launcher, tolerance=args.tolerance,
+                                             save_baseline=args.save_baseline, output=args.output,
+                                             ranks=args.ranks, max_size=args.max_size,
+                                             iterations=args.iterations, tests=args.tests.split(","))
+        if regressions:
+            exit(1)
+
+    except subprocess.CalledProcessError as error:
+        print_failure(f"{' '.join(error.cmd)} failed: {error.stderr}")
+        exit(1)
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
@@ -11,18 +11,19 @@
 # Maintainer: glozanoa <glozanoa@uni.pe>
 
 import os
-import distro
-from tabulate import tabulate
-from sbash import Bash
 from fineprint.status import print_status, print_successful, print_failure
 from fineprint.color import ColorStr
 
-from pkg import Package, BuildablePackage
-from linux_requirements import install_requirements
+from pkg import Package, BuildablePackage, install_packages
 
 
 class Munge(Package):
-    def __init__(self, *, pkgver, source, build_path, uncompressed_dir=None):
+    bootstrap_cmd = "./bootstrap"
+    footprint = 50 # MB (uncompressed and compiled source)
+
+    def __init__(self, *, pkgver, source, build_path, uncompressed_dir=None, prefix:str = None,
+                 nodes:str = None, credential_rate:float = None, threads:int = None,
+                 key_from:str = None, **options):
         depends = {
             "gcc": {"Centos": "gcc.x86_64"},
             "OpenSSL": {"Centos": "openssl-devel.x86_64"},
@@ -41,96 +42,105 @@ class Munge(Package):
                          depends=depends,
                          makedepends=makedepends,
                          build_path=build_path,
-                         uncompressed_dir=uncompressed_dir)
+                         uncompressed_dir=uncompressed_dir,
+                         prefix=prefix,
+                         **options)
+        self.nodes = nodes # hostlist of nodes to copy the munge key
+        self.credential_rate = credential_rate # expected credentials/second (size munged threads)
+        self.threads = threads
+        self.key_from = key_from # host to fetch the munge key (node role)
+
+    def configure_flags(self):
+        return [
+            f"--prefix={self.prefix or '/usr'}",
+            "--sysconfdir=/etc",
+            "--localstatedir=/var",
+            f"--libdir={self.prefix or '/usr'}/lib64"
+        ]
+
+    @property
+    def munged(self):
+        return os.path.join(self.prefix or "/usr", "sbin", "munged")
 
     def build(self):
         print_status(f"Building {self.pkgname}-{self.pkgver}")
         print(ColorStr("It can take a while, so go for a coffee ...").StyleBRIGHT)
 
-        Bash.exec("./bootstrap", where=self.uncompressed_path)
-        flags = [
-            "--prefix=/usr",
-            "--sysconfdir=/etc",
-            "--localstatedir=/var",
-            "--libdir=/usr/lib64"
-        ]
-
-        configure = "./configure " + " ".join(flags)
-        Bash.exec(configure, where=self.uncompressed_path)
-        Bash.exec("make", where=self.uncompressed_path)
+        self.configure()
+        self.run_step("make", where=self.objdir)
 
     def install(self):
+        from sbash import Bash
+        from munge_setup import setup_munge
+        from hostlist import expand_hostlist
+
         print_status(f"Installing {self.pkgname}-{self.pkgver}")
         #import pdb; pdb.set_trace()
 
-        Bash.exec("sudo make install", where=self.uncompressed_path)
+        self.run_step("sudo make install", where=self.objdir)
 
         print_status(f"Configuring {self.pkgname}-{self.pkgver} package")
-        configure = [
-            "sudo useradd -s /bin/bash -d /var/log/munge munge",
-            "sudo chown munge:munge -R /var/log/munge/",
-
-            "sudo chown munge:munge /etc/munge/",
-            "sudo chmod 700 /etc/munge/",
-
-            "sudo chown munge:munge /var/lib/munge/",
-            "sudo chmod 711 /var/lib/munge/",
-
-            "sudo chmod 700 /var/log/munge"
-        ]
+        configure = [f"sudo {cmd}" for cmd in self.node_setup()]
 
         for cmd in configure:
             print(cmd)
             Bash.exec(cmd)
 
-        print_status("Now create munge key in /etc/munge using mungekey.Then initialize munge service")
+        nodes = expand_hostlist(self.nodes) if self.nodes else []
+        setup_munge(nodes=nodes, rate=self.credential_rate, threads=self.threads, munged=self.munged)
+
+    def node_configure(self):
+        from munge_setup import fetch_key, key_exists, configure_threads, num_threads, credential_rate
+
+        if self.key_from:
+            fetch_key(self.key_from)
+        if not key_exists():
+            print_status("Munge key isn't in this node, copy it from the installer (munge_setup.py --nodes) "
+                         "or use --key-from INSTALLER")
+            return
+        threads = self.threads or num_threads(self.credential_rate or credential_rate(0))
+        configure_threads(threads, munged=self.munged)
 
+    def node_setup(self):
+        return [
+            "useradd -s /bin/bash -d /var/log/munge munge",
+            "chown munge:munge -R /var/log/munge/",
+
+            "chown munge:munge /etc/munge/",
+            "chmod 700 /etc/munge/",
+
+            "chown munge:munge /var/lib/munge/",
+            "chmod 711 /var/lib/munge/",
+
+            "chmod 700 /var/log/munge"
+        ]
 
 if __name__ == "__main__":
     parser = Package.cmd_parser()
+    key_parser = parser.add_argument_group("Munge key and threads")
+    key_parser.add_argument("--nodes", metavar="NODELIST",
+                            help="Copy the munge key to these nodes (e.g. node[01-20])")
+    key_parser.add_argument("--credential-rate", dest="credential_rate", type=float,
+                            help="Expected credentials/second (default: estimated from the number of nodes)")
+    key_parser.add_argument("--threads", type=int,
+                            help="Threads of munged (default: sized from the credential rate)")
+    key_parser.add_argument("--key-from", dest="key_from", metavar="HOST",
+                            help="Fetch the munge key from this host (node role of a shared prefix)")
+    parser.add_argument("--prefix",
+                        help="Location to install Munge, default: /usr (configuration and state are kept in /etc and /var)")
     args = parser.parse_args()
 
     build_path = os.path.abspath(os.path.expanduser(args.build_dir))
 
     bpkg = BuildablePackage(name='munge', version='0.5.14',
                     source='https://github.com/dun/munge/archive/refs/tags/munge-0.5.14.tar.gz',
-                    pkg=Munge, build_path=build_path, uncompressed_dir='munge-munge-0.5.14')
+                    pkg=Munge, build_path=build_path, uncompressed_dir='munge-munge-0.5.14',
+                            prefix=args.prefix,
+                            options={**Package.cmd_options(args),
+                                     'nodes': args.nodes,
+                                     'credential_rate': args.credential_rate,
+                                     'threads': args.threads,
+                                     'key_from': args.key_from})
     
-    pretty_name_distro = distro.os_release_info()['pretty_name']
-    print_status(f"Installing the following packages in {pretty_name_distro}")
-    bpkg_table = [[bpkg.name, bpkg.version, bpkg.source]]
-    print(tabulate(bpkg_table, headers=["Package", "Version", "Source"], tablefmt="pretty"))
-
-    while True:
-            short_answer = input("Proceed with installation? (y/n) ")
-            short_answer = short_answer.lower()
-            if short_answer in ['y', 'yes', 'n', 'no']:
-                if short_answer in ['n', 'no']:
-                    print_failure("Installation was canceled")
-                    exit(1)
-                else:
-                    break
-
-    install_requirements(distro.id(), pkgs=["munge"])
-
-    PkgClass = bpkg.pkg
-    pkg = PkgClass(**bpkg.init_options())
-    #import pdb; pdb.set_trace()
-    installation_options = { # default installation options
-        'no_confirm': True,
-        'avoid_download': False,
-        'avoid_uncompress': False,
-        'avoid_check': True
-    }
-
-    if args.only_compile:
-        installation_options['avoid_download'] = True
-        installation_options['avoid_uncompress'] = True
-
-    if args.avoid_download:
-        installation_options['avoid_download'] = True
-
-    if args.avoid_uncompress:
-        installation_options['avoid_uncompress'] = True
-
-    pkg.doall(**installation_options)
\ No newline at end of file
+
+    install_packages([bpkg], args, requirements=["munge"])
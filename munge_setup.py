@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+#
+# Munge key generation, distribution and thread tuning
+#
+# The key is created once in this host (mungekey) and copied in parallel
+# to the nodes through the stdin of ssh, so it's never written in a
+# temporary file (or fetched from the host that has it, e.g. by a node of
+# a shared-prefix installation). The number of threads of munged is sized from the
+# expected credential rate and confirmed with a remunge benchmark.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import math
+import os
+import re
+import subprocess
+import tempfile
+
+from fineprint.status import print_status, print_successful, print_failure
+
+
+key_path = "/etc/munge/munge.key"
+dropin_path = "/etc/systemd/system/munge.service.d/hpcluster-threads.conf"
+
+# credentials/second validated by a munged thread (conservative, measure it with remunge -N 1)
+default_thread_rate = 500
+
+
+def key_exists(path:str = key_path):
+    return subprocess.run(["sudo", "test", "-f", path]).returncode == 0
+
+
+def generate_key(path:str = key_path, *, force:bool = False):
+    """
+    Create the munge key (only if it doesn't exist, unless force is enabled)
+    """
+    from sbash import Bash
+
+    if key_exists(path) and not force:
+        print_status(f"Munge key {path} already exists")
+        return False
+
+    print_status(f"Creating munge key {path}")
+    Bash.exec(f"sudo mungekey --create --force --keyfile {path}")
+    Bash.exec(f"sudo chown munge:munge {path}")
+    Bash.exec(f"sudo chmod 400 {path}")
+    return True
+
+
+def read_key(path:str = key_path):
+    return subprocess.run(["sudo", "cat", path], capture_output=True, check=True).stdout
+
+
+def copy_key(node:str, key:bytes, *, path:str = key_path,
+             ssh_args:str = "-o BatchMode=yes -o ConnectTimeout=10"):
+    """
+    Copy the key to a node (through the stdin of ssh) and restart munged there
+    Return the error message (None if the key was copied)
+    """
+    remote = (f"sudo install -D -m400 -o munge -g munge /dev/stdin {path} && "
+              f"sudo sha256sum {path} && sudo systemctl restart munge")
+    process = subprocess.run(["ssh", *ssh_args.split(), node, remote],
+                             input=key, capture_output=True)
+    if process.returncode != 0:
+        return process.stderr.decode().strip() or f"exit status {process.returncode}"
+
+    if hashlib.sha256(key).hexdigest() not in process.stdout.decode():
+        return "checksum of the copied key doesn't match"
+    return None
+
+
+def fetch_key(host:str, *, path:str = key_path,
+              ssh_args:str = "-o BatchMode=yes -o ConnectTimeout=10"):
+    """
+    Copy the key of host to this node (through the stdout of ssh)
+    """
+    print_status(f"Fetching munge key from {host}")
+    process = subprocess.run(["ssh", *ssh_args.split(), host, f"sudo cat {path}"], capture_output=True)
+    if process.returncode != 0 or not process.stdout:
+        raise Exception(f"Munge key wasn't fetched from {host}: {process.stderr.decode().strip()}")
+    subprocess.run(["sudo", "install", "-D", "-m400", "-o", "munge", "-g", "munge", "/dev/stdin", path],
+                   input=process.stdout, check=True)
+    print_successful(f"Munge key of {host} was copied to {path}")
+
+
+def distribute_key(nodes, *, path:str = key_path, fanout:int = 32):
+    """
+    Copy the munge key to the nodes in parallel
+    Return the nodes where the key wasn't copied (node: error)
+    """
+    key = read_key(path)
+    print_status(f"Copying munge key to {len(nodes)} nodes (fanout: {fanout})")
+    with ThreadPoolExecutor(max_workers=fanout) as executor:
+        errors = dict(zip(nodes, executor.map(lambda node: copy_key(node, key, path=path), nodes)))
+
+    failures = {node: error for node, error in errors.items() if error}
+    for node, error in failures.items():
+        print_failure(f"{node}: {error}")
+    print_successful(f"Munge key was copied to {len(nodes) - len(failures)} of {len(nodes)} nodes")
+    return failures
+
+
+def credential_rate(nnodes:int, *, jobs_rate:float = 10):
+    """
+    Expected credentials/second in the controller: nodes registering (and responding
+    pings) at the same time, each message encoded and decoded, plus launched jobs
+    """
+    return 2 * nnodes + 4 * jobs_rate
+
+
+def num_threads(rate:float, *, thread_rate:float = default_thread_rate, headroom:float = 2):
+    """
+    Threads of munged to validate rate credentials/second (munged default: 2)
+    """
+    return max(2, min(4 * (os.cpu_count() or 1), math.ceil(headroom * rate / thread_rate)))
+
+
+def configure_threads(threads:int, *, munged:str = "/usr/sbin/munged"):
+    """
+    Set --num-threads of munged through a systemd drop-in and restart it.
+    $OPTIONS of the unit (EnvironmentFile /etc/sysconfig/munge or /etc/default/munge)
+    are kept, --num-threads goes after them so it overrides theirs
+    """
+    from sbash import Bash
+
+    dropin = "\n".join([
+        "# generated by hpcluster (munge_setup.py)",
+        "[Service]",
+        "ExecStart=",
+        f"ExecStart={munged} $OPTIONS --num-threads={threads}"
+    ]) + "\n"
+
+    with tempfile.NamedTemporaryFile('w', delete=False) as tmp:
+        tmp.write(dropin)
+    Bash.exec(f"sudo install -D -m644 {tmp.name} {dropin_path}")
+    os.remove(tmp.name)
+
+    Bash.exec("sudo systemctl daemon-reload")
+    Bash.exec("sudo systemctl enable munge")
+    Bash.exec("sudo systemctl restart munge")
+    print_successful(f"munged runs with {threads} threads ({dropin_path})")
+
+
+def remunge(*, threads:int, duration:int = 10, decode:bool = True):
+    """
+    Run remunge and return the credentials/second
+    """
+    cmd = ["remunge", "-N", str(threads), "-D", str(duration)]
+    if decode:
+        cmd.append("-d")
+    output = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    match = re.search(r"(\d+) credentials? (?:encoded|decoded).* in ([\d.]+) seconds",
+                      output.stdout + output.stderr)
+    if match is None:
+        raise Exception(f"remunge output wasn't recognized: {output.stderr.strip()}")
+    return int(match.group(1)) / float(match.group(2))
+
+
+def benchmark(*, client_threads=(1, 2, 4, 8, 16), duration:int = 10):
+    """
+    Measure the credential rate of the local munged with several client threads
+    """
+    results = []
+    for threads in client_threads:
+        rate = remunge(threads=threads, duration=duration)
+        print_status(f"remunge with {threads} threads: {rate:.0f} credentials/second")
+        results.append({"client_threads": threads, "rate": round(rate, 1)})
+    return results
+
+
+def setup_munge(*, nodes=None, rate:float = None, threads:int = None, fanout:int = 32,
+                munged:str = "/usr/sbin/munged"):
+    """
+    Create the key, tune munged and copy the key to the nodes
+    Return the threads of munged
+    """
+    generate_key()
+
+    if threads is None:
+        rate = rate or credential_rate(len(nodes or []))
+        threads = num_threads(rate)
+        print_status(f"Expected credential rate: {rate:.0f}/s -> {threads} threads")
+    configure_threads(threads, munged=munged)
+
+    if nodes:
+        failures = distribute_key(nodes, fanout=fanout)
+        if failures:
+            raise Exception(f"Munge key wasn't copied to {len(failures)} nodes")
+
+    return threads
+
+
+def munge_args():
+    parser = argparse.ArgumentParser(description="Munge key generation, distribution and thread tuning")
+    parser.add_argument("--nodes", metavar="NODELIST",
+                        help="Copy the munge key to these nodes (e.g. node[01-20])")
+    parser.add_argument("--fanout", type=int, default=32,
+                        help="Number of nodes copying the key at the same time")
+    parser.add_argument("--rate", type=float,
+                        help="Expected credentials/second (default: estimated from the number of nodes)")
+    parser.add_argument("--threads", type=int,
+                        help="Threads of munged (default: sized from the expected rate)")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Measure the credential rate with remunge after the setup")
+    parser.add_argument("--duration", type=int, default=10,
+                        help="Duration (seconds) of each remunge run")
+    parser.add_argument("-o", "--output",
+                        help="File to save the benchmark results (JSON)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from tabulate import tabulate
+    from bench import save_results
+    from hostlist import expand_hostlist
+
+    args = munge_args()
+
+    try:
+        nodes = expand_hostlist(args.nodes) if args.nodes else []
+        rate = args.rate or credential_rate(len(nodes))
+        threads = setup_munge(nodes=nodes, rate=rate, threads=args.threads, fanout=args.fanout)
+
+        if args.benchmark:
+            results = benchmark(duration=args.duration)
+            print(tabulate([[result["client_threads"], result["rate"]] for result in results],
+                           headers=["Client threads", "Credentials/s"], tablefmt="pretty"))
+            if args.output:
+                save_results(args.output, "remunge", results, munged_threads=threads, expected_rate=rate)
+
+            best = max(result["rate"] for result in results)
+            if best < rate:
+                print_failure(f"munged validates {best:.0f} credentials/s, but {rate:.0f}/s are expected")
+                exit(1)
+            print_successful(f"munged validates up to {best:.0f} credentials/s (expected: {rate:.0f}/s)")
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
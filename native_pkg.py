@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+#
+# Build distro-native packages (rpm, deb or pkg.tar) from staged installations
+#
+# Supported distributions (see linux_requirements):
+#   centos:       rpm      (rpmbuild, local repo with createrepo)
+#   ubuntu, kali: deb      (dpkg-deb, local repo with dpkg-scanpackages)
+#   arch:         pkg.tar  (local repo with repo-add)
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import os
+import platform
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+
+from fineprint.status import print_status, print_successful, print_failure
+
+
+native_formats = {
+    'centos': 'rpm',
+    'ubuntu': 'deb',
+    'kali': 'deb',
+    'arch': 'pkg.tar'
+}
+
+
+def staged_files(stage_path:str):
+    """
+    Files, symbolic links and empty directories (e.g. /var/lib/munge) of a
+    staged installation (paths relative to stage_path)
+    """
+    files = []
+    for root, dirs, filenames in os.walk(stage_path):
+        for name in filenames + dirs:
+            path = os.path.join(root, name)
+            if os.path.isdir(path) and not os.path.islink(path) and os.listdir(path):
+                continue
+            files.append(os.path.relpath(path, stage_path))
+    return sorted(files)
+
+
+def runtime_depends(pkg, distro_id:str):
+    """
+    Packages needed to run pkg in distro_id, declared by all the native formats:
+    the hpcluster packages it needs (native_depends) and its distro requirements
+    (see linux_requirements, without the architecture suffix of the yum names)
+    """
+    from linux_requirements import requirements
+
+    depends = []
+    for depend in pkg.native_depends + requirements.get(distro_id, {}).get(pkg.pkgname, []):
+        name, _, arch = depend.rpartition(".")
+        if name and arch in ["x86_64", "aarch64", "ppc64le", "i686", "noarch"]:
+            depend = name
+        if depend not in depends:
+            depends.append(depend)
+    return depends
+
+
+def post_install_script(pkg):
+    """
+    Shell commands to configure a node after the package is installed (see Package.node_setup)
+    """
+    return "\n".join(f"{cmd} || :" for cmd in pkg.node_setup())
+
+
+def build_rpm(pkg, output_dir:str, release:int, depends):
+    version = pkg.pkgver.replace("-", "_")
+    topdir = tempfile.mkdtemp(prefix=f"rpmbuild-{pkg.pkgname}-")
+
+    files = "\n".join(f'"/{path}"' for path in staged_files(pkg.stage_path))
+    requires = "\n".join(f"Requires: {depend}" for depend in depends)
+    post = post_install_script(pkg)
+
+    spec = f"""%define debug_package %{{nil}}
+%define __os_install_post %{{nil}}
+
+Name: {pkg.pkgname}
+Version: {version}
+Release: {release}
+Summary: {pkg.pkgname} {pkg.pkgver} built by hpcluster
+License: see /usr/share/licenses/{pkg.pkgname}
+AutoReqProv: yes
+{requires}
+
+%description
+{pkg.pkgname} {pkg.pkgver} built by hpcluster (flavor: {pkg.flavor()})
+
+%install
+mkdir -p %{{buildroot}}
+cp -a {pkg.stage_path}/. %{{buildroot}}/
+
+%files
+%defattr(-,root,root,-)
+{files}
+"""
+    if post:
+        spec += f"\n%post\n{post}\n"
+
+    spec_path = os.path.join(topdir, f"{pkg.pkgname}.spec")
+    with open(spec_path, 'w') as spec_file:
+        spec_file.write(spec)
+
+    try:
+        subprocess.run(["rpmbuild", "-bb", "--define", f"_topdir {topdir}", spec_path], check=True)
+
+        rpms_dir = os.path.join(topdir, "RPMS")
+        rpms = [os.path.join(rpms_dir, arch, rpm) for arch in sorted(os.listdir(rpms_dir))
+                for rpm in sorted(os.listdir(os.path.join(rpms_dir, arch)))] if os.path.isdir(rpms_dir) else []
+        if not rpms:
+            raise Exception(f"rpmbuild didn't build an rpm of {pkg.pkgname}-{pkg.pkgver}")
+        for rpm in rpms:
+            shutil.copy(rpm, output_dir)
+        package = os.path.join(output_dir, os.path.basename(rpms[0]))
+    finally:
+        shutil.rmtree(topdir, ignore_errors=True)
+    return package
+
+
+def shlibs_depends(root:str):
+    """
+    Dependencies of the ELF files in root computed by dpkg-shlibdeps
+    (libraries of the other hpcluster packages are ignored)
+    """
+    elf_files = []
+    for path in staged_files(root):
+        path = os.path.join(root, path)
+        if os.path.isfile(path) and not os.path.islink(path):
+            with open(path, 'rb') as binary:
+                if binary.read(4) == b"\x7fELF":
+                    elf_files.append(path)
+
+    if not elf_files:
+        return []
+
+    workdir = tempfile.mkdtemp(prefix="shlibdeps-")
+    os.mkdir(os.path.join(workdir, "debian"))
+    with open(os.path.join(workdir, "debian", "control"), 'w') as control:
+        control.write("Source: hpcluster\n\nPackage: hpcluster\n")
+
+    libdirs = [f"-l{os.path.join(root, libdir)}" for libdir in ["usr/lib", "usr/lib64", "usr/local/lib"]]
+    try:
+        output = subprocess.run(["dpkg-shlibdeps", "-O", "--ignore-missing-info", "--warnings=0",
+                                 *libdirs, *[f"-e{elf}" for elf in elf_files]],
+                                cwd=workdir, check=True, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError) as error:
+        print_failure(f"Library dependencies weren't computed (dpkg-shlibdeps: {error})")
+        return []
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    depends = []
+    for line in output.splitlines():
+        if line.startswith("shlibs:Depends="):
+            depends = [depend.strip() for depend in line.split("=", 1)[1].split(",") if depend.strip()]
+    return depends
+
+
+def build_deb(pkg, output_dir:str, release:int, depends):
+    arch = subprocess.run(["dpkg", "--print-architecture"],
+                          check=True, capture_output=True, text=True).stdout.strip()
+    version = f"{pkg.pkgver}-{release}"
+
+    workdir = tempfile.mkdtemp(prefix=f"deb-{pkg.pkgname}-")
+    root = os.path.join(workdir, pkg.pkgname)
+    shutil.copytree(pkg.stage_path, root, symlinks=True)
+
+    depends = depends + [depend for depend in shlibs_depends(root) if depend not in depends]
+
+    os.makedirs(os.path.join(root, "DEBIAN"))
+    control = [
+        f"Package: {pkg.pkgname}",
+        f"Version: {version}",
+        f"Architecture: {arch}",
+        f"Maintainer: hpcluster <root@{platform.node()}>",
+        f"Description: {pkg.pkgname} {pkg.pkgver} built by hpcluster (flavor: {pkg.flavor()})"
+    ]
+    if depends:
+        control.insert(3, f"Depends: {', '.join(depends)}")
+
+    with open(os.path.join(root, "DEBIAN", "control"), 'w') as control_file:
+        control_file.write("\n".join(control) + "\n")
+
+    post = post_install_script(pkg)
+    if post:
+        postinst = os.path.join(root, "DEBIAN", "postinst")
+        with open(postinst, 'w') as postinst_file:
+            postinst_file.write(f"#!/bin/sh\n{post}\n")
+        os.chmod(postinst, 0o755)
+
+    package = os.path.join(output_dir, f"{pkg.pkgname}_{version}_{arch}.deb")
+    subprocess.run(["dpkg-deb", "--root-owner-group", "--build", root, package], check=True)
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    return package
+
+
+def build_pkgtar(pkg, output_dir:str, release:int, depends):
+    arch = platform.machine()
+    version = f"{pkg.pkgver.replace('-', '_')}-{release}"
+    files = staged_files(pkg.stage_path)
+    size = sum(os.lstat(os.path.join(pkg.stage_path, path)).st_size for path in files)
+
+    pkginfo = [
+        f"pkgname = {pkg.pkgname}",
+        f"pkgver = {version}",
+        f"pkgdesc = {pkg.pkgname} {pkg.pkgver} built by hpcluster (flavor: {pkg.flavor()})",
+        f"builddate = {int(time.time())}",
+        f"packager = hpcluster <root@{platform.node()}>",
+        f"size = {size}",
+        f"arch = {arch}"
+    ] + [f"depend = {depend}" for depend in depends]
+
+    metadata = {".PKGINFO": "\n".join(pkginfo) + "\n"}
+    post = post_install_script(pkg)
+    if post:
+        metadata[".INSTALL"] = f"post_install() {{\n{post}\n}}\n\npost_upgrade() {{\n  post_install\n}}\n"
+
+    def root_owner(info):
+        info.uid = info.gid = 0
+        info.uname = info.gname = "root"
+        return info
+
+    workdir = tempfile.mkdtemp(prefix=f"pkgtar-{pkg.pkgname}-")
+    try:
+        root = os.path.join(workdir, pkg.pkgname)
+        shutil.copytree(pkg.stage_path, root, symlinks=True)
+        for name, content in metadata.items():
+            with open(os.path.join(root, name), 'w') as metadata_file:
+                metadata_file.write(content)
+
+        # file list with checksums checked by pacman (-Qkk), generated like makepkg does
+        subprocess.run(["bsdtar", "-czf", ".MTREE", "--format=mtree", "-n",
+                        "--uid", "0", "--gid", "0", "--uname", "root", "--gname", "root",
+                        "--options=!all,use-set,type,uid,gid,mode,time,size,md5,sha256,link",
+                        *metadata, *files], cwd=root, check=True)
+
+        package = os.path.join(output_dir, f"{pkg.pkgname}-{version}-{arch}.pkg.tar.xz")
+        with tarfile.open(package, 'w:xz') as pkgtar:
+            for path in [*metadata, ".MTREE", *files]:
+                pkgtar.add(os.path.join(root, path), arcname=path,
+                           recursive=False, filter=root_owner)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return package
+
+
+builders = {
+    'rpm': build_rpm,
+    'deb': build_deb,
+    'pkg.tar': build_pkgtar
+}
+
+
+def update_repo(repo_dir:str, native_format:str):
+    """
+    Update the metadata of the local repository (repo_dir)
+    """
+    from sbash import Bash
+
+    if native_format == 'rpm':
+        Bash.exec(f"createrepo {repo_dir}")
+    elif native_format == 'deb':
+        Bash.exec("dpkg-scanpackages . /dev/null | gzip -9c > Packages.gz", where=repo_dir)
+    elif native_format == 'pkg.tar':
+        Bash.exec("repo-add hpcluster.db.tar.gz *.pkg.tar.xz", where=repo_dir)
+
+
+def native_package(pkg, repo_dir:str, *, distro_id:str = None, release:int = 1):
+    """
+    Build a distro-native package of pkg (already staged, see Package.stage) in repo_dir
+    and update the local repository
+    """
+    if distro_id is None:
+        import distro
+        distro_id = distro.id()
+    if distro_id not in native_formats:
+        raise Exception(f"Native packages aren't supported in {distro_id} (supported: {', '.join(native_formats)})")
+
+    native_format = native_formats[distro_id]
+    repo_dir = os.path.abspath(os.path.expanduser(repo_dir))
+    os.makedirs(repo_dir, exist_ok=True)
+
+    print_status(f"Building {native_format} package of {pkg.pkgname}-{pkg.pkgver}")
+    package = builders[native_format](pkg, repo_dir, release, runtime_depends(pkg, distro_id))
+    update_repo(repo_dir, native_format)
+
+    print_successful(f"Package {os.path.basename(package)} was saved in {repo_dir}")
+    return package
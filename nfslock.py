@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+#
+# Cooperative file locks for build directories shared through NFS
+#
+# POSIX record locks (fcntl.lockf) are used because they are forwarded
+# to the NFS lock manager, while flock locks are local to each node
+# in old NFS clients.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import fcntl
+import os
+import platform
+import time
+
+
+class FileLock:
+    """
+    Exclusive lock of a file (shared by all the nodes that mount the same NFS directory)
+
+    Usage:
+        with FileLock(path):
+            # only one node (process) runs this block at the same time
+    """
+
+    def __init__(self, path:str, *, timeout:float = None, poll:float = 5):
+        self.path = path
+        self.timeout = timeout
+        self.poll = poll
+        self.lock_file = None
+
+    def holder(self):
+        """
+        Return the host and pid of the process holding the lock (as written by it)
+        """
+        try:
+            with open(self.path, 'r') as lock_file:
+                return lock_file.read().strip() or "unknown"
+        except OSError:
+            return "unknown"
+
+    def acquire(self):
+        self.lock_file = open(self.path, 'a+')
+        start = time.time()
+        waiting = False
+        while True:
+            try:
+                fcntl.lockf(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if not waiting:
+                    from fineprint.status import print_status
+                    print_status(f"Waiting for {self.path} (locked by {self.holder()})")
+                    waiting = True
+                if self.timeout is not None and time.time() - start > self.timeout:
+                    self.lock_file.close()
+                    raise TimeoutError(f"Timeout waiting for {self.path} (locked by {self.holder()})")
+                time.sleep(self.poll)
+
+        self.lock_file.seek(0)
+        self.lock_file.truncate()
+        self.lock_file.write(f"{platform.node()}:{os.getpid()}\n")
+        self.lock_file.flush()
+
+    def release(self):
+        if self.lock_file is not None:
+            self.lock_file.seek(0)
+            self.lock_file.truncate()
+            self.lock_file.flush()
+            fcntl.lockf(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -10,19 +10,88 @@
 # Maintainer: glozanoa <glozanoa@uni.pe>
 
 import os
-import distro
-from tabulate import tabulate
-from sbash import Bash
+import subprocess
 from fineprint.status import print_status, print_successful, print_failure
 from fineprint.color import ColorStr
 
-from pkg import Package, BuildablePackage
-from linux_requirements import install_requirements
+from pkg import Package, BuildablePackage, install_packages
+
+
+# components that must be built (alternatives separated by |) and
+# single-copy mechanisms of the shared-memory transport (btl/vader)
+expected_components = ["btl/self", "btl/vader", "pmix/ext3x|ext2x|pmix3x", "plm/slurm", "ras/slurm"]
+
+build_profiles = {
+    "default": {
+        "flags": [],
+        "components": expected_components,
+        "single_copy": []
+    },
+    "optimized": {
+        "flags": [
+            "--disable-debug",
+            "--disable-mem-debug",
+            "--disable-mem-profile",
+            "--disable-memchecker",
+            "--without-valgrind",
+            "--with-cma",
+            "CFLAGS='-O3'",
+            "CXXFLAGS='-O3'",
+            "FCFLAGS='-O3'"
+        ],
+        "components": expected_components,
+        "single_copy": ["cma"]
+    },
+    "debug": {
+        "flags": [
+            "--enable-debug",
+            "--enable-memchecker",
+            "--with-valgrind",
+            "CFLAGS='-O0 -g'",
+            "CXXFLAGS='-O0 -g'",
+            "FCFLAGS='-O0 -g'"
+        ],
+        "components": expected_components + ["memchecker/valgrind"],
+        "single_copy": []
+    }
+}
+
+
+def ompi_components(ompi_info:str):
+    """
+    Components (FRAMEWORK/NAME) built in an OpenMPI installation
+    """
+    output = subprocess.run([ompi_info, "--parsable"],
+                            capture_output=True, text=True, check=True).stdout
+    components = set()
+    for line in output.splitlines():
+        fields = line.split(":")
+        if len(fields) > 3 and fields[0] == "mca" and fields[3] == "version":
+            components.add(f"{fields[1]}/{fields[2]}")
+    return components
+
+
+def single_copy_mechanisms(ompi_info:str):
+    """
+    Single-copy mechanisms supported by the shared-memory transport (e.g. cma, xpmem, knem)
+    """
+    output = subprocess.run([ompi_info, "--parsable", "--param", "btl", "vader", "--level", "9"],
+                            capture_output=True, text=True).stdout
+    mechanisms = set()
+    for line in output.splitlines():
+        if ":btl_vader_single_copy_mechanism:enumerator:value:" in line:
+            mechanisms.add(line.rsplit(":", 1)[1])
+    return mechanisms
 
 
 class OpenMPI(Package):
+    footprint = 1500 # MB (uncompressed and compiled source)
+    native_depends = ["pmix"]
+
     def __init__(self, *, pkgver, source, build_path, uncompressed_dir=None, 
-                prefix:str = "/usr/local/openmpi"):
+                prefix:str = "/usr/local/openmpi", profile:str = "default",
+                bench:bool = False, bench_launcher:str = "mpirun",
+                mca_params:bool = False, calibrate:bool = False, **options):
         depends = {
             "gcc": {"Centos": "gcc.x86_64"},
             "pmix": {"CentOS": "https://github.com/fpolit/ama-framework/blob/master/depends/cluster/pmix.py"}
@@ -39,92 +108,122 @@ class OpenMPI(Package):
                          makedepends=makedepends,
                          build_path = build_path,
                          uncompressed_dir= uncompressed_dir,
-                         prefix=prefix)
+                         prefix=prefix,
+                         **options)
+
+        if profile not in build_profiles:
+            raise Exception(f"Unknown build profile {profile} (profiles: {', '.join(build_profiles)})")
+        self.profile = profile
+        self.bench = bench # run the MPI microbenchmarks after the installation (see mpi_bench.py)
+        self.bench_launcher = bench_launcher
+        self.mca_params = mca_params or calibrate # generate openmpi-mca-params.conf (see mca_params.py)
+        self.calibrate = calibrate
+
+    def configure_flags(self):
+        return [
+            f"--prefix={self.prefix}",
+            "--with-pmix",
+            "--with-slurm"
+        ] + build_profiles[self.profile]["flags"]
+
+    def verify_components(self):
+        """
+        Verify with ompi_info that the components expected by the build profile were built
+        """
+        from tabulate import tabulate
+
+        ompi_info = os.path.join(self.prefix, "bin", "ompi_info")
+        components = ompi_components(ompi_info)
+        mechanisms = single_copy_mechanisms(ompi_info)
+        self.components, self.mechanisms = components, mechanisms
+
+        missing = []
+        for expected in build_profiles[self.profile]["components"]:
+            framework, names = expected.split("/")
+            if not any(f"{framework}/{name}" in components for name in names.split("|")):
+                missing.append(expected)
+        missing += [f"btl/vader single copy ({mechanism})"
+                    for mechanism in build_profiles[self.profile]["single_copy"]
+                    if mechanism not in mechanisms]
+
+        table = [[framework, ", ".join(sorted(name.split("/")[1] for name in components
+                                              if name.startswith(f"{framework}/")))]
+                 for framework in ["btl", "pml", "pmix", "plm", "ras"]]
+        table.append(["single copy", ", ".join(sorted(mechanisms)) or "none"])
+        print(tabulate(table, headers=["Framework", "Components"], tablefmt="pretty"))
+
+        if missing:
+            raise Exception(f"OpenMPI ({self.profile} profile) was built without: {', '.join(missing)}")
+        print_successful(f"OpenMPI has all the components of the {self.profile} profile")
 
     def build(self):
         print_status(f"Building {self.pkgname}-{self.pkgver}")
         print(ColorStr("It can take a while, so go for a coffee ...").StyleBRIGHT)
 
-        flags = [
-            f"--prefix={self.prefix}",
-            "--with-pmix",
-            "--with-slurm"
-        ]
-
-        configure = "./configure " + " ".join(flags)
-        Bash.exec(configure, where=self.uncompressed_path)
-        Bash.exec("make", where=self.uncompressed_path)
+        self.configure()
+        self.run_step("make", where=self.objdir)
 
     def install(self):
         super().install()
+        self.verify_components()
         print_successful(f"Package {self.pkgname}-{self.pkgver} was sucefully installed in {self.prefix}")
 
-        print_status("Adding openmpi to you PATH")
+        if self.mca_params:
+            from mca_params import tune_openmpi
+            print_status("Generating MCA parameters from the topology and interconnect of this node")
+            tune_openmpi(self.prefix, components=self.components, mechanisms=self.mechanisms,
+                         calibration=self.calibrate, launcher=self.bench_launcher)
 
-        openmpi2path = f"""
-### exporting openmpi to the PATH
-export OPENMPI_HOME={self.prefix}
-export PATH=$PATH:$OPENMPI_HOME/bin
-export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:$OPENMPI_HOME/lib
-        """
+        if self.bench:
+            from mpi_bench import check_against_baseline
+            regressions = check_against_baseline(self.prefix, launcher=self.bench_launcher)
+            if regressions:
+                print_failure(f"MPI microbenchmarks of {self.prefix} are slower than its baseline (check the build)")
 
-        with open(os.path.expanduser("~/.bashrc"), 'a') as bashrc:
-            bashrc.write(openmpi2path)
+        print_status("Adding openmpi to you PATH")
+        self.setup_environment()
+
+    def environment_flavor(self):
+        # prefixes, build profiles and microarchs are modules side by side (e.g. openmpi/4.1.1-debug-1a2b3c4d5e)
+        return f"{self.profile}-{self.flavor()}"
 
-        # exporting OpenMPI to the PATH
-        openmpi_bin = os.path.join(self.prefix, "bin")
-        os.environ['PATH'] += f":{openmpi_bin}"
+    def environment(self):
+        return {"OPENMPI_HOME": self.prefix}, {
+            "PATH": [os.path.join(self.prefix, "bin")],
+            "LD_LIBRARY_PATH": [os.path.join(self.prefix, "lib")],
+            "MANPATH": [os.path.join(self.prefix, "share", "man")]
+        }
 
 
 if __name__ == "__main__":
     parser = Package.cmd_parser()
-    parser.add_argument("--prefix", default="/usr/local/openmpi",
-                        help="Location to install OpenMPI")
+    parser.add_argument("--prefix", nargs='+', default=["/usr/local/openmpi"],
+                        help="Location to install OpenMPI (several prefixes are compiled in parallel from the same source)")
+    parser.add_argument("--profile", choices=list(build_profiles), default="default",
+                        help="Build profile (compiler flags, debug/memchecker and expected transports)")
+    parser.add_argument("--mca-params", dest="mca_params", action="store_true",
+                        help="Generate PREFIX/etc/openmpi-mca-params.conf from the topology and interconnect")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="Generate the MCA parameters choosing the shared-memory ones with a local benchmark")
+    parser.add_argument("--bench", action="store_true",
+                        help="Run the MPI microbenchmarks after the installation and compare them against the baseline")
+    parser.add_argument("--bench-launcher", dest="bench_launcher", choices=["mpirun", "srun"], default="mpirun",
+                        help="Launch the microbenchmarks with mpirun or srun --mpi=pmix")
     args = parser.parse_args()
 
     build_path = os.path.abspath(os.path.expanduser(args.build_dir))
 
-    bpkg =  BuildablePackage(name='openmpi', version='4.1.1',
-                            source='https://download.open-mpi.org/release/open-mpi/v4.1/openmpi-4.1.1.tar.gz',
-                            pkg=OpenMPI, build_path=build_path, uncompressed_dir='openmpi-4.1.1',
-                            prefix=args.prefix)
-
-    pretty_name_distro = distro.os_release_info()['pretty_name']
-    print_status(f"Installing the following packages in {pretty_name_distro}")
-    bpkg_table = [[bpkg.name, bpkg.version, bpkg.source]]
-    print(tabulate(bpkg_table, headers=["Package", "Version", "Source"], tablefmt="pretty"))
-
-    while True:
-            short_answer = input("Proceed with installation? (y/n) ")
-            short_answer = short_answer.lower()
-            if short_answer in ['y', 'yes', 'n', 'no']:
-                if short_answer in ['n', 'no']:
-                    print_failure("Installation was canceled")
-                    exit(1)
-                else:
-                    break
-
-    install_requirements(distro.id(),
-                        only_build_requirements=True)
-
-    PkgClass = bpkg.pkg
-    pkg = PkgClass(**bpkg.init_options())
-
-    installation_options = { # default installation options
-        'no_confirm': True,
-        'avoid_download': False,
-        'avoid_uncompress': False,
-        'avoid_check': True
-    }
-
-    if args.only_compile:
-        installation_options['avoid_download'] = True
-        installation_options['avoid_uncompress'] = True
-
-    if args.avoid_download:
-        installation_options['avoid_download'] = True
-
-    if args.avoid_uncompress:
-        installation_options['avoid_uncompress'] = True
-
-    pkg.doall(**installation_options)
+    bpkgs = [BuildablePackage(name='openmpi', version='4.1.1',
+                              source='https://download.open-mpi.org/release/open-mpi/v4.1/openmpi-4.1.1.tar.gz',
+                              pkg=OpenMPI, build_path=build_path, uncompressed_dir='openmpi-4.1.1',
+                              prefix=prefix,
+                              options={**Package.cmd_options(args),
+                                       'microarch': microarch,
+                                       'profile': args.profile,
+                                       'bench': args.bench,
+                                       'bench_launcher': args.bench_launcher,
+                                       'mca_params': args.mca_params,
+                                       'calibrate': args.calibrate})
+             for prefix in args.prefix for microarch in (args.microarch or [None])]
+
+    install_packages(bpkgs, args, only_build_requirements=True)
@@ -11,19 +11,22 @@
 # Maintainer: glozanoa <glozanoa@uni.pe>
 
 import os
-import distro
-from tabulate import tabulate
-from sbash import Bash
 from fineprint.status import print_status, print_successful, print_failure
 from fineprint.color import ColorStr
 
-from pkg import Package, BuildablePackage
-from linux_requirements import install_requirements
+from pkg import Package, BuildablePackage, install_packages
 
+# modules of pdsh that can be built (besides the ssh rcmd module)
+pdsh_modules = ["exec", "genders", "slurm", "machines", "dshgroups", "netgroup"]
 
 
 class Pdsh(Package):
-    def __init__(self, *, pkgver, source, build_path, uncompressed_dir=None, prefix="/usr/local/pdsh"):
+    bootstrap_cmd = "./bootstrap"
+    footprint = 60 # MB (uncompressed and compiled source)
+
+    def __init__(self, *, pkgver, source, build_path, uncompressed_dir=None, prefix="/usr/local/pdsh",
+                with_modules:list = None, bench_targets:int = None, rcmd_type:str = "ssh", fanout:int = None,
+                **options):
         depends = {
             "ssh": {"Centos": "libssh.x86_64"},
         }
@@ -40,48 +43,69 @@ class Pdsh(Package):
                          makedepends=makedepends,
                          build_path = build_path,
                          uncompressed_dir= uncompressed_dir,
-                         prefix=prefix)
-
+                         prefix=prefix,
+                         **options)
+
+        self.pdsh_modules = with_modules or []
+        unknown = set(self.pdsh_modules) - set(pdsh_modules)
+        if unknown:
+            raise Exception(f"Unknown pdsh modules: {', '.join(unknown)} (modules: {', '.join(pdsh_modules)})")
+        self.bench_targets = bench_targets # run the fan-out benchmark after the installation (see pdsh_bench.py)
+        self.rcmd_type = rcmd_type
+        self.fanout = fanout
+
+    def configure_flags(self):
+        return [
+            f"--prefix={self.prefix}",
+            "--with-ssh"
+        ] + [f"--with-{module}" for module in self.pdsh_modules]
 
     def build(self):
         print_status(f"Building {self.pkgname}-{self.pkgver}")
         print(ColorStr("It can take a while, so go for a coffee ...").StyleBRIGHT)
 
         #import pdb; pdb.set_trace()
-        Bash.exec("./bootstrap", where=self.uncompressed_path)
-        flags = [
-            f"--prefix={self.prefix}",
-            "--with-ssh"
-        ]
-
-        configure = "./configure " + " ".join(flags)
-        Bash.exec(configure, where=self.uncompressed_path)
-        Bash.exec("make", where=self.uncompressed_path)
+        self.configure()
+        self.run_step("make", where=self.objdir)
 
     def install(self):
+        from pdsh_bench import bench_install
+
         print_status(f"Installing {self.pkgname}-{self.pkgver} in {self.prefix}")
         #import pdb; pdb.set_trace()
 
-        Bash.exec("sudo make install", where=self.uncompressed_path)
+        self.run_step("sudo make install", where=self.objdir)
+
+        if self.bench_targets:
+            self.rcmd_type, self.fanout = bench_install(self.prefix, targets=self.bench_targets)
 
         print_status("Adding pdsh to the PATH")
-        pdsh2path = f"""
-# Adding PDSH to the PATH
-export PDSH_RCMD_TYPE=ssh
-export PDSH_HOME={self.prefix}
-export PATH=$PATH:$PDSH_HOME/bin
-export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:$PDSH_HOME/lib
-            """
-
-        with open(os.path.expanduser("~/.bashrc"), 'a') as bashrc:
-            bashrc.write(pdsh2path)
-        
+        self.setup_environment()
+
+    def environment(self):
+        variables = {"PDSH_RCMD_TYPE": self.rcmd_type, "PDSH_HOME": self.prefix}
+        if self.fanout:
+            variables["FANOUT"] = self.fanout
+        return variables, {
+            "PATH": [os.path.join(self.prefix, "bin")],
+            "LD_LIBRARY_PATH": [os.path.join(self.prefix, "lib")],
+            "MANPATH": [os.path.join(self.prefix, "share", "man")]
+        }
+
 
 if __name__ == "__main__":
     parser = Package.cmd_parser()
     parser.add_argument("--prefix", default="/usr/local/pdsh",
                         metavar="/usr/local/pdsh",
                         help="Location to install PDSH")
+    parser.add_argument("--with", dest="with_modules", nargs="+", choices=pdsh_modules, default=[],
+                        help="pdsh modules to build besides ssh (e.g. exec genders slurm)")
+    parser.add_argument("--bench", type=int, metavar="TARGETS", dest="bench_targets",
+                        help="Choose the default rcmd module and fan-out (FANOUT) with a benchmark of TARGETS local sshd stand-ins")
+    parser.add_argument("--rcmd-type", dest="rcmd_type", choices=["ssh", "exec"], default="ssh",
+                        help="Default rcmd module (PDSH_RCMD_TYPE) if the benchmark isn't run")
+    parser.add_argument("--fanout", type=int,
+                        help="Default fan-out (FANOUT) if the benchmark isn't run")
     args = parser.parse_args()
 
     build_path = os.path.abspath(os.path.expanduser(args.build_dir))
@@ -89,44 +113,12 @@ if __name__ == "__main__":
     bpkg = BuildablePackage(name='pdsh', version='2.34',
                             source='https://github.com/chaos/pdsh/releases/download/pdsh-2.34/pdsh-2.34.tar.gz',
                             pkg=Pdsh, build_path=build_path, uncompressed_dir='pdsh-2.34',
-                            prefix=args.prefix)
-
-    pretty_name_distro = distro.os_release_info()['pretty_name']
-    print_status(f"Installing the following packages in {pretty_name_distro}")
-    bpkg_table = [[bpkg.name, bpkg.version, bpkg.source]]
-    print(tabulate(bpkg_table, headers=["Package", "Version", "Source"], tablefmt="pretty"))
-
-    while True:
-            short_answer = input("Proceed with installation? (y/n) ")
-            short_answer = short_answer.lower()
-            if short_answer in ['y', 'yes', 'n', 'no']:
-                if short_answer in ['n', 'no']:
-                    print_failure("Installation was canceled")
-                    exit(1)
-                else:
-                    break
-
-
-    install_requirements(distro.id(), pkgs=["pdsh"])
-
-    PkgClass = bpkg.pkg
-    pkg = PkgClass(**bpkg.init_options())
-
-    installation_options = { # default installation options
-        'no_confirm': True,
-        'avoid_download': False,
-        'avoid_uncompress': False,
-        'avoid_check': True
-    }
-
-    if args.only_compile:
-        installation_options['avoid_download'] = True
-        installation_options['avoid_uncompress'] = True
-
-    if args.avoid_download:
-        installation_options['avoid_download'] = True
-
-    if args.avoid_uncompress:
-        installation_options['avoid_uncompress'] = True
-
-    pkg.doall(**installation_options)
\ No newline at end of file
+                            prefix=args.prefix,
+                            options={**Package.cmd_options(args),
+                                     'with_modules': args.with_modules,
+                                     'bench_targets': args.bench_targets,
+                                     'rcmd_type': args.rcmd_type,
+                                     'fanout': args.fanout})
+
+    install_packages([bpkg], args, requirements=["pdsh"] + (["pdsh-genders"] if "genders" in args.with_modules else [])
+                                                 + (["pdsh-bench"] if args.bench_targets else []))
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+#
+# pdsh fan-out benchmark (command round-trip time across N targets)
+#
+# A local sshd (running as the current user) listens on N loopback
+# addresses (127.0.0.2, 127.0.0.3, ...) that stand in for the nodes of the
+# cluster. 'pdsh -w TARGETS true' is timed with different fan-out widths
+# (-f) and rcmd modules (ssh, and exec running ssh), and the fastest
+# combination is reported. Results are stored alongside the pdsh
+# installation ($prefix/share/hpcluster/pdsh-bench.json).
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import ipaddress
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import tempfile
+import time
+
+from fineprint.status import print_status, print_successful, print_failure
+from tabulate import tabulate
+
+from bench import save_results
+
+
+rcmd_types = ["ssh", "exec"]
+
+fanouts = [4, 8, 16, 32, 64, 128, 256]
+
+
+class SshdStandIn:
+    """
+    sshd of the current user listening on loopback addresses that stand in for cluster nodes
+
+    Attributes:
+    work_dir (str): directory of the keys, configuration and logs
+    targets (int): number of stand-in nodes (loopback addresses)
+    port (int): port of sshd
+    """
+
+    def __init__(self, *, work_dir:str, targets:int, port:int = 2222, sshd:str = "/usr/sbin/sshd"):
+        self.work_dir = work_dir
+        self.targets = targets
+        self.port = port
+        self.sshd = sshd
+        self.process = None
+
+    @property
+    def hosts(self):
+        first = ipaddress.IPv4Address("127.0.0.2")
+        return [str(first + index) for index in range(self.targets)]
+
+    @property
+    def ssh_args(self):
+        """
+        ssh options to connect to the stand-in nodes
+        """
+        return (f"-p {self.port} -i {os.path.join(self.work_dir, 'client_key')} -o BatchMode=yes "
+                f"-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o LogLevel=ERROR")
+
+    def sshd_config(self):
+        lines = [
+            f"Port {self.port}",
+            *[f"ListenAddress {host}" for host in self.hosts],
+            f"HostKey {os.path.join(self.work_dir, 'host_key')}",
+            f"PidFile {os.path.join(self.work_dir, 'sshd.pid')}",
+            f"AuthorizedKeysFile {os.path.join(self.work_dir, 'authorized_keys')}",
+            "PasswordAuthentication no",
+            "UsePAM no",
+            "StrictModes no",
+            # unauthenticated connections of a wide fan-out aren't throttled
+            f"MaxStartups {2 * self.targets + 10}:30:{4 * self.targets + 10}",
+            "LogLevel ERROR"
+        ]
+        return "\n".join(lines) + "\n"
+
+    def start(self, *, timeout:float = 30):
+        os.makedirs(self.work_dir, exist_ok=True)
+        for key in ["host_key", "client_key"]:
+            path = os.path.join(self.work_dir, key)
+            if not os.path.isfile(path):
+                subprocess.run(["ssh-keygen", "-q", "-t", "ed25519", "-N", "", "-f", path], check=True)
+        shutil.copy(os.path.join(self.work_dir, "client_key.pub"), os.path.join(self.work_dir, "authorized_keys"))
+
+        config = os.path.join(self.work_dir, "sshd_config")
+        with open(config, 'w') as config_file:
+            config_file.write(self.sshd_config())
+
+        log = open(os.path.join(self.work_dir, "sshd.log"), 'w')
+        self.process = subprocess.Popen([self.sshd, "-D", "-e", "-f", config], stdout=log, stderr=log)
+        print_status(f"sshd stand-in of {self.targets} nodes listening on port {self.port}")
+
+        start = time.time()
+        while time.time() - start < timeout:
+            if self.process.poll() is not None:
+                raise Exception(f"sshd stand-in failed (see {log.name})")
+            try:
+                socket.create_connection((self.hosts[-1], self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise Exception(f"sshd stand-in isn't listening after {timeout} seconds")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+
+def pdsh_rcmds(pdsh:str):
+    """
+    rcmd modules built in pdsh (pdsh -V)
+    """
+    output = subprocess.run([pdsh, "-V"], capture_output=True, text=True)
+    for line in (output.stdout + output.stderr).splitlines():
+        if line.startswith("rcmd modules:"):
+            return [name.strip() for name in line.split(":", 1)[1].split("(")[0].split(",")]
+    return ["ssh"]
+
+
+def run_pdsh(pdsh:str, hosts, *, rcmd:str, fanout:int, ssh_args:str, command:str = "true"):
+    """
+    Time (seconds) to run command in the hosts with pdsh
+    """
+    env = dict(os.environ)
+    env["PDSH_SSH_ARGS"] = f"{ssh_args} -l%u %h"
+    cmd = [pdsh, "-R", rcmd, "-f", str(fanout), "-w", ",".join(hosts)]
+    if rcmd == "exec":
+        cmd += ["ssh", *ssh_args.split(), "%h", command]
+    else:
+        cmd.append(command)
+
+    start = time.perf_counter()
+    subprocess.run(cmd, env=env, capture_output=True, text=True, check=True)
+    return time.perf_counter() - start
+
+
+def fanout_bench(pdsh:str, *, targets:int = 64, widths=None, rcmds=None, repeat:int = 3,
+                 port:int = 2222, sshd:str = "/usr/sbin/sshd"):
+    """
+    Measure the round-trip time of pdsh across targets stand-in nodes for each rcmd module and fan-out width
+    Return a list of results (rcmd, fanout, targets, seconds, per_target_ms)
+    """
+    available = pdsh_rcmds(pdsh)
+    rcmds = [rcmd for rcmd in (rcmds or rcmd_types) if rcmd in available]
+    widths = widths or sorted({width for width in fanouts if width < targets} | {targets})
+
+    work_dir = tempfile.mkdtemp(prefix="hpcluster-pdsh-bench-")
+    standin = SshdStandIn(work_dir=work_dir, targets=targets, port=port, sshd=sshd)
+    try:
+        standin.start()
+        results = []
+        for rcmd in rcmds:
+            for width in widths:
+                seconds = statistics.median(run_pdsh(pdsh, standin.hosts, rcmd=rcmd, fanout=width,
+                                                     ssh_args=standin.ssh_args)
+                                            for _ in range(repeat))
+                print_status(f"pdsh -R {rcmd} -f {width}: {seconds:.3f}s across {targets} nodes")
+                results.append({
+                    "rcmd": rcmd,
+                    "fanout": width,
+                    "targets": targets,
+                    "seconds": round(seconds, 4),
+                    "per_target_ms": round(seconds / targets * 1000, 3)
+                })
+        return results
+    finally:
+        standin.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def optimum(results):
+    """
+    Fastest rcmd module and fan-out width (the smallest width among ties within 5%)
+    """
+    best = min(result["seconds"] for result in results)
+    candidates = [result for result in results if result["seconds"] <= best * 1.05]
+    fastest = min(candidates, key=lambda result: (result["fanout"], result["seconds"]))
+    return fastest["rcmd"], fastest["fanout"]
+
+
+def results_path(prefix:str):
+    return os.path.join(prefix, "share", "hpcluster", "pdsh-bench.json")
+
+
+def bench_install(prefix:str, *, targets:int = 64, **options):
+    """
+    Run the benchmark with the pdsh of an installation and store the results with it
+    Return the optimum rcmd module and fan-out width
+    """
+    results = fanout_bench(os.path.join(prefix, "bin", "pdsh"), targets=targets, **options)
+    rcmd, fanout = optimum(results)
+    print(tabulate([[result["rcmd"], result["fanout"], result["seconds"], result["per_target_ms"],
+                     "*" if (result["rcmd"], result["fanout"]) == (rcmd, fanout) else ""]
+                    for result in results],
+                   headers=["rcmd", "Fan-out", "Time (s)", "Per node (ms)", "Optimum"], tablefmt="pretty"))
+    save_results(results_path(prefix), "pdsh-fanout", results, sudo=True, rcmd=rcmd, fanout=fanout)
+    print_successful(f"Optimum: PDSH_RCMD_TYPE={rcmd} FANOUT={fanout}")
+    return rcmd, fanout
+
+
+def pdsh_bench_args():
+    parser = argparse.ArgumentParser(description="pdsh fan-out benchmark with local sshd stand-ins")
+    parser.add_argument("--prefix", default="/usr/local/pdsh",
+                        help="Location of pdsh (results are stored in PREFIX/share/hpcluster)")
+    parser.add_argument("-n", "--targets", type=int, default=64,
+                        help="Number of stand-in nodes")
+    parser.add_argument("-f", "--fanout", type=int, nargs="+", dest="widths",
+                        help="Fan-out widths (default: powers of 2 up to the number of targets)")
+    parser.add_argument("-R", "--rcmd", nargs="+", dest="rcmds", choices=rcmd_types,
+                        help="rcmd modules (default: the ones built in pdsh)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs of each combination (median)")
+    parser.add_argument("--port", type=int, default=2222,
+                        help="Port of the sshd stand-in")
+    parser.add_argument("--sshd", default="/usr/sbin/sshd",
+                        help="sshd binary")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = pdsh_bench_args()
+
+    try:
+        bench_install(args.prefix, targets=args.targets, widths=args.widths, rcmds=args.rcmds,
+                      repeat=args.repeat, port=args.port, sshd=args.sshd)
+
+    except subprocess.CalledProcessError as error:
+        print_failure(f"{' '.join(error.cmd)} failed: {error.stderr}")
+        exit(1)
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
@@ -6,19 +6,48 @@
 
 import argparse
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import errno
+import hashlib
+import json
 import os
+import platform
+import shutil
+import subprocess
 import sys
+import time
 import zipfile
 import tarfile
 
 from fineprint.status import print_status, print_successful, print_failure
 from fineprint.color import ColorStr
-from sbash import Bash
 
 from pkg_exceptions import UnsupportedCompression
 
+# sbash and the modules of the optional stages (shared build directory, native packages, microarch, ...)
+# are imported where they're used, so a package script starts (e.g. --help) without them
 
 
+stages = ["prepare", "build", "install"] # last stage run by doall (see cmd_parser)
+roles = ["installer", "node"] # roles of the shared-prefix mode (see shared_prefix.py)
+
+
+def available_memory(path:str):
+    """
+    Available space (MB) in a memory filesystem (tmpfs) mounted in path.
+    Pages of tmpfs are taken from RAM, so the available memory of the system is also considered
+    """
+    stat = os.statvfs(path)
+    available = stat.f_bavail * stat.f_frsize // 2**20
+
+    with open("/proc/meminfo") as meminfo:
+        for line in meminfo:
+            if line.startswith("MemAvailable:"):
+                available = min(available, int(line.split()[1]) // 1024)
+                break
+
+    return available
+
 
 class Package:
 
@@ -31,6 +60,20 @@ class Package:
     depends (list): dependences of packages in the standard repositories
     makedepends (list):  dependences of buildables packages.
 
+    out_of_tree (bool): build in a separated directory per flavor (see objdir)
+    tmpfs (str): memory filesystem (e.g. /dev/shm) where the source is uncompressed and compiled
+    shared (bool): build_path is shared by several nodes (e.g. NFS), the source is prepared
+                   by a single node and each node compiles in its own directory
+    native_pkg (str): directory where a distro-native package (rpm, deb or pkg.tar) is saved
+    microarch (str): CPU microarchitecture level of the build (-march), e.g. x86-64-v3 (see microarch.py)
+    artifacts (str): artifact store where the staged installation is saved (under the microarch key)
+    modules (bool): install the environment of the package as a modulefile instead of a profile.d script
+    role (str): shared-prefix mode (see shared_prefix.py), the installer installs the package in
+                a shared prefix and the nodes only install its node-local files and setup
+    warmup (bool): read the binaries and libraries of the prefix into the page cache (node role)
+    native_depends (list): buildable packages needed to run the package (e.g. slurm needs munge)
+    footprint (int): disk space (MB) used by the uncompressed and compiled source
+
     Methods:
     prepare: Download and uncompress the source code
     build: simple build for the package(use inheritance for more complex builds)
@@ -38,8 +81,15 @@ class Package:
     package: simple installation (use inheritance for more complex installations)
     """
 
+    bootstrap_cmd = None # command to generate the configure script (e.g. ./bootstrap)
+    native_depends = []
+    footprint = None # MB used by the uncompressed and compiled source (None: unknown)
+    tmpfs_reserve = 1024 # MB of memory left free for compilers when a tmpfs is used
+
     def __init__(self, pkgname, *, pkgver, source, depends=None, makedepends=None, 
-                build_path, uncompressed_dir=None, prefix=None):
+                build_path, uncompressed_dir=None, prefix=None, out_of_tree=False,
+                tmpfs=None, shared=False, native_pkg=None, microarch=None, artifacts=None, modules=False,
+                role=None, warmup=False):
         self.pkgname=pkgname
         self.pkgver=pkgver
         self.source=source # link to the source code (compressed file)
@@ -48,6 +98,18 @@ class Package:
         self.build_path = build_path
         self.uncompressed_dir = uncompressed_dir
         self.prefix = prefix
+        self.out_of_tree = out_of_tree
+        self.tmpfs = tmpfs
+        self.shared = shared
+        self.native_pkg = native_pkg
+        self.microarch = microarch
+        self.artifacts = artifacts
+        self.modules = modules
+        self.role = role
+        self.warmup = warmup
+        if shared: # the shared source is never modified, each node compiles out of tree
+            self.out_of_tree = True
+        self.work_path = build_path # where the source is uncompressed and compiled
         if uncompressed_dir:
             self.uncompressed_path = os.path.join(build_path, uncompressed_dir) #path of uncompressed directory
         else:
@@ -93,11 +155,43 @@ class Package:
 
         if self.build_path is not None:
             self.build_path = os.path.abspath(self.build_path)
-            if not (os.path.exists(self.build_path) and os.path.isdir(self.build_path)):
-                os.mkdir(self.build_path)
+            os.makedirs(self.build_path, exist_ok=True) # other nodes can create it at the same time
         else:
             self.build_path = os.getcwd()
 
+        if self.shared:
+            from nfslock import FileLock
+            # only a node downloads and uncompresses the source, the other ones wait and reuse it
+            with FileLock(self.shared_lock):
+                if os.path.isfile(self.shared_stamp):
+                    with open(self.shared_stamp) as stamp:
+                        print_status(f"Reusing {self.pkgname}-{self.pkgver} source prepared by {stamp.read().strip()}")
+                    self.fetch(avoid_download=True, avoid_uncompress=True)
+                else:
+                    if os.path.isfile(os.path.join(self.build_path, os.path.basename(self.source))):
+                        avoid_download = True
+                    self.fetch(avoid_download=avoid_download, avoid_uncompress=avoid_uncompress)
+                    self.bootstrap()
+                    with open(self.shared_stamp, 'w') as stamp:
+                        stamp.write(f"{platform.node()}\n")
+        else:
+            self.fetch(avoid_download=avoid_download, avoid_uncompress=avoid_uncompress)
+
+        print_successful(f"Package {self.pkgname}-{self.pkgver} was prepared")
+
+    @property
+    def shared_lock(self):
+        return os.path.join(self.build_path, f".{self.pkgname}-{self.pkgver}.lock")
+
+    @property
+    def shared_stamp(self):
+        return os.path.join(self.build_path, f".{self.pkgname}-{self.pkgver}.prepared")
+
+    def fetch(self, *, avoid_download=False, avoid_uncompress=False):
+        """
+        Download the source code in build_path and uncompress it in work_path
+        """
+        from sbash import Bash
         if not avoid_download:
             print_status(f"Downloading {os.path.basename(self.source)}")
             Bash.exec(f"wget {self.source}", where=self.build_path)
@@ -105,24 +199,187 @@ class Package:
         ## uncompress
         compressed_file = os.path.join(self.build_path, os.path.basename(self.source))
 
+        self.work_path = self.select_work_path(reuse=avoid_uncompress)
         if not avoid_uncompress:
             print_status(f"Uncompressing {compressed_file}")
-            if zipfile.is_zipfile(compressed_file): # source was compressed using zip
-                with zipfile.ZipFile(compressed_file, 'r') as zip_compressed_file:
-                    zip_compressed_file.extractall(self.build_path)
-
-            elif tarfile.is_tarfile(compressed_file): # source was compressed using tar
-                with tarfile.open(compressed_file, 'r') as tar_compressed_file:
-                    tar_compressed_file.extractall(self.build_path)
-            else:
-                raise UnsupportedCompression(["zip", "tar"])
-
-        if self.uncompressed_path is None:
-            self.uncompressed_path = os.path.join(self.build_path, f"{self.pkgname}-{self.pkgver}")
+            try:
+                self.uncompress(compressed_file, self.work_path)
+            except OSError as error:
+                if error.errno != errno.ENOSPC or self.work_path == self.build_path:
+                    raise
+                print_failure(f"{self.tmpfs} is full, uncompressing {compressed_file} in {self.build_path}")
+                self.cleanup()
+                self.work_path = self.build_path
+                self.uncompress(compressed_file, self.work_path)
+
+        if self.uncompressed_dir:
+            self.uncompressed_path = os.path.join(self.work_path, self.uncompressed_dir)
+        else:
+            self.uncompressed_path = os.path.join(self.work_path, f"{self.pkgname}-{self.pkgver}")
             if not os.path.isdir(self.uncompressed_path):
                 raise Exception("Supply the name of the uncompressed directory")
 
-        print_successful(f"Package {self.pkgname}-{self.pkgver} was prepared")
+        if not avoid_uncompress and os.path.isfile(self.bootstrap_stamp):
+            os.remove(self.bootstrap_stamp) # fresh source, so bootstrap it again
+
+    def uncompress(self, compressed_file, where):
+        """
+        Uncompress the source code (zip or tar) in where
+        """
+        if zipfile.is_zipfile(compressed_file): # source was compressed using zip
+            with zipfile.ZipFile(compressed_file, 'r') as zip_compressed_file:
+                zip_compressed_file.extractall(where)
+
+        elif tarfile.is_tarfile(compressed_file): # source was compressed using tar
+            with tarfile.open(compressed_file, 'r') as tar_compressed_file:
+                tar_compressed_file.extractall(where)
+        else:
+            raise UnsupportedCompression(["zip", "tar"])
+
+    @property
+    def tmpfs_path(self):
+        if self.tmpfs is None:
+            return None
+        return os.path.join(self.tmpfs, f"hpcluster-{os.getuid()}", f"{self.pkgname}-{self.pkgver}")
+
+    def select_work_path(self, *, reuse=False):
+        """
+        Select where the source is uncompressed and compiled.
+        The tmpfs is used only if the footprint of the package fits in the available memory,
+        otherwise (or if tmpfs isn't enabled) the build directory is used (spill to disk).
+        If reuse is True, the source was uncompressed before: in the tmpfs if it's
+        there, otherwise in the build directory (it spilled or the tmpfs was released).
+        """
+        if self.tmpfs is None:
+            return self.build_path
+
+        if self.shared:
+            print_status(f"The shared source of {self.pkgname}-{self.pkgver} is uncompressed in {self.build_path} (tmpfs isn't used)")
+            return self.build_path
+
+        if reuse:
+            if os.path.isdir(self.tmpfs_path):
+                return self.tmpfs_path
+            print_status(f"{self.pkgname}-{self.pkgver} isn't uncompressed in {self.tmpfs}, reusing {self.build_path}")
+            return self.build_path
+
+        if self.footprint is None:
+            print_status(f"Footprint of {self.pkgname}-{self.pkgver} is unknown, using {self.build_path}")
+            return self.build_path
+
+        available = available_memory(self.tmpfs)
+        required = self.footprint + self.tmpfs_reserve
+        if available < required:
+            print_status(f"Not enough memory in {self.tmpfs} ({available} MB available, {required} MB required), using {self.build_path}")
+            return self.build_path
+
+        print_status(f"Using {self.tmpfs_path} to uncompress and compile {self.pkgname}-{self.pkgver}")
+        os.makedirs(self.tmpfs_path, exist_ok=True)
+        return self.tmpfs_path
+
+    def cleanup(self):
+        """
+        Release the memory used in the tmpfs (the downloaded source is kept in build_path)
+        """
+        if self.tmpfs_path is not None and os.path.isdir(self.tmpfs_path):
+            shutil.rmtree(self.tmpfs_path, ignore_errors=True)
+            self.work_path = self.build_path
+
+    def configure_flags(self):
+        """
+        Flags supplied to the configure script (use inheritance to customize them)
+        """
+        return []
+
+    def flavor(self):
+        """
+        Key of the build flavor (prefix, configure flags and microarch)
+        """
+        flavor = " ".join([str(self.prefix)] + self.configure_flags())
+        if self.microarch is not None:
+            flavor += f" microarch={self.microarch}"
+        return hashlib.sha1(flavor.encode()).hexdigest()[:10]
+
+    @property
+    def log_path(self):
+        """
+        Output of the build steps (kept in build_path, also when the source is compiled in the tmpfs)
+        """
+        log = f"{self.pkgname}-{self.pkgver}-{self.flavor()}.log"
+        if self.shared:
+            return os.path.join(self.build_path, "hosts", platform.node(), "logs", log)
+        return os.path.join(self.build_path, "logs", log)
+
+    def run_step(self, cmd:str, *, where:str = None):
+        """
+        Run a build step (e.g. configure, make) showing its output and appending it to log_path
+        """
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        with open(self.log_path, 'a') as log:
+            log.write(f"### {time.strftime('%Y-%m-%d %H:%M:%S')} {where or os.getcwd()}: {cmd}\n")
+            log.flush()
+            process = subprocess.Popen(cmd, shell=True, cwd=where, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, text=True, errors="replace")
+            for line in process.stdout:
+                sys.stdout.write(line)
+                log.write(line)
+            returncode = process.wait()
+
+        if returncode != 0:
+            raise Exception(f"{cmd} failed (exit status {returncode}), its output is in {self.log_path}")
+
+    @property
+    def objdir(self):
+        """
+        Directory where the package is compiled.
+        If out_of_tree is enabled each flavor is compiled in its own directory (VPATH build),
+        so the uncompressed source is shared by all the flavors, otherwise the package
+        is compiled in the uncompressed directory. If build_path is shared, each host
+        compiles in its own directory (build_path/hosts/HOSTNAME)
+        """
+        objdir = f"{self.pkgname}-{self.pkgver}-build-{self.flavor()}"
+        if self.shared:
+            return os.path.join(self.build_path, "hosts", platform.node(), objdir)
+        if self.out_of_tree:
+            return os.path.join(self.work_path, objdir)
+        return self.uncompressed_path
+
+    @property
+    def bootstrap_stamp(self):
+        return os.path.join(self.uncompressed_path, ".hpcluster-bootstrap")
+
+    def bootstrap(self):
+        """
+        Generate the configure script running bootstrap_cmd
+        (only once per uncompressed source, so flavors can share it)
+        """
+        if self.bootstrap_cmd is None or os.path.isfile(self.bootstrap_stamp):
+            return
+
+        if self.shared and os.path.isfile(self.shared_stamp):
+            raise Exception(f"The shared source of {self.pkgname}-{self.pkgver} wasn't bootstrapped")
+
+        print_status(f"Running {self.bootstrap_cmd}")
+        self.run_step(self.bootstrap_cmd, where=self.uncompressed_path)
+        open(self.bootstrap_stamp, 'w').close()
+
+    def configure(self):
+        """
+        Run the configure script (with configure_flags) in objdir
+        """
+        from microarch import microarch_flags
+        self.bootstrap()
+
+        configure = "./configure"
+        if self.out_of_tree:
+            os.makedirs(self.objdir, exist_ok=True)
+            configure = os.path.join(self.uncompressed_path, "configure")
+
+        flags = self.configure_flags()
+        if self.microarch is not None:
+            flags = microarch_flags(flags, self.microarch)
+        configure = " ".join([configure] + flags)
+        self.run_step(configure, where=self.objdir)
 
     def build(self): # simple build(use inheritance for more complex builds)
         """
@@ -132,8 +389,8 @@ class Package:
         print(ColorStr("It can take a while, so go for a cafe ...").StyleBRIGHT)
         #import pdb; pdb.set_trace()
 
-        Bash.exec("./configure", where=self.uncompressed_path)
-        Bash.exec("make", where=self.uncompressed_path)
+        self.configure()
+        self.run_step("make", where=self.objdir)
 
 
     def check(self):
@@ -142,7 +399,7 @@ class Package:
         """
         #import pdb; pdb.set_trace()
 
-        Bash.exec("make check", where=self.uncompressed_path)
+        self.run_step("make check", where=self.objdir)
 
 
     def install(self): # simple installation(use inheritance for more complex installations)
@@ -152,34 +409,170 @@ class Package:
         print_status(f"Installing {self.pkgname}-{self.pkgver}")
         #import pdb; pdb.set_trace()
 
-        Bash.exec("sudo make install", where=self.uncompressed_path)
+        self.run_step("sudo make install", where=self.objdir)
 
+    @property
+    def stage_path(self):
+        """
+        Directory where the package is installed (staged) to build native packages
+        """
+        stage = f"{self.pkgname}-{self.pkgver}-{self.flavor()}"
+        if self.shared:
+            return os.path.join(self.build_path, "hosts", platform.node(), "stage", stage)
+        return os.path.join(self.build_path, "stage", stage)
+
+    def stage(self):
+        """
+        Install the compiled source in stage_path (without root privileges)
+        """
+        print_status(f"Staging {self.pkgname}-{self.pkgver} in {self.stage_path}")
+        if os.path.isdir(self.stage_path):
+            shutil.rmtree(self.stage_path)
+        os.makedirs(self.stage_path)
+
+        self.run_step(f"make install DESTDIR={self.stage_path}", where=self.objdir)
+
+    def node_setup(self):
+        """
+        Commands (run as root) to configure a node after the package is installed,
+        e.g. users, spool and log directories (use inheritance to add them)
+        """
+        return []
+
+    def stage_install(self):
+        """
+        Stage the package and save its node setup next to the staged installation
+        (stage_path.json, read by squashfs_export.py)
+        """
+        self.stage()
+        with open(f"{self.stage_path}.json", 'w') as stage_file:
+            json.dump({"node_setup": self.node_setup()}, stage_file, indent=2)
+
+    def environment(self):
+        """
+        Variables and paths (e.g. {"PATH": [bin]}) of the installed package (use inheritance to add them)
+        """
+        return {}, {}
+
+    def environment_flavor(self):
+        """
+        Name of the flavor in its module version (PKG/VERSION-FLAVOR) if several flavors
+        of the package can be installed side by side, otherwise None
+        """
+        return None
+
+    def setup_environment(self):
+        """
+        Install the environment of the package (profile.d script or modulefile, see environment.py)
+        """
+        from environment import install_environment
+        variables, paths = self.environment()
+        if variables or paths:
+            install_environment(self.pkgname, self.pkgver, variables=variables, paths=paths,
+                                modules=self.modules, flavor=self.environment_flavor())
+
+    def package(self):
+        """
+        Build a distro-native package (rpm, deb or pkg.tar) from the staged installation
+        """
+        from native_pkg import native_package
+        self.stage_install()
+        return native_package(self, self.native_pkg)
+
+    def store_artifact(self):
+        """
+        Save the staged installation in the artifact store (see microarch.py)
+        """
+        from microarch import store_artifact
+        if not self.native_pkg: # otherwise it was staged by package
+            self.stage_install()
+        return store_artifact(self, self.artifacts)
+
+    def node_configure(self):
+        """
+        Node-local configuration of the package in the node role besides
+        the node setup commands, e.g. the munge key (use inheritance to add it)
+        """
+        pass
+
+    def export_node_files(self):
+        """
+        Save the node-local files, node setup and environment in the shared prefix (installer role)
+        """
+        from shared_prefix import export_node_files
+        if not (self.native_pkg or self.artifacts): # otherwise it was staged already
+            self.stage_install()
+        return export_node_files(self)
+
+    def node_install(self):
+        """
+        Configure this node to use the package installed in the shared prefix (node role)
+        """
+        from shared_prefix import install_node_files, warmup
+        install_node_files(self)
+        self.node_configure()
+        if self.warmup:
+            warmup(self.prefix)
+        print_successful(f"{self.pkgname}-{self.pkgver} of {self.prefix} was configured in this node")
 
     def doall(self, *,
               avoid_download=False, avoid_uncompress=False,
-              avoid_check=True, no_confirm=False):
+              avoid_check=True, no_confirm=False, install=None, stage="install"):
         """
         Install the buildable package(build, check, and install)
+        stage is the last stage to run (prepare, build or install), e.g. to build the
+        package in a node and install it later (avoiding download and uncompress)
+        By default a microarch variant is only installed if this host can run it
+        In the node role of the shared-prefix mode only the node-local setup is done
         """
         try:
+            if self.role == "node":
+                self.node_install()
+                return
+
             self.prepare(avoid_download = avoid_download,
                          avoid_uncompress = avoid_uncompress,
                          no_confirm = no_confirm)
+            if stage == "prepare":
+                return
+
             self.build()
 
             if not avoid_check:
                 self.check()
 
-            self.install()
+            if stage == "build":
+                print_successful(f"{self.pkgname}-{self.pkgver} was built in {self.objdir}")
+                return
+
+            if install is None:
+                from microarch import detect_microarch, can_run
+                install = can_run(self.microarch, detect_microarch())
+            if install:
+                self.install()
+            else:
+                print_status(f"{self.pkgname}-{self.pkgver} ({self.microarch}) isn't installed in this host")
+            if self.native_pkg:
+                self.package()
+            if self.artifacts:
+                self.store_artifact()
+            if self.role == "installer" and install:
+                self.export_node_files()
+            self.cleanup()
             print_successful(f"Sucefully installation of {self.pkgname}-{self.pkgver}")
 
         except Exception as error:
             print_failure(error)
             print_failure(f"Failed installation of {self.pkgname}-{self.pkgver}")
+            self.cleanup() # the output of the build steps is kept in log_path
 
     @staticmethod
     def cmd_parser():
+        from microarch import level_names # choices of --microarch (microarch.py only needs the standard library)
+
         pkg_parser = argparse.ArgumentParser()
+        pkg_parser.add_argument("stage", nargs='?', choices=stages, default="install",
+                        help="Last stage to run: prepare (download and uncompress), build or install (default)")
         pkg_parser.add_argument('-b','--build-dir', dest='build_dir', required=True,
                         help="Directory where packages will be downloaded, uncompressed and compiled")
 
@@ -192,13 +585,119 @@ class Package:
                                          help="Do not download package")
         installation_parser.add_argument("--avoid-uncompress", dest='avoid_uncompress', action='store_true',
                                          help="Do not uncompress package")
+        installation_parser.add_argument("--out-of-tree", dest='out_of_tree', action='store_true',
+                                         help="Compile each flavor (prefix and flags) in its own build directory")
+        installation_parser.add_argument("--tmpfs", nargs='?', const='/dev/shm', metavar='/dev/shm',
+                                         help="Uncompress and compile in a memory filesystem (spill to build directory if memory is short)")
+        installation_parser.add_argument("--shared-build-dir", dest='shared', action='store_true',
+                                         help="Build directory is shared by several nodes (NFS): prepare the source once and compile per host")
+        installation_parser.add_argument("--native-pkg", dest='native_pkg', metavar='REPO_DIR',
+                                         help="Also build a distro-native package (rpm, deb or pkg.tar) in REPO_DIR")
+        installation_parser.add_argument("--microarch", nargs='+', choices=level_names, metavar='LEVEL',
+                                         help=f"Build a variant per CPU microarchitecture level ({', '.join(level_names)})")
+        installation_parser.add_argument("--artifacts", metavar='DIR',
+                                         help="Save the staged installation in the artifact store DIR (under the microarch key)")
+        installation_parser.add_argument("--modules", action='store_true',
+                                         help="Install the environment of the packages as modulefiles instead of /etc/profile.d scripts")
+
+        shared_parser = pkg_parser.add_argument_group("Shared prefix (e.g. NFS /opt)")
+        shared_parser.add_argument("--role", choices=roles,
+                                   help="installer: install in the shared prefix and save the node-local files, "
+                                        "node: only install the node-local files and setup (users, spool and log directories, services)")
+        shared_parser.add_argument("--warmup", action='store_true',
+                                   help="Read the binaries and libraries of the prefix into the page cache (node role)")
         return pkg_parser
 
+    @staticmethod
+    def cmd_options(args):
+        """
+        Package options supplied in the command line (see cmd_parser)
+        """
+        return {'out_of_tree': args.out_of_tree,
+                'tmpfs': args.tmpfs,
+                'shared': args.shared,
+                'native_pkg': args.native_pkg,
+                'artifacts': args.artifacts,
+                'modules': args.modules,
+                'role': args.role,
+                'warmup': args.warmup}
+
+
+def _build_flavor(pkg):
+    pkg.build()
+    return pkg
+
+
+def doall_flavors(pkgs, *, jobs=None,
+                  avoid_download=False, avoid_uncompress=False,
+                  avoid_check=True, no_confirm=False, stage="install"):
+    """
+    Install several flavors of the same package (e.g. OpenMPI in different prefixes).
+    The source is downloaded and uncompressed only once and all the flavors are
+    compiled in parallel (out of tree), then they are checked and installed one by one
+    (only the best microarch variant of each flavor that this host can run is installed)
+    In the node role of the shared-prefix mode only the node-local setup of each prefix is done
+    """
+    from microarch import select_variants
+
+    first = pkgs[0]
+    try:
+        if first.role == "node":
+            for pkg in select_variants(pkgs):
+                pkg.node_install()
+            return
+
+        first.prepare(avoid_download = avoid_download,
+                      avoid_uncompress = avoid_uncompress,
+                      no_confirm = no_confirm)
+        first.bootstrap()
+        if stage == "prepare":
+            return
+
+        for pkg in pkgs:
+            pkg.out_of_tree = True
+            pkg.build_path = first.build_path
+            pkg.work_path = first.work_path
+            pkg.uncompressed_path = first.uncompressed_path
+
+        print_status(f"Building {len(pkgs)} flavors of {first.pkgname}-{first.pkgver}")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            pkgs = list(executor.map(_build_flavor, pkgs))
+
+        if stage == "build":
+            if not avoid_check:
+                for pkg in pkgs:
+                    pkg.check()
+            print_successful(f"{len(pkgs)} flavors of {first.pkgname}-{first.pkgver} were built")
+            return
+
+        installable = select_variants(pkgs)
+        for pkg in pkgs:
+            if not avoid_check:
+                pkg.check()
+
+            if pkg in installable:
+                pkg.install()
+            if pkg.native_pkg:
+                pkg.package()
+            if pkg.artifacts:
+                pkg.store_artifact()
+            if pkg.role == "installer" and pkg in installable:
+                pkg.export_node_files()
+            print_successful(f"Sucefully installation of {pkg.pkgname}-{pkg.pkgver} (flavor: {pkg.flavor()})")
+
+        first.cleanup()
+
+    except Exception as error:
+        print_failure(error)
+        print_failure(f"Failed installation of {first.pkgname}-{first.pkgver}")
+        first.cleanup() # the output of the build steps is kept in the log_path of each flavor
+
 
 class BuildablePackage:
     def __init__(self, *, name:str, version:str, source:str,
                 pkg: Package, build_path:str, uncompressed_dir:str, 
-                prefix:str = None):
+                prefix:str = None, options:dict = None):
 
         self.name = name
         self.version = version
@@ -207,6 +706,7 @@ class BuildablePackage:
         self.build_path = build_path
         self.uncompressed_dir = uncompressed_dir
         self.prefix = prefix
+        self.options = options if options is not None else {}
 
     def init_options(self):
         options = {'pkgver':self.version, 'source': self.source,
@@ -215,4 +715,74 @@ class BuildablePackage:
         if self.prefix is not None:
             options['prefix'] = self.prefix
 
-        return  options
\ No newline at end of file
+        options.update(self.options)
+        return  options
+
+
+def confirm(question:str):
+    """
+    Ask a yes/no question until it's answered
+    """
+    while True:
+        answer = input(f"{question} (y/n) ").lower()
+        if answer in ["y", "yes"]:
+            return True
+        if answer in ["n", "no"]:
+            return False
+
+
+def install_packages(bpkgs, args, *, requirements=None, only_build_requirements=False, in_tree=False):
+    """
+    Install buildable packages from the command line of a package script (see Package.cmd_parser):
+    print them, ask for confirmation, install the OS requirements (requirements of
+    linux_requirements.py, none if it's None) and run the stages up to args.stage.
+    Several flavors are compiled in parallel (see doall_flavors), unless in_tree is
+    enabled, then they are compiled one by one in the source tree
+    """
+    # only needed by the command line, so importing a package module doesn't load them
+    import distro
+    from tabulate import tabulate
+    from linux_requirements import install_requirements
+    from microarch import select_variants
+
+    headers = ["Package", "Version", "Source"]
+    table = [[bpkg.name, bpkg.version, bpkg.source] for bpkg in bpkgs]
+    if any(bpkg.prefix for bpkg in bpkgs):
+        headers.append("Prefix")
+        for bpkg, row in zip(bpkgs, table):
+            row.append(bpkg.prefix or "-")
+    if any(bpkg.options.get('microarch') for bpkg in bpkgs):
+        headers.append("Microarch")
+        for bpkg, row in zip(bpkgs, table):
+            row.append(bpkg.options.get('microarch') or "generic")
+
+    print_status(f"Installing the following packages in {distro.os_release_info()['pretty_name']}")
+    print(tabulate(table, headers=headers, tablefmt="pretty"))
+
+    if not confirm("Proceed with installation?"):
+        print_failure("Installation was canceled")
+        sys.exit(1)
+
+    if (requirements is not None or only_build_requirements) and not args.no_ospkgs:
+        install_requirements(distro.id(), pkgs=requirements, only_build_requirements=only_build_requirements)
+
+    installation_options = { # default installation options
+        'no_confirm': True,
+        'avoid_download': args.only_compile or args.avoid_download,
+        'avoid_uncompress': args.only_compile or args.avoid_uncompress,
+        'avoid_check': True,
+        'stage': args.stage
+    }
+
+    pkgs = [bpkg.pkg(**bpkg.init_options()) for bpkg in bpkgs]
+    if len(pkgs) == 1:
+        pkgs[0].doall(**installation_options)
+    elif in_tree:
+        # variants are compiled one by one in the source tree, only the best one this host can run is installed
+        installable = select_variants(pkgs)
+        for pkg in pkgs:
+            pkg.doall(**installation_options, install=pkg in installable)
+            installation_options['avoid_download'] = True
+    else:
+        doall_flavors(pkgs, **installation_options)
+    return pkgs
@@ -11,18 +11,32 @@
 # Maintainer: glozanoa <glozanoa@uni.pe>
 
 import os
-import distro
-from tabulate import tabulate
-from sbash import Bash
 from fineprint.status import print_status, print_successful, print_failure
 from fineprint.color import ColorStr
 
-from pkg import Package, BuildablePackage
-from linux_requirements import install_requirements
+from pkg import Package, BuildablePackage, install_packages
+
+
+build_profiles = {
+    "default": [],
+    # components linked in libpmix (no dlopen at launch) without debug, timing and valgrind support
+    "optimized": [
+        "--disable-debug",
+        "--disable-pmix-timing",
+        "--without-valgrind",
+        "--disable-dlopen",
+        "CFLAGS='-O3'"
+    ]
+}
 
 
 class Pmix(Package):
-    def __init__(self, *, pkgver, source, build_path, uncompressed_dir=None):
+    bootstrap_cmd = "./autogen.pl"
+    footprint = 300 # MB (uncompressed and compiled source)
+    native_depends = ["munge"]
+
+    def __init__(self, *, pkgver, source, build_path, uncompressed_dir=None,
+                 profile:str = "default", mpi_prefix:str = None, launcher:str = "srun", **options):
         depends = {
             "gcc": {"Centos": "gcc.x86_64"},
             "libevent": {"Centos": "libevent-devel.x86_64"},
@@ -41,69 +55,66 @@ class Pmix(Package):
                          depends=depends,
                          makedepends=makedepends,
                          build_path=build_path,
-                         uncompressed_dir=uncompressed_dir)
+                         uncompressed_dir=uncompressed_dir,
+                         **options)
 
-    def build(self):
-        print_status(f"Building {self.pkgname}-{self.pkgver}")
-        print(ColorStr("It can take a while, so go for a coffee ...").StyleBRIGHT)
+        if profile not in build_profiles:
+            raise Exception(f"Unknown build profile {profile} (profiles: {', '.join(build_profiles)})")
+        self.profile = profile
+        self.mpi_prefix = mpi_prefix # OpenMPI used by the launch benchmark (see pmix_bench.py)
+        self.launcher = launcher
 
-        Bash.exec("./autogen.pl", where=self.uncompressed_path)
-        flags = [
+    def configure_flags(self):
+        return [
             "--prefix=/usr",
             "--with-libevent",
             "--with-zlib",
             "--with-munge"
-        ]
+        ] + build_profiles[self.profile]
+
+    def build(self):
+        print_status(f"Building {self.pkgname}-{self.pkgver}")
+        print(ColorStr("It can take a while, so go for a coffee ...").StyleBRIGHT)
+
+        self.configure()
+        self.run_step("make", where=self.objdir)
+
+    def install(self):
+        from pmix_bench import bench_install
 
-        configure = "./configure " + " ".join(flags)
-        Bash.exec(configure, where=self.uncompressed_path)
-        Bash.exec("make", where=self.uncompressed_path)
+        super().install()
+
+        if self.mpi_prefix is None:
+            return
+
+        if not os.path.isfile(os.path.join(self.mpi_prefix, "bin", "mpicc")):
+            print_status(f"OpenMPI isn't installed in {self.mpi_prefix}, run pmix_bench.py after its installation")
+            return
+
+        print_status(f"Measuring PMIx launch time ({self.launcher})")
+        regressions = bench_install("/usr", self.mpi_prefix, launcher=self.launcher,
+                                    profile=self.profile, pmix_version=self.pkgver)
+        if regressions:
+            print_failure(f"PMIx wire-up of {self.pkgname}-{self.pkgver} ({self.profile} profile) is slower than before")
 
 if __name__ == "__main__":
     parser = Package.cmd_parser()
+    parser.add_argument("--profile", choices=list(build_profiles), default="default",
+                        help="Build profile (optimized: without debug, timing and valgrind support)")
+    parser.add_argument("--launch-bench", dest="mpi_prefix", metavar="MPI_PREFIX",
+                        help="Measure time to MPI_Init after the installation with the OpenMPI of MPI_PREFIX")
+    parser.add_argument("--launcher", choices=["srun", "mpirun"], default="srun",
+                        help="Launcher of the launch benchmark")
     args = parser.parse_args()
 
     build_path = os.path.abspath(os.path.expanduser(args.build_dir))
 
     bpkg = BuildablePackage(name='pmix', version='3.2.3',
                             source='https://github.com/openpmix/openpmix/releases/download/v3.2.3/pmix-3.2.3.tar.gz',
-                            pkg=Pmix, build_path=build_path, uncompressed_dir='pmix-3.2.3')
-
-    pretty_name_distro = distro.os_release_info()['pretty_name']
-    print_status(f"Installing the following packages in {pretty_name_distro}")
-    bpkg_table = [[bpkg.name, bpkg.version, bpkg.source]]
-    print(tabulate(bpkg_table, headers=["Package", "Version", "Source"], tablefmt="pretty"))
-
-    while True:
-            short_answer = input("Proceed with installation? (y/n) ")
-            short_answer = short_answer.lower()
-            if short_answer in ['y', 'yes', 'n', 'no']:
-                if short_answer in ['n', 'no']:
-                    print_failure("Installation was canceled")
-                    exit(1)
-                else:
-                    break
-
-    install_requirements(distro.id(), pkgs=["pmix"])
-    
-    PkgClass = bpkg.pkg
-    pkg = PkgClass(**bpkg.init_options())
-
-    installation_options = { # default installation options
-        'no_confirm': True,
-        'avoid_download': False,
-        'avoid_uncompress': False,
-        'avoid_check': True
-    }
-
-    if args.only_compile:
-        installation_options['avoid_download'] = True
-        installation_options['avoid_uncompress'] = True
-
-    if args.avoid_download:
-        installation_options['avoid_download'] = True
-
-    if args.avoid_uncompress:
-        installation_options['avoid_uncompress'] = True
-
-    pkg.doall(**installation_options)
\ No newline at end of file
+                            pkg=Pmix, build_path=build_path, uncompressed_dir='pmix-3.2.3',
+                            options={**Package.cmd_options(args),
+                                     'profile': args.profile,
+                                     'mpi_prefix': args.mpi_prefix,
+                                     'launcher': args.launcher})
+
+    install_packages([bpkg], args, requirements=["pmix"])
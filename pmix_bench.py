@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#
+# PMIx launch wire-up benchmark (time to MPI_Init)
+#
+# A small MPI program is compiled with the mpicc of OpenMPI and launched
+# with increasing local rank counts under srun --mpi=pmix (or mpirun).
+# Each rank measures the time since the launch (and the duration of
+# MPI_Init), the slowest rank is reported. Results are stored alongside
+# the PMIx installation ($prefix/share/hpcluster/pmix-launch.json) and
+# compared against the previous ones.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from fineprint.status import print_status, print_successful, print_failure
+from tabulate import tabulate
+
+from bench import save_results, load_results, compare_results
+from mpi_bench import launch_cmd
+
+
+LAUNCH_SOURCE = r"""
+#include <mpi.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <sys/time.h>
+
+static double now(void)
+{
+    struct timeval tv;
+    gettimeofday(&tv, NULL);
+    return tv.tv_sec + tv.tv_usec * 1e-6;
+}
+
+int main(int argc, char **argv)
+{
+    double start = now();
+    MPI_Init(&argc, &argv);
+    double initialized = now();
+
+    const char *launch = getenv("HPCLUSTER_LAUNCH_TIME");
+    double times[2] = {launch ? initialized - atof(launch) : 0.0, initialized - start}, slowest[2];
+    int rank, nprocs;
+    MPI_Comm_rank(MPI_COMM_WORLD, &rank);
+    MPI_Comm_size(MPI_COMM_WORLD, &nprocs);
+    MPI_Reduce(times, slowest, 2, MPI_DOUBLE, MPI_MAX, 0, MPI_COMM_WORLD);
+
+    if (rank == 0)
+        printf("INIT %d %.6f %.6f\n", nprocs, slowest[0], slowest[1]);
+
+    MPI_Finalize();
+    return 0;
+}
+"""
+
+
+def results_path(pmix_prefix:str):
+    return os.path.join(pmix_prefix, "share", "hpcluster", "pmix-launch.json")
+
+
+def compile_launch(mpi_prefix:str, work_dir:str):
+    source = os.path.join(work_dir, "hpcluster_pmix_launch.c")
+    binary = os.path.join(work_dir, "hpcluster_pmix_launch")
+    with open(source, 'w') as source_file:
+        source_file.write(LAUNCH_SOURCE)
+
+    subprocess.run([os.path.join(mpi_prefix, "bin", "mpicc"), "-O2", "-o", binary, source],
+                   check=True, capture_output=True, text=True)
+    return binary
+
+
+def launch(binary:str, mpi_prefix:str, *, ranks:int, launcher:str = "srun"):
+    """
+    Launch ranks processes in this node
+    Return the time (seconds) to MPI_Init since the launch and the duration of MPI_Init (slowest rank)
+    """
+    cmd, env = launch_cmd(mpi_prefix, launcher, ranks)
+    if launcher == "srun":
+        cmd.insert(1, "--nodes=1")
+    env["HPCLUSTER_LAUNCH_TIME"] = f"{time.time():.6f}"
+
+    output = subprocess.run(cmd + [binary], env=env, capture_output=True, text=True, check=True).stdout
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 4 and fields[0] == "INIT":
+            return float(fields[2]), float(fields[3])
+    raise Exception(f"Unexpected output of {binary}: {output.strip()}")
+
+
+def launch_bench(mpi_prefix:str, *, launcher:str = "srun", ranks=None, repeat:int = 3):
+    """
+    Measure time to MPI_Init for increasing local rank counts (median of repeat launches)
+    """
+    if ranks is None:
+        ncpus = os.cpu_count() or 1
+        ranks = sorted({1, *[2**i for i in range(1, 10) if 2**i <= ncpus], ncpus})
+
+    work_dir = tempfile.mkdtemp(prefix="hpcluster-pmix-bench-")
+    try:
+        binary = compile_launch(mpi_prefix, work_dir)
+        results = []
+        for nprocs in ranks:
+            runs = [launch(binary, mpi_prefix, ranks=nprocs, launcher=launcher) for _ in range(repeat)]
+            result = {
+                "launcher": launcher,
+                "ranks": nprocs,
+                "time_to_init": round(statistics.median(run[0] for run in runs), 4),
+                "init_duration": round(statistics.median(run[1] for run in runs), 4)
+            }
+            print_status(f"{nprocs} ranks: MPI_Init after {result['time_to_init']}s "
+                         f"(MPI_Init takes {result['init_duration']}s)")
+            results.append(result)
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_install(pmix_prefix:str, mpi_prefix:str, *, launcher:str = "srun", ranks=None,
+                  tolerance:float = 0.2, **metadata):
+    """
+    Run the launch benchmark, compare it against the results stored with the PMIx
+    installation (if any) and store the new ones. Return the regressions
+    """
+    results = launch_bench(mpi_prefix, launcher=launcher, ranks=ranks)
+    print(tabulate([[result["ranks"], result["time_to_init"], result["init_duration"]] for result in results],
+                   headers=["Ranks", "Time to MPI_Init (s)", "MPI_Init (s)"], tablefmt="pretty"))
+
+    path = results_path(pmix_prefix)
+    regressions = []
+    if os.path.isfile(path):
+        current = {"benchmark": "pmix-launch", "results": results}
+        regressions = compare_results(load_results(path), current, key=["launcher", "ranks"],
+                                      metric="time_to_init", tolerance=tolerance)
+
+    save_results(path, "pmix-launch", results, sudo=True, mpi_prefix=mpi_prefix, **metadata)
+    return regressions
+
+
+def pmix_bench_args():
+    parser = argparse.ArgumentParser(description="PMIx launch wire-up benchmark (time to MPI_Init)")
+    parser.add_argument("--pmix-prefix", dest="pmix_prefix", default="/usr",
+                        help="Location of PMIx (results are stored in PREFIX/share/hpcluster)")
+    parser.add_argument("--mpi-prefix", dest="mpi_prefix", default="/usr/local/openmpi",
+                        help="Location of OpenMPI (mpicc and mpirun)")
+    parser.add_argument("--launcher", choices=["srun", "mpirun"], default="srun",
+                        help="Launch with srun --mpi=pmix or mpirun")
+    parser.add_argument("-n", "--ranks", type=int, nargs="+",
+                        help="Rank counts (default: 1 up to the number of CPUs)")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed degradation against the stored results (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = pmix_bench_args()
+
+    try:
+        regressions = bench_install(args.pmix_prefix, args.mpi_prefix, launcher=args.launcher,
+                                    ranks=args.ranks, tolerance=args.tolerance)
+        if regressions:
+            exit(1)
+
+    except subprocess.CalledProcessError as error:
+        print_failure(f"{' '.join(error.cmd)} failed: {error.stderr}")
+        exit(1)
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
@@ -11,18 +11,18 @@
 # Maintainer: glozanoa <glozanoa@uni.pe>
 
 import os
-import distro
-from tabulate import tabulate
-from sbash import Bash
 from fineprint.status import print_status, print_successful, print_failure
 from fineprint.color import ColorStr
 
 
-from pkg import Package, BuildablePackage
+from pkg import Package, BuildablePackage, install_packages
 
 
 class PySlurm(Package):
-    def __init__(self, *, pkgver, source, build_path, uncompressed_dir=None):
+    footprint = 200 # MB (uncompressed and compiled source)
+    native_depends = ["slurm"]
+
+    def __init__(self, *, pkgver, source, build_path, uncompressed_dir=None, **options):
         depends = {}
 
         makedepends = {
@@ -36,20 +36,31 @@ class PySlurm(Package):
                          depends=depends,
                          makedepends=makedepends,
                          build_path=build_path,
-                         uncompressed_dir=uncompressed_dir)
+                         uncompressed_dir=uncompressed_dir,
+                         **options)
 
     def build(self):
         print_status(f"Building {self.pkgname}-{self.pkgver}")
         print(ColorStr("It can take a while, so go for a coffee ...").StyleBRIGHT)
 
         #import pdb; pdb.set_trace()
-        Bash.exec("python3 setup.py build", where=self.uncompressed_path)
+        self.run_step(f"python3 setup.py {self.build_cmd()}", where=self.uncompressed_path)
+
+    def build_cmd(self):
+        if self.out_of_tree: # compile in objdir (e.g. per host when the build directory is shared)
+            return f"build --build-base={self.objdir}"
+        return "build"
 
     def install(self):
         print_status(f"Installing {self.pkgname}-{self.pkgver}")
         #import pdb; pdb.set_trace()
 
-        Bash.exec("python3 setup.py install", where=self.uncompressed_path)
+        self.run_step(f"python3 setup.py {self.build_cmd()} install", where=self.uncompressed_path)
+
+    def stage(self):
+        print_status(f"Staging {self.pkgname}-{self.pkgver} in {self.stage_path}")
+        self.run_step(f"python3 setup.py {self.build_cmd()} install --root={self.stage_path}",
+                      where=self.uncompressed_path)
 
 
 if __name__ == "__main__":
@@ -60,42 +71,7 @@ if __name__ == "__main__":
 
     bpkg = BuildablePackage(name='pyslurm', version='20.02.0',
                             source='https://github.com/PySlurm/pyslurm/archive/refs/tags/20-02-0.tar.gz',
-                            pkg=PySlurm, build_path=build_path, uncompressed_dir='pyslurm-20-02-0')
-
-    pretty_name_distro = distro.os_release_info()['pretty_name']
-    print_status(f"Installing the following packages in {pretty_name_distro}")
-    bpkg_table = [[bpkg.name, bpkg.version, bpkg.source]]
-    print(tabulate(bpkg_table, headers=["Package", "Version", "Source"], tablefmt="pretty"))
-
-    while True:
-            short_answer = input("Proceed with installation? (y/n) ")
-            short_answer = short_answer.lower()
-            if short_answer in ['y', 'yes', 'n', 'no']:
-                if short_answer in ['n', 'no']:
-                    print_failure("Installation was canceled")
-                    exit(1)
-                else:
-                    break
-
-
-    PkgClass = bpkg.pkg
-    pkg = PkgClass(**bpkg.init_options())
-
-    installation_options = { # default installation options
-        'no_confirm': True,
-        'avoid_download': False,
-        'avoid_uncompress': False,
-        'avoid_check': True
-    }
-
-    if args.only_compile:
-        installation_options['avoid_download'] = True
-        installation_options['avoid_uncompress'] = True
-
-    if args.avoid_download:
-        installation_options['avoid_download'] = True
-
-    if args.avoid_uncompress:
-        installation_options['avoid_uncompress'] = True
+                            pkg=PySlurm, build_path=build_path, uncompressed_dir='pyslurm-20-02-0',
+                            options=Package.cmd_options(args))
 
-    pkg.doall(**installation_options)
+    install_packages([bpkg], args)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+#
+# Shared-prefix installation mode (e.g. /opt exported by NFS)
+#
+# A single host (--role installer) compiles and installs the packages in a
+# shared prefix, and saves in it what the other nodes need locally:
+#   PREFIX/share/hpcluster/node/root           files installed outside the prefix
+#                                              (service units, /etc, /var directories)
+#   PREFIX/share/hpcluster/node/manifest.json  node setup commands and environment
+# The other nodes (--role node) don't compile or install anything, they only
+# copy those files and run the node setup (users, spool and log directories,
+# munge key, ...). Optionally the hot binaries and libraries of the prefix are
+# read into the page cache of the node (warmup), so the first jobs don't
+# hit the shared filesystem at the same time.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import json
+import os
+import platform
+import shlex
+import shutil
+import tempfile
+import time
+
+from fineprint.status import print_status, print_successful, print_failure
+
+
+# prefixes that can't be shared (files outside the prefix are node-local)
+system_prefixes = ["/", "/usr"]
+
+# directories of the prefix read by warmup
+hot_dirs = ["bin", "sbin", "lib", "lib64"]
+
+
+def node_path(prefix:str):
+    return os.path.join(prefix, "share", "hpcluster", "node")
+
+
+def check_prefix(pkg):
+    if pkg.prefix is None or os.path.normpath(pkg.prefix) in system_prefixes:
+        raise Exception(f"The shared-prefix mode needs a prefix of {pkg.pkgname} in the shared "
+                        f"filesystem (e.g. /opt/{pkg.pkgname}), not {pkg.prefix}")
+
+
+def export_node_files(pkg):
+    """
+    Save in the shared prefix the staged files of a package outside its prefix,
+    its node setup commands and its environment (see Package.stage)
+    """
+    from sbash import Bash
+
+    check_prefix(pkg)
+    prefix = os.path.join(pkg.stage_path, os.path.normpath(pkg.prefix).lstrip("/"))
+    ignore = lambda directory, names: [name for name in names if os.path.join(directory, name) == prefix]
+
+    work_dir = tempfile.mkdtemp(prefix="hpcluster-node-")
+    try:
+        shutil.copytree(pkg.stage_path, os.path.join(work_dir, "root"), symlinks=True, ignore=ignore)
+        variables, paths = pkg.environment()
+        manifest = {"pkgname": pkg.pkgname, "pkgver": pkg.pkgver, "prefix": pkg.prefix,
+                    "flavor": pkg.flavor(), "host": platform.node(),
+                    "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "node_setup": pkg.node_setup(),
+                    "variables": variables, "paths": paths}
+        with open(os.path.join(work_dir, "manifest.json"), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+        path = node_path(pkg.prefix)
+        Bash.exec(f"sudo rm -rf {path}")
+        Bash.exec(f"sudo mkdir -p {path}")
+        Bash.exec(f"sudo cp -a {work_dir}/. {path}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_successful(f"Node files of {pkg.pkgname}-{pkg.pkgver} were saved in {path}")
+    return path
+
+
+def install_node_files(pkg):
+    """
+    Install in this node the node-local files of a package installed in the shared prefix,
+    then run its node setup and install its environment. Return the manifest
+    """
+    from sbash import Bash
+    from environment import install_environment
+
+    check_prefix(pkg)
+    path = node_path(pkg.prefix)
+    manifest_path = os.path.join(path, "manifest.json")
+    if not os.path.isfile(manifest_path):
+        raise Exception(f"{pkg.pkgname} wasn't installed in {pkg.prefix} by an installer (--role installer)")
+
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest["pkgver"] != pkg.pkgver:
+        raise Exception(f"{pkg.prefix} has {pkg.pkgname}-{manifest['pkgver']}, not {pkg.pkgname}-{pkg.pkgver}")
+
+    print_status(f"Installing the node files of {pkg.pkgname}-{pkg.pkgver} (installed by {manifest['host']})")
+    root = os.path.join(path, "root")
+    if os.listdir(root):
+        Bash.exec(f"sudo cp -a {root}/. /")
+    if any(os.path.isdir(os.path.join(root, unit_dir)) for unit_dir in ["usr/lib/systemd", "etc/systemd"]):
+        Bash.exec("sudo systemctl daemon-reload")
+
+    for cmd in manifest["node_setup"]:
+        print_status(f"Node setup: {cmd}")
+        Bash.exec(f"sudo sh -c {shlex.quote(cmd)}")
+
+    if manifest["variables"] or manifest["paths"]:
+        install_environment(pkg.pkgname, pkg.pkgver, variables=manifest["variables"],
+                            paths=manifest["paths"], modules=pkg.modules, flavor=pkg.environment_flavor())
+    return manifest
+
+
+def hot_files(prefix:str):
+    """
+    Binaries and shared libraries of a prefix (bin, sbin and libraries in lib and lib64)
+    """
+    files = []
+    seen = set()
+    for name in hot_dirs:
+        top = os.path.join(prefix, name)
+        for dirpath, _, filenames in os.walk(top):
+            for filename in sorted(filenames):
+                path = os.path.realpath(os.path.join(dirpath, filename))
+                if path in seen or not os.path.isfile(path):
+                    continue
+                if name.startswith("lib") and ".so" not in filename:
+                    continue
+                seen.add(path)
+                files.append(path)
+            if name in ["bin", "sbin"]:
+                break # only the top-level binaries
+    return files
+
+
+def warm_page_cache(files, *, block_size:int = 1 << 20):
+    """
+    Read files into the page cache of this node (posix_fadvise WILLNEED, then a sequential read)
+    Return the number of read files and bytes
+    """
+    nfiles, nbytes = 0, 0
+    for path in files:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            while True:
+                block = os.read(fd, block_size)
+                if not block:
+                    break
+                nbytes += len(block)
+            nfiles += 1
+        finally:
+            os.close(fd)
+    return nfiles, nbytes
+
+
+def warmup(prefix:str):
+    """
+    Read the hot binaries and libraries of a prefix into the page cache
+    """
+    start = time.perf_counter()
+    nfiles, nbytes = warm_page_cache(hot_files(prefix))
+    seconds = time.perf_counter() - start
+    print_successful(f"{nfiles} files of {prefix} ({nbytes / 2**20:.1f} MB) were read into the page cache "
+                     f"in {seconds:.2f}s")
+    return nfiles, nbytes, seconds
+
+
+def shared_prefix_args():
+    parser = argparse.ArgumentParser(description="Node side of the shared-prefix mode")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="Packages installed in shared prefixes by an installer")
+    list_parser.add_argument("prefixes", nargs="+",
+                             help="Shared prefixes (e.g. /opt/openmpi /opt/slurm)")
+
+    warmup_parser = subparsers.add_parser("warmup", help="Read the hot binaries and libraries into the page cache")
+    warmup_parser.add_argument("prefixes", nargs="+",
+                               help="Shared prefixes (e.g. /opt/openmpi /opt/slurm)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # only needed by the command line, so importing this module (e.g. pkg.py) doesn't load it
+    from tabulate import tabulate
+
+    args = shared_prefix_args()
+
+    try:
+        if args.command == "list":
+            table = []
+            for prefix in args.prefixes:
+                manifest_path = os.path.join(node_path(prefix), "manifest.json")
+                if not os.path.isfile(manifest_path):
+                    table.append([prefix, "-", "-", "-", "-"])
+                    continue
+                with open(manifest_path) as manifest_file:
+                    manifest = json.load(manifest_file)
+                table.append([prefix, f"{manifest['pkgname']}-{manifest['pkgver']}", manifest["host"],
+                              manifest["date"], len(manifest["node_setup"])])
+            print(tabulate(table, headers=["Prefix", "Package", "Installer", "Date", "Node setup"],
+                           tablefmt="pretty"))
+
+        else:
+            for prefix in args.prefixes:
+                warmup(prefix)
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
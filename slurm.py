@@ -7,19 +7,26 @@
 #
 # Maintainer: glozanoa <glozanoa@uni.pe>
 
+import hashlib
 import os
-import distro
-from tabulate import tabulate
-from sbash import Bash
+import platform
+import tempfile
 from fineprint.status import print_status, print_successful, print_failure
 from fineprint.color import ColorStr
 
-from pkg import Package, BuildablePackage
-from linux_requirements import install_requirements
+from pkg import Package, BuildablePackage, install_packages
 
 
 class Slurm(Package):
-    def __init__(self, *, pkgver, source, build_path, uncompressed_dir=None):
+    bootstrap_cmd = "autoreconf"
+    footprint = 1200 # MB (uncompressed and compiled source)
+    native_depends = ["munge", "pmix"]
+
+    def __init__(self, *, pkgver, source, build_path, uncompressed_dir=None, prefix:str = "/usr",
+                nodes:str = None, controller:str = None,
+                affinity:bool = False,
+                multiple_slurmd:bool = False, plugin_profile:list = None,
+                plugins:list = None, accounting:bool = False, **options):
         depends = {
             "gcc": {"CentOS": "gcc.x86_64"},
             "pmix": {"Linux": "ADD_LINK2SCRIPT"},
@@ -38,108 +45,219 @@ class Slurm(Package):
                          depends=depends,
                          makedepends=makedepends,
                          build_path = build_path,
-                         uncompressed_dir= uncompressed_dir)
+                         uncompressed_dir= uncompressed_dir,
+                         prefix=prefix,
+                         **options)
+        self.multiple_slurmd = multiple_slurmd # emulate several slurmd in a host (see slurm_emulate.py)
+        self.nodes = nodes # hostlist of compute nodes (generate slurm.conf)
+        self.controller = controller
+        self.affinity = affinity # bind tasks to cores (task/affinity, task/cgroup)
+        self.accounting = accounting # slurmdbd with a local MariaDB (see slurmdbd.py)
 
-    def build(self):
-        print_status(f"Building {self.pkgname}-{self.pkgver}")
-        print(ColorStr("It can take a while, so go for a coffee ...").StyleBRIGHT)
+        # build only the plugins named in the target configuration files (see slurm_plugins.py)
+        self.plugins = None
+        if plugin_profile or plugins:
+            from slurm_plugins import plugin_profile as read_plugin_profile
+            self.plugins = read_plugin_profile(plugin_profile or [], extra=plugins)
+            if accounting:
+                self.plugins.update(["accounting_storage/slurmdbd", "accounting_storage/mysql",
+                                     "jobacct_gather/linux"])
+
+    def configure_flags(self):
+        if self.prefix == "/usr":
+            paths = [
+                "--prefix=/usr",
+                "--sbindir=/usr/bin",
+                "--sysconfdir=/etc/slurm-llnl",
+                "--localstatedir=/var"
+            ]
+        else: # self-contained installation (e.g. emulation flavor)
+            paths = [
+                f"--prefix={self.prefix}",
+                f"--sysconfdir={self.prefix}/etc",
+                f"--localstatedir={self.prefix}/var"
+            ]
 
-        print_status("Running autreconf")
-        Bash.exec("autoreconf", where=self.uncompressed_path)
         flags = [
             "--disable-developer",
             "--disable-debug",
             "--enable-optimizations",
-            "--prefix=/usr",
-            "--sbindir=/usr/bin",
-            "--sysconfdir=/etc/slurm-llnl",
-            "--localstatedir=/var",
+            *paths,
             "--with-pmix",
             "--with-hwloc",
             "--with-rrdtool",
             "--with-munge"
         ]
-        configure = "./configure " + " ".join(flags) 
-        Bash.exec(configure, where=self.uncompressed_path)
-        
+
+        # rrdtool (ext_sensors/rrd) and hdf5 (acct_gather_profile/hdf5) are only linked if they are used
+        if self.plugins is not None:
+            if "ext_sensors/rrd" not in self.plugins:
+                flags[flags.index("--with-rrdtool")] = "--without-rrdtool"
+            if "acct_gather_profile/hdf5" not in self.plugins:
+                flags.append("--without-hdf5")
+
+        if self.multiple_slurmd:
+            flags.append("--enable-multiple-slurmd")
+
+        return flags
+
+    def flavor(self):
+        flavor = super().flavor()
+        if self.plugins is None:
+            return flavor
+        flavor = " ".join([flavor] + sorted(self.plugins))
+        return hashlib.sha1(flavor.encode()).hexdigest()[:10]
+
+    def build(self):
+        from slurm_plugins import prune_plugins
+
+        print_status(f"Building {self.pkgname}-{self.pkgver}")
+        print(ColorStr("It can take a while, so go for a coffee ...").StyleBRIGHT)
+
+        self.configure()
+
+        if self.plugins is not None:
+            removed = prune_plugins(self.objdir, self.plugins)
+            print_status(f"{len(removed)} plugins (not in the plugin profile) won't be built")
+
         #import pdb; pdb.set_trace()
-        Bash.exec("make", where=self.uncompressed_path)
+        self.run_step("make", where=self.objdir)
 
     def install(self):
+        from sbash import Bash
+
         print_status(f"Installing {self.pkgname}-{self.pkgver}")
-        Bash.exec("sudo make install", where=self.uncompressed_path)
+        self.run_step("sudo make install", where=self.objdir)
+
+        if self.multiple_slurmd:
+            print_status(f"Emulation flavor of {self.pkgname}-{self.pkgver} was installed in {self.prefix} (start it with slurm_emulate.py)")
+            return
 
         print_status(f"Configuring {self.pkgname}-{self.pkgver} package")
 
-        configurations = [
-            'sudo install -D -m644 etc/slurm.conf.example    "/etc/slurm-llnl/slurm.conf.example"',
-            'sudo install -D -m644 etc/slurmdbd.conf.example "/etc/slurm-llnl/slurmdbd.conf.example"',
-            'sudo install -D -m644 LICENSE.OpenSSL           "/usr/share/licenses/slurm/LICENSE.OpenSSL"',
-            'sudo install -D -m644 COPYING           "/usr/share/licenses/slurm/COPYING"',
-            'sudo install -D -m755 etc/init.d.slurm      "/etc/rc.d/slurm"',
-            'sudo install -D -m755 etc/init.d.slurmdbd   "/etc/rc.d/slurmdbd"',
-            'sudo install -D -m644 etc/slurmctld.service "/usr/lib/systemd/system/slurmctld.service"',
-            'sudo install -D -m644 etc/slurmd.service    "/usr/lib/systemd/system/slurmd.service"',
-            'sudo install -D -m644 etc/slurmdbd.service  "/usr/lib/systemd/system/slurmdbd.service"',
-            'sudo install -d -m755 "/var/log/slurm-llnl"',
-            'sudo install -d -m755 "/var/lib/slurm-llnl"',
-            'sudo useradd -r -c "slurm daemon" -u 64030 -s /bin/nologin -d /var/log/slurm-llnl slurm',
-            'sudo install -d -m700 "/var/spool/slurm/d"',
-            'sudo install -d -m700 -o slurm -g slurm "/var/spool/slurm/ctld"'
-        ]
+        configurations = [f"sudo {cmd}" for cmd in self.install_files() + self.node_setup()]
 
         for cmd in configurations:
             print(cmd)
-            Bash.exec(cmd, where=self.uncompressed_path)
+            Bash.exec(cmd, where=self.objdir)
 
+        accounting = {}
+        if self.accounting:
+            from slurmdbd import setup_accounting
+            accounting = setup_accounting(dbd_host=self.controller)
 
-if __name__ == "__main__":
-    parser = Package.cmd_parser()
-    args = parser.parse_args()
+        if self.nodes:
+            self.install_slurm_conf(extra=accounting)
+        elif accounting:
+            print_status("Add these parameters to slurm.conf: " +
+                         " ".join(f"{name}={value}" for name, value in accounting.items()))
 
-    build_path = os.path.abspath(os.path.expanduser(args.build_dir))
+    def install_slurm_conf(self, extra:dict = None):
+        """
+        Generate /etc/slurm-llnl/slurm.conf from the hardware of the compute nodes
+        extra: more parameters of slurm.conf (e.g. accounting)
+        """
+        from sbash import Bash
+        from hostlist import expand_hostlist
+        from slurm_conf import discover_nodes, slurm_conf, cgroup_conf
 
-    bpkg = BuildablePackage(name='slurm', version='20.02.7',
-                            source='https://download.schedmd.com/slurm/slurm-20.02.7.tar.bz2',
-                            pkg=Slurm, build_path=build_path, uncompressed_dir='slurm-20.02.7')
+        topologies = discover_nodes(expand_hostlist(self.nodes))
+        if not topologies:
+            raise Exception(f"Topology of {self.nodes} wasn't collected")
 
-    pretty_name_distro = distro.os_release_info()['pretty_name']
-    print_status(f"Installing the following packages in {pretty_name_distro}")
-    bpkg_table = [[bpkg.name, bpkg.version, bpkg.source]]
-    print(tabulate(bpkg_table, headers=["Package", "Version", "Source"], tablefmt="pretty"))
+        controller = self.controller or platform.node().split(".")[0]
+        configurations = {"slurm.conf": slurm_conf(topologies, controller=controller,
+                                                   affinity=self.affinity, extra=extra)}
+        if self.affinity:
+            configurations["cgroup.conf"] = cgroup_conf()
 
-    while True:
-            short_answer = input("Proceed with installation? (y/n) ")
-            short_answer = short_answer.lower()
-            if short_answer in ['y', 'yes', 'n', 'no']:
-                if short_answer in ['n', 'no']:
-                    print_failure("Installation was canceled")
-                    exit(1)
-                else:
-                    break
+        for name, content in configurations.items():
+            with tempfile.NamedTemporaryFile('w', suffix=".conf", delete=False) as conf:
+                conf.write(content)
 
+            Bash.exec(f'sudo install -D -m644 {conf.name} "/etc/slurm-llnl/{name}"')
+            os.remove(conf.name)
 
-    install_requirements(distro.id(), pkgs=["slurm"])
+        print_successful(f"{', '.join(configurations)} for {len(topologies)} nodes were installed in /etc/slurm-llnl")
+        if self.affinity:
+            print_status("After starting munge, slurmctld and slurmd verify the CPU binding with: slurm_conf.py --verify-binding")
 
+    def install_files(self, destdir=""):
+        """
+        Commands to install examples, licenses, init scripts and service units in destdir
+        """
+        # examples and licenses are taken from the source, while init scripts
+        # and service units are generated by configure (in objdir)
+        source = self.uncompressed_path
+        return [
+            f'install -D -m644 {source}/etc/slurm.conf.example    "{destdir}/etc/slurm-llnl/slurm.conf.example"',
+            f'install -D -m644 {source}/etc/slurmdbd.conf.example "{destdir}/etc/slurm-llnl/slurmdbd.conf.example"',
+            f'install -D -m644 {source}/LICENSE.OpenSSL           "{destdir}/usr/share/licenses/slurm/LICENSE.OpenSSL"',
+            f'install -D -m644 {source}/COPYING           "{destdir}/usr/share/licenses/slurm/COPYING"',
+            f'install -D -m755 etc/init.d.slurm      "{destdir}/etc/rc.d/slurm"',
+            f'install -D -m755 etc/init.d.slurmdbd   "{destdir}/etc/rc.d/slurmdbd"',
+            f'install -D -m644 etc/slurmctld.service "{destdir}/usr/lib/systemd/system/slurmctld.service"',
+            f'install -D -m644 etc/slurmd.service    "{destdir}/usr/lib/systemd/system/slurmd.service"',
+            f'install -D -m644 etc/slurmdbd.service  "{destdir}/usr/lib/systemd/system/slurmdbd.service"'
+        ]
 
-    PkgClass = bpkg.pkg
-    pkg = PkgClass(**bpkg.init_options())
+    def node_setup(self):
+        return [
+            'install -d -m755 "/var/log/slurm-llnl"',
+            'install -d -m755 "/var/lib/slurm-llnl"',
+            'useradd -r -c "slurm daemon" -u 64030 -s /bin/nologin -d /var/log/slurm-llnl slurm',
+            'install -d -m700 "/var/spool/slurm/d"',
+            'install -d -m700 -o slurm -g slurm "/var/spool/slurm/ctld"'
+        ]
 
-    installation_options = { # default installation options
-        'no_confirm': True,
-        'avoid_download': False,
-        'avoid_uncompress': False,
-        'avoid_check': True
-    }
+    def stage(self):
+        from sbash import Bash
 
-    if args.only_compile:
-        installation_options['avoid_download'] = True
-        installation_options['avoid_uncompress'] = True
+        super().stage()
+        for cmd in self.install_files(self.stage_path):
+            Bash.exec(cmd, where=self.objdir)
 
-    if args.avoid_download:
-        installation_options['avoid_download'] = True
+if __name__ == "__main__":
+    parser = Package.cmd_parser()
+    conf_parser = parser.add_argument_group("Slurm configuration")
+    conf_parser.add_argument("--nodes", metavar="NODELIST",
+                             help="Generate slurm.conf from the hardware of these compute nodes (e.g. node[01-20])")
+    conf_parser.add_argument("--controller",
+                             help="Host of slurmctld (default: this host)")
+    conf_parser.add_argument("--affinity", action="store_true",
+                             help="Bind tasks to cores (task/affinity, task/cgroup) and generate cgroup.conf")
+
+    conf_parser.add_argument("--accounting", action="store_true",
+                             help="Configure slurmdbd with a tuned local MariaDB (see slurmdbd.py)")
+
+    plugins_parser = parser.add_argument_group("Plugins")
+    plugins_parser.add_argument("--plugin-profile", dest="plugin_profile", nargs="+", metavar="CONF",
+                                help="Build only the plugins named in these configuration files (e.g. slurm.conf slurmdbd.conf)")
+    plugins_parser.add_argument("--plugins", default="",
+                                help="Extra plugins to build with --plugin-profile (e.g. mpi/pmi2,sview)")
+
+    emulate_parser = parser.add_argument_group("Emulation")
+    emulate_parser.add_argument("--multiple-slurmd", dest="multiple_slurmd", action="store_true",
+                                help="Build a flavor able to run several slurmd in a host (see slurm_emulate.py)")
+    emulate_parser.add_argument("--prefix", default=None,
+                                help="Location to install Slurm (default: /usr, or /opt/slurm-emulate with --multiple-slurmd)")
+    args = parser.parse_args()
+    if args.prefix is None:
+        args.prefix = "/opt/slurm-emulate" if args.multiple_slurmd else "/usr"
 
-    if args.avoid_uncompress:
-        installation_options['avoid_uncompress'] = True
+    build_path = os.path.abspath(os.path.expanduser(args.build_dir))
+
+    bpkg = BuildablePackage(name='slurm', version='20.02.7',
+                            source='https://download.schedmd.com/slurm/slurm-20.02.7.tar.bz2',
+                            pkg=Slurm, build_path=build_path, uncompressed_dir='slurm-20.02.7',
+                            prefix=args.prefix,
+                            options={**Package.cmd_options(args),
+                                     'nodes': args.nodes,
+                                     'controller': args.controller,
+                                     'affinity': args.affinity,
+                                     'multiple_slurmd': args.multiple_slurmd,
+                                     'accounting': args.accounting,
+                                     'plugin_profile': args.plugin_profile,
+                                     'plugins': [plugin for plugin in args.plugins.split(",") if plugin]})
 
-    pkg.doall(**installation_options)
+    install_packages([bpkg], args, requirements=["slurm", "slurmdbd"] if args.accounting else ["slurm"])
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+#
+# Job submission throughput and scheduling latency benchmark (using PySlurm)
+#
+# Thousands of trivial jobs (and job arrays) are submitted to the local
+# controller, then the submit rate, the queue-to-start latency and the
+# completion rate are measured. Results are saved in JSON format to compare
+# Slurm configurations and versions (see bench.py).
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import importlib.machinery
+import importlib.util
+import os
+import statistics
+import sys
+import time
+
+from fineprint.status import print_status, print_successful, print_failure
+from tabulate import tabulate
+
+from bench import save_results, load_results, compare_results
+from slurm_emulate import EmulatedCluster
+
+
+finished_states = ["COMPLETED", "FAILED", "CANCELLED", "TIMEOUT", "NODE_FAIL", "OUT_OF_MEMORY", "BOOT_FAIL"]
+
+
+def import_pyslurm():
+    """
+    Import the installed PySlurm (pyslurm.py of this directory is its installer)
+    libslurm reads SLURM_CONF when it's imported (e.g. emulated cluster)
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    path = [entry for entry in sys.path if os.path.abspath(entry or os.curdir) != here]
+    spec = importlib.machinery.PathFinder.find_spec("pyslurm", path)
+    if spec is None:
+        raise Exception("PySlurm isn't installed (see pyslurm.py)")
+
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["pyslurm"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def submit_jobs(pyslurm, njobs:int, *, partition:str = None, array_size:int = None):
+    """
+    Submit njobs trivial jobs (job arrays of array_size tasks if array_size is supplied)
+    Return the submitted job ids and the submission time
+    """
+    options = {'wrap': 'true', 'job_name': 'hpcluster-bench', 'output': '/dev/null'}
+    if partition:
+        options['partition'] = partition
+    if array_size:
+        options['array_inx'] = f"0-{array_size - 1}"
+
+    job = pyslurm.job()
+    job_ids = []
+    start = time.perf_counter()
+    for _ in range(njobs):
+        job_ids.append(job.submit_batch_job(dict(options)))
+    elapsed = time.perf_counter() - start
+
+    return job_ids, elapsed
+
+
+def wait_jobs(pyslurm, job_ids, ntasks:int, *, timeout:float = 600, poll:float = 2):
+    """
+    Wait until ntasks tasks (jobs or array tasks) of job_ids finish
+    Return the information of the finished tasks
+    """
+    # slurmctld purges the finished jobs after MinJobAge, so each task is recorded when it's first seen finished
+    job_ids = set(job_ids)
+    finished = {}
+    start = time.time()
+    while True:
+        for info in pyslurm.job().get().values():
+            if ((info.get('job_id') in job_ids or info.get('array_job_id') in job_ids)
+                    and info.get('job_state') in finished_states and info.get('array_task_str') is None):
+                finished.setdefault(info['job_id'], info)
+
+        if len(finished) >= ntasks:
+            return list(finished.values())
+
+        if time.time() - start > timeout:
+            print_failure(f"Timeout: {len(finished)} of {ntasks} tasks finished")
+            return list(finished.values())
+
+        time.sleep(poll)
+
+
+def measure(pyslurm, scenario:str, njobs:int, *, partition:str = None,
+            array_size:int = None, timeout:float = 600):
+    """
+    Submit the jobs of a scenario and measure submit rate, latency and completion rate
+    """
+    ntasks = njobs * (array_size or 1)
+    print_status(f"Scenario {scenario}: submitting {njobs} jobs ({ntasks} tasks)")
+
+    job_ids, submit_time = submit_jobs(pyslurm, njobs, partition=partition, array_size=array_size)
+    finished = wait_jobs(pyslurm, job_ids, ntasks, timeout=timeout)
+
+    latencies = [info['start_time'] - info['submit_time'] for info in finished
+                 if info.get('start_time') and info.get('submit_time')]
+    completed = [info for info in finished if info['job_state'] == "COMPLETED"]
+    first_submit = min(info['submit_time'] for info in finished) if finished else 0
+    last_end = max(info['end_time'] for info in finished) if finished else 0
+
+    return {
+        "scenario": scenario,
+        "jobs": njobs,
+        "tasks": ntasks,
+        "submit_rate": round(njobs / submit_time, 2) if submit_time else None,
+        "latency_mean": round(statistics.mean(latencies), 3) if latencies else None,
+        "latency_p50": percentile(latencies, 0.50) if latencies else None,
+        "latency_p95": percentile(latencies, 0.95) if latencies else None,
+        "latency_max": max(latencies) if latencies else None,
+        "completion_rate": round(len(completed) / max(1, last_end - first_submit), 2),
+        "completed": len(completed)
+    }
+
+
+def bench_args():
+    parser = argparse.ArgumentParser(description="Job submission throughput and scheduling latency benchmark")
+    parser.add_argument("-j", "--jobs", type=int, default=1000,
+                        help="Number of single jobs")
+    parser.add_argument("--arrays", type=int, default=10,
+                        help="Number of job arrays")
+    parser.add_argument("--array-size", dest="array_size", type=int, default=100,
+                        help="Number of tasks of each job array")
+    parser.add_argument("-p", "--partition",
+                        help="Partition where jobs are submitted")
+    parser.add_argument("--timeout", type=float, default=600,
+                        help="Maximum time (seconds) to wait for the jobs of a scenario")
+    parser.add_argument("--emulate", type=int, metavar="NODES",
+                        help="Run the benchmark in an emulated cluster of NODES nodes (see slurm_emulate.py)")
+    parser.add_argument("--emulate-prefix", dest="emulate_prefix", default="/opt/slurm-emulate",
+                        help="Location of the emulation flavor of Slurm")
+    parser.add_argument("-o", "--output", default="slurm_bench.json",
+                        help="File to save the results (JSON)")
+    parser.add_argument("--baseline",
+                        help="Results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Allowed degradation against the baseline (0.1 = 10%%)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = bench_args()
+
+    cluster = None
+    try:
+        if args.emulate:
+            cluster = EmulatedCluster(prefix=args.emulate_prefix,
+                                      work_dir="~/.hpcluster/emulate-bench",
+                                      nodes=args.emulate)
+            cluster.start()
+            os.environ.update(cluster.env)
+
+        pyslurm = import_pyslurm() # after the environment of the emulated cluster
+
+        results = []
+        if args.jobs:
+            results.append(measure(pyslurm, "single", args.jobs,
+                                   partition=args.partition, timeout=args.timeout))
+        if args.arrays:
+            results.append(measure(pyslurm, "array", args.arrays, partition=args.partition,
+                                   array_size=args.array_size, timeout=args.timeout))
+
+        headers = ["scenario", "tasks", "submit_rate", "latency_mean", "latency_p95", "completion_rate", "completed"]
+        print(tabulate([[result[header] for header in headers] for result in results],
+                       headers=headers, tablefmt="pretty"))
+
+        version = ".".join(map(str, pyslurm.slurm_api_version()))
+        current = save_results(args.output, "slurm-throughput", results,
+                               slurm_version=version, emulated_nodes=args.emulate)
+
+        if args.baseline:
+            baseline = load_results(args.baseline)
+            regressions = compare_results(baseline, current, key=["scenario"], metric="submit_rate",
+                                          higher_is_better=True, tolerance=args.tolerance)
+            regressions += compare_results(baseline, current, key=["scenario"], metric="latency_p95",
+                                           tolerance=args.tolerance)
+            if regressions:
+                exit(1)
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
+
+    finally:
+        if cluster is not None:
+            cluster.stop()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+#
+# Generate slurm.conf (and cgroup.conf) from the hardware of the nodes
+#
+# The topology of each node (sockets, cores, threads, NUMA, memory and CPU features)
+# is collected in parallel (lscpu or /proc/cpuinfo, through ssh), identical
+# nodes are compressed in hostlist ranges (e.g. node[01-20]) and the
+# scheduler parameters are sized to the number of nodes of the cluster.
+# NUMA nodes inside a socket are reported as sockets, so tasks aren't
+# distributed or bound across them. Optionally, tasks are bound to cores
+# (task/affinity and task/cgroup) and the binding is verified with a test job.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import math
+import os
+import platform
+import re
+import subprocess
+
+from fineprint.status import print_status, print_successful, print_failure
+from tabulate import tabulate
+
+from hostlist import expand_hostlist, compress_hostlist
+
+
+# CPU flags reported as node features (flag in /proc/cpuinfo: feature name)
+cpu_features = {
+    'avx512f': 'avx512',
+    'avx2': 'avx2',
+    'avx': 'avx',
+    'sse4_2': 'sse4_2'
+}
+
+topology_cmd = ("if command -v lscpu > /dev/null; then LC_ALL=C lscpu; else cat /proc/cpuinfo; fi; "
+                "grep MemTotal /proc/meminfo")
+
+
+def parse_cpulist(cpulist:str):
+    """
+    Parse a list of CPUs (e.g. 0-3,8-11) into a set
+    """
+    cpus = set()
+    for interval in cpulist.strip().split(","):
+        if "-" in interval:
+            start, end = interval.split("-")
+            cpus.update(range(int(start), int(end) + 1))
+        elif interval:
+            cpus.add(int(interval))
+    return cpus
+
+
+def parse_topology(output:str):
+    """
+    Parse the output of topology_cmd (lscpu or /proc/cpuinfo and MemTotal)
+    """
+    topology = {'sockets': 1, 'cores_per_socket': 1, 'threads_per_core': 1,
+                'cpus': 1, 'numa_nodes': 1, 'numa_cpus': [], 'memory': 0, 'features': []}
+    flags = set()
+
+    if "Socket(s):" in output: # lscpu
+        fields = dict(line.split(":", 1) for line in output.splitlines() if ":" in line)
+        fields = {key.strip(): value.strip() for key, value in fields.items()}
+        topology['sockets'] = int(fields.get("Socket(s)", 1))
+        topology['cores_per_socket'] = int(fields.get("Core(s) per socket", 1))
+        topology['threads_per_core'] = int(fields.get("Thread(s) per core", 1))
+        topology['cpus'] = int(fields.get("CPU(s)", 1))
+        topology['numa_nodes'] = int(fields.get("NUMA node(s)", 1))
+        flags = set(fields.get("Flags", "").split())
+        topology['numa_cpus'] = [parse_cpulist(fields[f"NUMA node{i} CPU(s)"])
+                                 for i in range(topology['numa_nodes'])
+                                 if fields.get(f"NUMA node{i} CPU(s)")]
+
+    else: # /proc/cpuinfo
+        physical_ids = set()
+        cpus = 0
+        for block in output.split("\n\n"):
+            fields = dict(line.split(":", 1) for line in block.splitlines() if ":" in line)
+            fields = {key.strip(): value.strip() for key, value in fields.items()}
+            if "processor" not in fields:
+                continue
+            cpus += 1
+            physical_ids.add(fields.get("physical id", "0"))
+            topology['cores_per_socket'] = int(fields.get("cpu cores", 1))
+            siblings = int(fields.get("siblings", topology['cores_per_socket']))
+            topology['threads_per_core'] = max(1, siblings // topology['cores_per_socket'])
+            flags = set(fields.get("flags", "").split())
+        topology['sockets'] = max(1, len(physical_ids))
+        topology['cpus'] = max(1, cpus)
+
+    match = re.search(r"MemTotal:\s+(\d+)\s+kB", output)
+    if match:
+        topology['memory'] = int(match.group(1)) // 1024
+
+    topology['features'] = [feature for flag, feature in cpu_features.items() if flag in flags]
+    return topology
+
+
+def discover_node(node:str, *, ssh_args:str = "-o BatchMode=yes -o ConnectTimeout=10"):
+    """
+    Collect the topology of a node (locally if node is this host, otherwise through ssh)
+    """
+    if node in ["localhost", platform.node(), platform.node().split(".")[0]]:
+        cmd = ["sh", "-c", topology_cmd]
+    else:
+        cmd = ["ssh", *ssh_args.split(), node, topology_cmd]
+
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=60).stdout
+    return parse_topology(output)
+
+
+def discover_nodes(nodes, *, fanout:int = 32):
+    """
+    Collect the topology of the nodes in parallel
+    Return a dictionary node: topology (nodes that fail are reported and skipped)
+    """
+    print_status(f"Collecting the topology of {len(nodes)} nodes")
+    topologies = {}
+    with ThreadPoolExecutor(max_workers=fanout) as executor:
+        futures = {node: executor.submit(discover_node, node) for node in nodes}
+        for node, future in futures.items():
+            try:
+                topologies[node] = future.result()
+            except Exception as error:
+                print_failure(f"Topology of {node} wasn't collected: {error}")
+
+    return topologies
+
+
+def node_lines(topologies, *, mem_reserve:float = 0.02, cpu_bind:str = None):
+    """
+    NodeName lines of slurm.conf (identical nodes are compressed in a hostlist).
+    RealMemory is MemTotal minus mem_reserve (fraction reserved for the OS), rounded
+    down to 128 MB so that identical nodes with small kernel differences are grouped.
+    Nodes with several NUMA nodes per socket (e.g. sub-NUMA clustering) report each
+    NUMA node as a socket, so the socket distribution and binding of the tasks
+    (and the socket boundary of the cores allocated to a job) don't cross NUMA nodes.
+    cpu_bind is the default binding of the tasks in the nodes (e.g. cores)
+    """
+    groups = {}
+    for node, topology in topologies.items():
+        memory = int(topology['memory'] * (1 - mem_reserve)) // 128 * 128
+        sockets, cores = topology['sockets'], topology['cores_per_socket']
+        numa_nodes = topology['numa_nodes']
+        if numa_nodes > sockets and sockets * cores % numa_nodes == 0:
+            sockets, cores = numa_nodes, sockets * cores // numa_nodes
+        key = (sockets, cores, topology['threads_per_core'], memory, tuple(topology['features']),
+               topology['sockets'], numa_nodes)
+        groups.setdefault(key, []).append(node)
+
+    lines = []
+    for (sockets, cores, threads, memory, features, physical_sockets, numa_nodes), nodes in groups.items():
+        line = (f"NodeName={compress_hostlist(nodes)} Sockets={sockets} CoresPerSocket={cores} "
+                f"ThreadsPerCore={threads} RealMemory={memory}")
+        if features:
+            line += f" Feature={','.join(features)}"
+        if cpu_bind:
+            line += f" CpuBind={cpu_bind}"
+        if sockets != physical_sockets:
+            lines.append(f"# NUMA nodes: {numa_nodes} (reported as sockets, {physical_sockets} physical sockets)")
+        else:
+            lines.append(f"# NUMA nodes: {numa_nodes}")
+        lines.append(line + " State=UNKNOWN")
+
+    return lines
+
+
+def scheduler_parameters(nnodes:int):
+    """
+    Performance-oriented scheduler parameters sized to the number of nodes
+    """
+    parameters = ["bf_continue", "bf_interval=30", "default_queue_depth=200"]
+    if nnodes >= 100:
+        parameters += ["defer", "bf_max_job_test=1000", "bf_resolution=300",
+                       "max_rpc_cnt=150", "batch_sched_delay=10", "sched_min_interval=2000000"]
+    return parameters
+
+
+def tree_width(nnodes:int):
+    """
+    Fanout of slurmd communications: square root of the number of nodes
+    (cube root for clusters bigger than 2500 nodes)
+    """
+    if nnodes > 2500:
+        return math.ceil(nnodes ** (1/3))
+    return max(2, math.ceil(math.sqrt(nnodes)))
+
+
+def affinity_parameters():
+    """
+    Parameters to bind tasks to CPUs (task/affinity) and confine them (task/cgroup)
+    """
+    return {
+        "TaskPlugin": "task/affinity,task/cgroup",
+        "ProctrackType": "proctrack/cgroup"
+    }
+
+
+def cgroup_conf():
+    """
+    Generate the content of cgroup.conf (binding is done by task/affinity)
+    """
+    parameters = {
+        "CgroupAutomount": "yes",
+        "ConstrainCores": "yes",
+        "ConstrainRAMSpace": "yes",
+        "ConstrainSwapSpace": "yes",
+        "ConstrainDevices": "yes",
+        "AllowedRAMSpace": 100,
+        "AllowedSwapSpace": 0,
+        "TaskAffinity": "no"
+    }
+    lines = ["# cgroup.conf generated by hpcluster"]
+    lines += [f"{name}={value}" for name, value in parameters.items()]
+    return "\n".join(lines) + "\n"
+
+
+def slurm_conf(topologies, *, controller:str, cluster_name:str = "cluster",
+               mem_reserve:float = 0.02, affinity:bool = False, extra:dict = None):
+    """
+    Generate the content of slurm.conf
+    affinity: bind tasks to cores (see affinity_parameters and cgroup_conf)
+    extra: more parameters (name: value) to add or override
+    """
+    nnodes = len(topologies)
+    if nnodes >= 1000:
+        message_timeout = 60
+    elif nnodes >= 100:
+        message_timeout = 30
+    else:
+        message_timeout = 10
+
+    parameters = {
+        "ClusterName": cluster_name,
+        "SlurmctldHost": controller,
+        "SlurmUser": "slurm",
+        "AuthType": "auth/munge",
+        "CryptoType": "crypto/munge",
+        "MpiDefault": "pmix",
+        "ProctrackType": "proctrack/linuxproc",
+        "SelectType": "select/cons_tres",
+        "SelectTypeParameters": "CR_Core_Memory",
+        "SchedulerType": "sched/backfill",
+        "SchedulerParameters": ",".join(scheduler_parameters(nnodes)),
+        "MessageTimeout": message_timeout,
+        "TreeWidth": tree_width(nnodes),
+        "ReturnToService": 2,
+        "StateSaveLocation": "/var/spool/slurm/ctld",
+        "SlurmdSpoolDir": "/var/spool/slurm/d",
+        "SlurmctldPidFile": "/var/run/slurmctld.pid",
+        "SlurmdPidFile": "/var/run/slurmd.pid",
+        "SlurmctldLogFile": "/var/log/slurm-llnl/slurmctld.log",
+        "SlurmdLogFile": "/var/log/slurm-llnl/slurmd.log",
+    }
+    if affinity:
+        parameters.update(affinity_parameters())
+    parameters.update(extra or {})
+
+    lines = [f"# slurm.conf generated by hpcluster for {nnodes} nodes"]
+    lines += [f"{name}={value}" for name, value in parameters.items()]
+    lines += ["", "# COMPUTE NODES"]
+    lines += node_lines(topologies, mem_reserve=mem_reserve,
+                        cpu_bind="cores" if affinity else None)
+    lines += [f"PartitionName=batch Nodes=ALL Default=YES MaxTime=INFINITE State=UP"]
+
+    return "\n".join(lines) + "\n"
+
+
+def verify_binding(topology, *, node:str = None, ntasks:int = None):
+    """
+    Run a test job (one task per core) in node (default: this host, its topology)
+    and verify that each task is bound to its own core and doesn't cross NUMA nodes.
+    Slurm daemons must be running. Return True if the binding is right
+    """
+    node = node or platform.node().split(".")[0]
+    cores = topology['sockets'] * topology['cores_per_socket']
+    ntasks = ntasks or cores
+    print_status(f"Verifying CPU binding of {node} with a test job of {ntasks} tasks")
+
+    task_cmd = "echo $SLURM_PROCID $(grep Cpus_allowed_list /proc/self/status | cut -f2)"
+    output = subprocess.run(["srun", "-N1", f"-w{node}", f"-n{ntasks}", "--cpu-bind=cores", "sh", "-c", task_cmd],
+                            check=True, capture_output=True, text=True, timeout=300).stdout
+
+    table = []
+    errors = []
+    used = set()
+    for line in sorted(output.splitlines(), key=lambda line: int(line.split()[0])):
+        task, cpulist = line.split()
+        cpus = parse_cpulist(cpulist)
+        numa = [i for i, numa_cpus in enumerate(topology['numa_cpus']) if cpus & numa_cpus]
+
+        if len(cpus) > topology['threads_per_core']:
+            errors.append(f"task {task} isn't bound to a core ({cpulist})")
+        if cpus & used:
+            errors.append(f"task {task} shares CPUs with other tasks ({cpulist})")
+        if len(numa) > 1:
+            errors.append(f"task {task} crosses NUMA nodes {numa} ({cpulist})")
+        used |= cpus
+        table.append([task, cpulist, ",".join(map(str, numa))])
+
+    print(tabulate(table, headers=["Task", "CPUs", "NUMA node"], tablefmt="pretty"))
+
+    if len(table) != ntasks:
+        errors.append(f"{len(table)} of {ntasks} tasks reported their binding")
+
+    for error in errors:
+        print_failure(error)
+    if not errors:
+        print_successful("Tasks are bound to cores")
+
+    return not errors
+
+
+def slurm_conf_args():
+    parser = argparse.ArgumentParser(description="Generate slurm.conf from the hardware of the nodes")
+    parser.add_argument("nodes", metavar="NODELIST", nargs="?",
+                        help="Compute nodes (e.g. node[01-20])")
+    parser.add_argument("--controller", default=platform.node().split(".")[0],
+                        help="Host of slurmctld")
+    parser.add_argument("--cluster-name", dest="cluster_name", default="cluster",
+                        help="Name of the cluster")
+    parser.add_argument("--mem-reserve", dest="mem_reserve", type=float, default=0.02,
+                        help="Fraction of memory reserved for the OS (not reported as RealMemory)")
+    parser.add_argument("-f", "--fanout", type=int, default=32,
+                        help="Number of nodes queried at the same time")
+    parser.add_argument("--affinity", action="store_true",
+                        help="Bind tasks to cores (task/affinity, task/cgroup) and generate cgroup.conf")
+    parser.add_argument("--verify-binding", dest="verify_binding", action="store_true",
+                        help="Only verify the CPU binding of this node with a test job (Slurm must be running)")
+    parser.add_argument("-o", "--output", default="slurm.conf",
+                        help="Output file (cgroup.conf is saved in the same directory)")
+    args = parser.parse_args()
+    if args.nodes is None and not args.verify_binding:
+        parser.error("NODELIST is required (unless --verify-binding)")
+    return args
+
+
+if __name__ == "__main__":
+    args = slurm_conf_args()
+
+    if args.verify_binding:
+        exit(0 if verify_binding(discover_node("localhost")) else 1)
+
+    topologies = discover_nodes(expand_hostlist(args.nodes), fanout=args.fanout)
+    if not topologies:
+        print_failure("Topology of the nodes wasn't collected")
+        exit(1)
+
+    with open(args.output, 'w') as output:
+        output.write(slurm_conf(topologies, controller=args.controller,
+                                cluster_name=args.cluster_name,
+                                mem_reserve=args.mem_reserve,
+                                affinity=args.affinity))
+
+    print_successful(f"slurm.conf for {len(topologies)} nodes was saved in {args.output}")
+
+    if args.affinity:
+        cgroup_path = os.path.join(os.path.dirname(os.path.abspath(args.output)), "cgroup.conf")
+        with open(cgroup_path, 'w') as output:
+            output.write(cgroup_conf())
+        print_successful(f"cgroup.conf was saved in {cgroup_path}")
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+#
+# Emulate a Slurm cluster in a single host (slurmctld and N slurmd daemons)
+#
+# It needs the emulation flavor of Slurm (built with --enable-multiple-slurmd):
+#   $ python3 slurm.py -b build --multiple-slurmd --prefix /opt/slurm-emulate
+# and munge running in the host. Every daemon runs as the current user
+# with its state, spool and logs in a working directory.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import getpass
+import os
+import signal
+import subprocess
+import time
+
+from fineprint.status import print_status, print_successful, print_failure
+
+
+class EmulatedCluster:
+    """
+    Slurm cluster emulated in a single host
+
+    Attributes:
+    prefix (str): location of the emulation flavor of Slurm
+    work_dir (str): directory of the configuration, state, spool and logs
+    nodes (int): number of emulated slurmd daemons (nodes emu[1-N])
+    cpus (int): CPUs of each emulated node
+    memory (int): memory (MB) of each emulated node
+    """
+
+    def __init__(self, *, prefix:str, work_dir:str, nodes:int, cpus:int = 4, memory:int = 1024,
+                 controller_port:int = 16817, slurmd_port:int = 17000):
+        self.prefix = prefix
+        self.work_dir = os.path.abspath(os.path.expanduser(work_dir))
+        self.nodes = nodes
+        self.cpus = cpus
+        self.memory = memory
+        self.controller_port = controller_port
+        self.slurmd_port = slurmd_port
+
+    @property
+    def conf_path(self):
+        return os.path.join(self.work_dir, "etc", "slurm.conf")
+
+    @property
+    def node_names(self):
+        return [f"emu{i}" for i in range(1, self.nodes + 1)]
+
+    @property
+    def env(self):
+        """
+        Environment to use the emulated cluster (e.g. to run sbatch, squeue or pyslurm)
+        """
+        env = dict(os.environ)
+        env["SLURM_CONF"] = self.conf_path
+        env["PATH"] = f"{os.path.join(self.prefix, 'bin')}:{env.get('PATH', '')}"
+        return env
+
+    def slurm_conf(self):
+        """
+        Generate the content of slurm.conf of the emulated cluster
+        """
+        user = getpass.getuser()
+        work = self.work_dir
+        parameters = {
+            "ClusterName": "emulated",
+            "SlurmctldHost": "localhost",
+            "SlurmctldPort": self.controller_port,
+            "SlurmUser": user,
+            "SlurmdUser": user,
+            "AuthType": "auth/munge",
+            "CryptoType": "crypto/munge",
+            "MpiDefault": "none",
+            "ProctrackType": "proctrack/linuxproc",
+            "TaskPlugin": "task/none",
+            "SelectType": "select/cons_tres",
+            "SelectTypeParameters": "CR_Core",
+            "SchedulerType": "sched/backfill",
+            "ReturnToService": 2,
+            "SlurmdParameters": "config_overrides", # emulated nodes report the CPUs and memory of slurm.conf, not of the host
+            "StateSaveLocation": f"{work}/state",
+            "SlurmdSpoolDir": f"{work}/spool/%n",
+            "SlurmctldPidFile": f"{work}/run/slurmctld.pid",
+            "SlurmdPidFile": f"{work}/run/slurmd-%n.pid",
+            "SlurmctldLogFile": f"{work}/log/slurmctld.log",
+            "SlurmdLogFile": f"{work}/log/slurmd-%n.log",
+        }
+
+        lines = [f"# slurm.conf generated by hpcluster to emulate {self.nodes} nodes"]
+        lines += [f"{name}={value}" for name, value in parameters.items()]
+        lines += [""]
+        lines += [f"NodeName={name} NodeHostname=localhost NodeAddr=127.0.0.1 Port={self.slurmd_port + i} "
+                  f"CPUs={self.cpus} RealMemory={self.memory} State=UNKNOWN"
+                  for i, name in enumerate(self.node_names, start=1)]
+        lines += ["PartitionName=emulated Nodes=ALL Default=YES MaxTime=INFINITE State=UP"]
+        return "\n".join(lines) + "\n"
+
+    def setup(self):
+        for directory in ["etc", "state", "spool", "run", "log"]:
+            os.makedirs(os.path.join(self.work_dir, directory), exist_ok=True)
+
+        with open(self.conf_path, 'w') as conf:
+            conf.write(self.slurm_conf())
+
+    def start(self, *, timeout:float = 120):
+        """
+        Start slurmctld and the slurmd daemons, then wait until all the nodes are idle
+        """
+        self.setup()
+        sbin = os.path.join(self.prefix, "sbin")
+
+        print_status(f"Starting slurmctld (port {self.controller_port})")
+        subprocess.run([os.path.join(sbin, "slurmctld"), "-f", self.conf_path],
+                       env=self.env, check=True)
+
+        print_status(f"Starting {self.nodes} slurmd daemons")
+        for name in self.node_names:
+            subprocess.run([os.path.join(sbin, "slurmd"), "-f", self.conf_path, "-N", name],
+                           env=self.env, check=True)
+
+        self.wait_ready(timeout=timeout)
+        print_successful(f"Emulated cluster with {self.nodes} nodes is ready (SLURM_CONF={self.conf_path})")
+
+    def idle_nodes(self):
+        output = subprocess.run(["sinfo", "-h", "-N", "-t", "idle", "-o", "%N"],
+                                env=self.env, capture_output=True, text=True).stdout
+        return len(set(output.split()))
+
+    def wait_ready(self, *, timeout:float = 120):
+        start = time.time()
+        while self.idle_nodes() < self.nodes:
+            if time.time() - start > timeout:
+                raise TimeoutError(f"{self.idle_nodes()} of {self.nodes} emulated nodes are idle (check {self.work_dir}/log)")
+            time.sleep(1)
+
+    def stop(self):
+        """
+        Stop all the daemons of the emulated cluster (using their pid files)
+        """
+        run_dir = os.path.join(self.work_dir, "run")
+        if not os.path.isdir(run_dir):
+            return
+
+        for pid_file in os.listdir(run_dir):
+            with open(os.path.join(run_dir, pid_file)) as pid:
+                try:
+                    os.kill(int(pid.read().strip()), signal.SIGTERM)
+                except (ValueError, ProcessLookupError):
+                    pass
+            os.remove(os.path.join(run_dir, pid_file))
+
+        print_successful("Emulated cluster was stopped")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def emulate_args():
+    parser = argparse.ArgumentParser(description="Emulate a Slurm cluster in a single host")
+    parser.add_argument("action", choices=["start", "stop", "status", "env"],
+                        help="start/stop the emulated cluster, show its status or the environment to use it")
+    parser.add_argument("-n", "--nodes", type=int, default=8,
+                        help="Number of emulated nodes")
+    parser.add_argument("--cpus", type=int, default=4,
+                        help="CPUs of each emulated node")
+    parser.add_argument("--memory", type=int, default=1024,
+                        help="Memory (MB) of each emulated node")
+    parser.add_argument("--prefix", default="/opt/slurm-emulate",
+                        help="Location of the emulation flavor of Slurm")
+    parser.add_argument("-w", "--work-dir", dest="work_dir", default="~/.hpcluster/emulate",
+                        help="Directory of the configuration, state and logs")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = emulate_args()
+    cluster = EmulatedCluster(prefix=args.prefix, work_dir=args.work_dir,
+                              nodes=args.nodes, cpus=args.cpus, memory=args.memory)
+
+    try:
+        if args.action == "start":
+            cluster.start()
+        elif args.action == "stop":
+            cluster.stop()
+        elif args.action == "status":
+            subprocess.run(["sinfo"], env=cluster.env)
+        elif args.action == "env":
+            print(f"export SLURM_CONF={cluster.conf_path}")
+            print(f"export PATH={os.path.join(args.prefix, 'bin')}:$PATH")
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
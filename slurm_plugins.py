@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+#
+# Plugin profile of Slurm: plugins named in the target configuration files
+#
+# The profile is used to build only the plugins that the daemons load
+# (see Slurm.prune_plugins), the others are removed from the SUBDIRS of
+# src/plugins/<type>/Makefile after configure.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import os
+import re
+
+from fineprint.status import print_status, print_successful, print_failure
+
+
+# configuration keys naming plugins and their default value (Slurm 20.02)
+plugin_keys = {
+    "accountingstoragetype": "accounting_storage/none",
+    "acctgatherenergytype": "acct_gather_energy/none",
+    "acctgatherfilesystemtype": "acct_gather_filesystem/none",
+    "acctgatherinterconnecttype": "acct_gather_interconnect/none",
+    "acctgatherprofiletype": "acct_gather_profile/none",
+    "authtype": "auth/munge",
+    "authalttypes": None,
+    "burstbuffertype": None,
+    "clifilterplugins": None,
+    "corespecplugin": "core_spec/none",
+    "credtype": "cred/munge",
+    "cryptotype": "crypto/munge",
+    "extsensorstype": "ext_sensors/none",
+    "jobacctgathertype": "jobacct_gather/none",
+    "jobcomptype": "jobcomp/none",
+    "jobcontainertype": "job_container/none",
+    "jobsubmitplugins": None,
+    "launchtype": "launch/slurm",
+    "mcsplugin": "mcs/none",
+    "mpidefault": "mpi/none",
+    "nodefeaturesplugins": None,
+    "powerplugin": None,
+    "preempttype": "preempt/none",
+    "prioritytype": "priority/basic",
+    "proctracktype": "proctrack/cgroup",
+    "routeplugin": "route/default",
+    "schedulertype": "sched/backfill",
+    "selecttype": "select/linear",
+    "sitefactorplugins": None,
+    "switchtype": "switch/none",
+    "taskplugin": "task/none",
+    "topologyplugin": "topology/none"
+}
+
+# keys of slurmdbd.conf naming plugins (besides AuthType and AuthAltTypes) and their default value
+dbd_plugin_keys = {
+    "storagetype": "accounting_storage/mysql"
+}
+
+# plugins needed even if they aren't named (srun --mpi=pmix)
+required_plugins = ["mpi/pmix", "launch/slurm"]
+
+# plugin directories always built (libraries shared by the plugins of a type)
+always_built = ["none", "common", "default", "generic", "cons_common"]
+
+
+def read_conf(path:str):
+    """
+    Parse KEY=VALUE pairs of a Slurm configuration file (keys in lowercase)
+    """
+    parameters = {}
+    with open(os.path.expanduser(path)) as conf:
+        for line in conf:
+            line = line.split("#", 1)[0].strip()
+            for pair in line.split():
+                if "=" in pair:
+                    key, value = pair.split("=", 1)
+                    parameters.setdefault(key.lower(), value)
+    return parameters
+
+
+def plugin_names(key:str, value:str):
+    """
+    Plugins (TYPE/NAME) named by the value of a configuration key
+    """
+    names = []
+    for name in value.split(","):
+        name = name.strip()
+        if not name or name.lower() == "none":
+            continue
+        if "/" not in name: # e.g. MpiDefault=pmix, JobSubmitPlugins=lua, GresTypes=gpu
+            plugin_type = {"mpidefault": "mpi", "jobsubmitplugins": "job_submit", "grestypes": "gres",
+                           "sitefactorplugins": "site_factor", "clifilterplugins": "cli_filter",
+                           "nodefeaturesplugins": "node_features"}.get(key, key)
+            name = f"{plugin_type}/{name}"
+        names.append(name)
+    return names
+
+
+def plugin_profile(conf_paths, *, extra=None):
+    """
+    Set of plugins (TYPE/NAME) named in the configuration files (e.g. slurm.conf
+    and slurmdbd.conf) plus the defaults of the missing keys and extra plugins
+    """
+    parameters = {}
+    keys = dict(plugin_keys)
+    for path in conf_paths:
+        conf_parameters = read_conf(path)
+        if os.path.basename(path) == "slurmdbd.conf" or "dbdhost" in conf_parameters:
+            keys.update(dbd_plugin_keys)
+        parameters.update(conf_parameters)
+
+    plugins = set(required_plugins) | set(extra or [])
+    for key, default in keys.items():
+        value = parameters.get(key, default)
+        if value:
+            plugins.update(plugin_names(key, value))
+
+    grestypes = parameters.get("grestypes")
+    if grestypes:
+        plugins.update(plugin_names("grestypes", grestypes))
+        if "gpu" in grestypes.split(","): # GPU autodetection (AutoDetect in gres.conf)
+            plugins.update(["gpu/nvml", "gpu/rsmi"])
+
+    # CryptoType plugins live in src/plugins/crypto or src/plugins/cred (depending on the version)
+    plugins.update(plugin.replace("crypto/", "cred/") for plugin in list(plugins)
+                   if plugin.startswith("crypto/"))
+
+    return plugins
+
+
+def read_makefile(path:str):
+    """
+    Return the lines of a Makefile with continuation lines joined
+    """
+    with open(path) as makefile:
+        content = makefile.read()
+    return content.replace("\\\n", " ").splitlines()
+
+
+def subdirs(lines):
+    """
+    Expand the SUBDIRS of a generated Makefile (variables defined in the same Makefile)
+    """
+    variables = {}
+    for line in lines:
+        match = re.match(r"^([A-Za-z_][A-Za-z0-9_]*)\s*=\s*(.*)$", line)
+        if match:
+            variables[match.group(1)] = match.group(2)
+
+    def expand(value, depth=0):
+        if depth > 10:
+            return value
+        return re.sub(r"\$\((\w+)\)", lambda var: expand(variables.get(var.group(1), ""), depth + 1), value)
+
+    return expand(variables.get("SUBDIRS", "")).split()
+
+
+def remove_subdirs(path:str, removed):
+    """
+    Remove directories from the SUBDIRS of a generated Makefile
+    """
+    keep = [name for name in subdirs(read_makefile(path)) if name not in removed]
+    with open(path) as makefile:
+        content = makefile.read()
+
+    # only the SUBDIRS assignment (and its continuation lines) is rewritten
+    content = re.sub(r"^SUBDIRS\s*=(?:.*\\\n)*.*$", lambda _: f"SUBDIRS = {' '.join(keep)}",
+                     content, count=1, flags=re.MULTILINE)
+    with open(path, 'w') as makefile:
+        makefile.write(content)
+
+
+def prune_makefile(path:str, plugin_type:str, plugins):
+    """
+    Keep in the SUBDIRS of src/plugins/<plugin_type>/Makefile only the plugins of the profile
+    Return the removed plugins
+    """
+    removed = [name for name in subdirs(read_makefile(path))
+               if name not in always_built and f"{plugin_type}/{name}" not in plugins]
+    if removed:
+        remove_subdirs(path, removed)
+    return removed
+
+
+def prune_plugins(objdir:str, plugins):
+    """
+    Remove from the build (configured objdir) the plugins that aren't in the profile
+    and sview (unless the profile has it). Return the removed plugins (TYPE/NAME)
+    """
+    removed = []
+    if "sview" not in plugins and "sview" in subdirs(read_makefile(os.path.join(objdir, "src", "Makefile"))):
+        remove_subdirs(os.path.join(objdir, "src", "Makefile"), ["sview"])
+        removed.append("sview")
+
+    plugins_dir = os.path.join(objdir, "src", "plugins")
+    for plugin_type in sorted(os.listdir(plugins_dir)):
+        makefile = os.path.join(plugins_dir, plugin_type, "Makefile")
+        if os.path.isfile(makefile):
+            removed += [f"{plugin_type}/{name}" for name in prune_makefile(makefile, plugin_type, plugins)]
+    return removed
+
+
+def profile_args():
+    parser = argparse.ArgumentParser(description="Plugin profile of Slurm configuration files")
+    parser.add_argument("conf", nargs="+",
+                        help="Configuration files (e.g. slurm.conf slurmdbd.conf)")
+    parser.add_argument("--plugins", default="",
+                        help="Extra plugins to build (e.g. mpi/pmi2,gres/gpu,sview)")
+    parser.add_argument("--objdir",
+                        help="Prune the plugins of this configured build directory")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = profile_args()
+
+    try:
+        plugins = plugin_profile(args.conf, extra=[plugin for plugin in args.plugins.split(",") if plugin])
+        print_status(f"Plugin profile: {len(plugins)} plugins")
+        for plugin in sorted(plugins):
+            print(f"  {plugin}")
+
+        if args.objdir:
+            removed = prune_plugins(args.objdir, plugins)
+            print_successful(f"{len(removed)} plugins were removed from the build")
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+#
+# Configure Slurm accounting (slurmdbd) with a tuned MariaDB/MySQL backend
+#
+# The InnoDB settings recommended by Slurm (buffer pool, log file and
+# lock wait timeout) are sized to the memory of the database host,
+# then slurmdbd.conf, the database and its user are generated and the
+# result is validated against the local MariaDB instance.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import os
+import platform
+import re
+import secrets
+import subprocess
+import tempfile
+
+from fineprint.status import print_status, print_successful, print_failure
+
+
+def host_memory():
+    """
+    Total memory of this host (MB)
+    """
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2**20
+
+
+def innodb_settings(memory:int, *, fraction:float = 0.25):
+    """
+    InnoDB settings recommended by Slurm sized to memory (MB)
+    fraction: fraction of memory for the buffer pool (0.5 or more in a dedicated database host)
+    """
+    buffer_pool = max(1024, int(memory * fraction) // 128 * 128)
+    return {
+        "innodb_buffer_pool_size": f"{buffer_pool}M",
+        "innodb_log_file_size": f"{max(64, min(1024, buffer_pool // 8))}M",
+        "innodb_lock_wait_timeout": 900
+    }
+
+
+def to_bytes(size):
+    """
+    Convert a MySQL size (e.g. 1024M) to bytes
+    """
+    size = str(size)
+    units = {"K": 2**10, "M": 2**20, "G": 2**30}
+    if size[-1].upper() in units:
+        return int(size[:-1]) * units[size[-1].upper()]
+    return int(size)
+
+
+def mysql_cnf(settings:dict):
+    lines = ["# InnoDB settings for slurmdbd generated by hpcluster", "[mysqld]"]
+    lines += [f"{name}={value}" for name, value in settings.items()]
+    return "\n".join(lines) + "\n"
+
+
+def mysql_cnf_path():
+    """
+    Drop-in directory of the MariaDB server configuration (it depends on the distribution)
+    """
+    for conf_dir in ["/etc/my.cnf.d", "/etc/mysql/mariadb.conf.d", "/etc/mysql/conf.d"]:
+        if os.path.isdir(conf_dir):
+            return os.path.join(conf_dir, "90-slurmdbd.cnf")
+    raise Exception("Configuration directory of MariaDB/MySQL wasn't found (is mariadb-server installed?)")
+
+
+def slurmdbd_conf(*, dbd_host:str, storage_host:str = "localhost", storage_port:int = 3306,
+                  storage_user:str = "slurm", storage_pass:str, storage_loc:str = "slurm_acct_db"):
+    """
+    Generate the content of slurmdbd.conf
+    """
+    parameters = {
+        "AuthType": "auth/munge",
+        "DbdHost": dbd_host,
+        "SlurmUser": "slurm",
+        "DebugLevel": "info",
+        "LogFile": "/var/log/slurm-llnl/slurmdbd.log",
+        "PidFile": "/var/run/slurmdbd.pid",
+        "StorageType": "accounting_storage/mysql",
+        "StorageHost": storage_host,
+        "StoragePort": storage_port,
+        "StorageUser": storage_user,
+        "StoragePass": storage_pass,
+        "StorageLoc": storage_loc
+    }
+    lines = ["# slurmdbd.conf generated by hpcluster"]
+    lines += [f"{name}={value}" for name, value in parameters.items()]
+    return "\n".join(lines) + "\n"
+
+
+def accounting_parameters(dbd_host:str):
+    """
+    Parameters of slurm.conf to store the accounting in slurmdbd
+    """
+    return {
+        "AccountingStorageType": "accounting_storage/slurmdbd",
+        "AccountingStorageHost": dbd_host,
+        "JobAcctGatherType": "jobacct_gather/linux",
+        "JobAcctGatherFrequency": 30
+    }
+
+
+def mysql(sql:str, *, user:str = None, password:str = None, database:str = None):
+    """
+    Run sql with the mysql client (as root through sudo, unless user is supplied)
+    Return the rows of the result (tab separated columns)
+    """
+    cmd = ["mysql", "-N", "-B"]
+    env = dict(os.environ)
+    if user:
+        cmd.append(f"--user={user}")
+        env["MYSQL_PWD"] = password # not visible in the process list
+    else:
+        cmd = ["sudo"] + cmd
+    if database:
+        cmd.append(database)
+
+    output = subprocess.run(cmd, input=sql, env=env, capture_output=True, text=True, check=True).stdout
+    return [line.split("\t") for line in output.splitlines()]
+
+
+def check_identifier(value:str, description:str, *, pattern:str = r"[A-Za-z0-9_]+"):
+    """
+    Validate a name written in the SQL (database, user or host)
+    """
+    if not re.fullmatch(pattern, value):
+        raise Exception(f"Invalid {description} {value!r} (allowed characters: {pattern})")
+    return value
+
+
+def sql_string(value:str):
+    """
+    Quote a string literal of the SQL (backslashes and quotes are escaped)
+    """
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def database_sql(*, storage_user:str, storage_pass:str, storage_loc:str, client_host:str = "localhost"):
+    """
+    SQL to create the accounting database and its user (connecting from client_host)
+    """
+    check_identifier(storage_loc, "database name")
+    check_identifier(storage_user, "database user")
+    check_identifier(client_host, "client host", pattern=r"[A-Za-z0-9_.%-]+")
+    account = f"'{storage_user}'@'{client_host}'"
+    password = sql_string(storage_pass)
+    return "\n".join([
+        f"CREATE DATABASE IF NOT EXISTS {storage_loc};",
+        f"CREATE USER IF NOT EXISTS {account} IDENTIFIED BY {password};",
+        f"ALTER USER {account} IDENTIFIED BY {password};",
+        f"GRANT ALL ON {storage_loc}.* TO {account};",
+        "FLUSH PRIVILEGES;"
+    ]) + "\n"
+
+
+def validate(settings:dict, *, storage_user:str, storage_pass:str, storage_loc:str):
+    """
+    Validate the InnoDB settings of the running server and the access of slurmdbd to its database
+    Return a list of problems (empty if everything is right)
+    """
+    from tabulate import tabulate
+
+    problems = []
+    names = list(settings)
+    values = mysql(f"SELECT {', '.join('@@' + name for name in names)};")[0]
+
+    table = []
+    for name, value in zip(names, values):
+        expected = to_bytes(settings[name]) if name.endswith("_size") else int(settings[name])
+        ok = int(value) >= expected
+        table.append([name, settings[name], value, "ok" if ok else "WRONG"])
+        if not ok:
+            problems.append(f"{name} is {value} (expected {settings[name]})")
+    print(tabulate(table, headers=["Setting", "Expected", "Server", "Status"], tablefmt="pretty"))
+
+    try:
+        mysql("SELECT 1;", user=storage_user, password=storage_pass, database=storage_loc)
+    except subprocess.CalledProcessError as error:
+        problems.append(f"{storage_user} can't access {storage_loc}: {error.stderr.strip()}")
+
+    return problems
+
+
+def install_file(content:str, path:str, *, mode:str = "644", owner:str = "root"):
+    from sbash import Bash
+
+    with tempfile.NamedTemporaryFile('w', delete=False) as tmp:
+        tmp.write(content)
+    Bash.exec(f'sudo install -D -m{mode} -o {owner} -g {owner} {tmp.name} "{path}"')
+    os.remove(tmp.name)
+
+
+def setup_accounting(*, dbd_host:str = None, storage_user:str = "slurm", storage_pass:str = None,
+                     storage_loc:str = "slurm_acct_db", fraction:float = 0.25,
+                     service:str = "mariadb", conf_dir:str = "/etc/slurm-llnl"):
+    """
+    Tune MariaDB, create the accounting database and its user and install slurmdbd.conf
+    """
+    from sbash import Bash
+
+    dbd_host = dbd_host or platform.node().split(".")[0]
+    storage_pass = storage_pass or secrets.token_urlsafe(18)
+    settings = innodb_settings(host_memory(), fraction=fraction)
+    sql = database_sql(storage_user=storage_user, storage_pass=storage_pass, storage_loc=storage_loc)
+
+    if not os.path.isdir("/var/lib/mysql/mysql"): # e.g. arch doesn't initialize the data directory
+        Bash.exec("sudo mariadb-install-db --user=mysql --basedir=/usr --datadir=/var/lib/mysql")
+
+    print_status(f"Tuning InnoDB ({', '.join(f'{name}={value}' for name, value in settings.items())})")
+    install_file(mysql_cnf(settings), mysql_cnf_path())
+    Bash.exec(f"sudo systemctl enable {service}")
+    Bash.exec(f"sudo systemctl restart {service}")
+
+    print_status(f"Creating database {storage_loc} and user {storage_user}")
+    mysql(sql)
+
+    # slurmdbd refuses to start if slurmdbd.conf is readable by other users
+    install_file(slurmdbd_conf(dbd_host=dbd_host, storage_pass=storage_pass,
+                               storage_user=storage_user, storage_loc=storage_loc),
+                 os.path.join(conf_dir, "slurmdbd.conf"), mode="600", owner="slurm")
+
+    problems = validate(settings, storage_user=storage_user, storage_pass=storage_pass,
+                        storage_loc=storage_loc)
+    if problems:
+        raise Exception(f"Accounting setup is wrong: {'; '.join(problems)}")
+
+    print_successful(f"Accounting database {storage_loc} is ready (slurmdbd.conf in {conf_dir})")
+    return accounting_parameters(dbd_host)
+
+
+def slurmdbd_args():
+    parser = argparse.ArgumentParser(description="Configure Slurm accounting (slurmdbd) with a tuned MariaDB/MySQL backend")
+    parser.add_argument("--dbd-host", dest="dbd_host",
+                        help="Host of slurmdbd (default: this host)")
+    parser.add_argument("--storage-user", dest="storage_user", default="slurm",
+                        help="Database user of slurmdbd")
+    parser.add_argument("--storage-pass", dest="storage_pass",
+                        help="Password of the database user (default: random)")
+    parser.add_argument("--storage-loc", dest="storage_loc", default="slurm_acct_db",
+                        help="Name of the accounting database")
+    parser.add_argument("--buffer-pool", dest="fraction", type=float, default=0.25,
+                        help="Fraction of memory for the InnoDB buffer pool (0.5 or more in a dedicated host)")
+    parser.add_argument("--service", default="mariadb",
+                        help="Service of the database server (e.g. mariadb, mysqld)")
+    parser.add_argument("--no-deps", dest="no_deps", action="store_true",
+                        help="Don't install the database server")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import distro
+    from linux_requirements import install_requirements
+
+    args = slurmdbd_args()
+
+    try:
+        if not args.no_deps:
+            install_requirements(distro.id(), pkgs=["slurmdbd"], avoid_build_requirements=True)
+
+        parameters = setup_accounting(dbd_host=args.dbd_host, storage_user=args.storage_user,
+                                      storage_pass=args.storage_pass, storage_loc=args.storage_loc,
+                                      fraction=args.fraction, service=args.service)
+
+        print_status("Add these parameters to slurm.conf (or use slurm.py --accounting)")
+        for name, value in parameters.items():
+            print(f"{name}={value}")
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)
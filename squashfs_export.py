@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+#
+# Export the staged installations as a squashfs image (diskless/stateless nodes)
+#
+# The staged installations of the packages (BUILD_DIR/stage, built with
+# --native-pkg or --artifacts, or the best variant of the artifact store)
+# are merged in a compressed read-only squashfs image with a manifest
+# (packages and sha256 of every file). The image is verified locally
+# (unsquashfs, no root privileges) and a script is generated to mount it
+# in the nodes: the image is loop mounted and overlaid on its top-level
+# directories (/usr, /etc, ...) with a tmpfs upper layer, then the node
+# setup of the packages (users, spool and log directories, ...) is run.
+#
+# Maintainer: glozanoa <glozanoa@uni.pe>
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+
+import distro
+from fineprint.status import print_status, print_successful, print_failure
+from tabulate import tabulate
+
+from microarch import detect_microarch, stored_variants, best_variant, artifact_path
+from linux_requirements import install_requirements
+
+
+stack = ["pdsh", "munge", "pmix", "slurm", "openmpi", "pyslurm"]
+
+manifest_dir = ".hpcluster" # manifest inside the image
+
+
+def file_hash(path:str):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def tree_entries(root:str):
+    """
+    Files of a tree (path relative to root: sha256, symlink target or directory)
+    """
+    entries = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            relpath = os.path.relpath(path, root)
+            if relpath.split(os.sep)[0] == manifest_dir:
+                continue
+            if os.path.islink(path):
+                entries[relpath] = f"-> {os.readlink(path)}"
+            elif os.path.isdir(path):
+                entries[relpath] = "dir"
+            else:
+                entries[relpath] = file_hash(path)
+    return entries
+
+
+def staged_installs(build_dir:str, packages):
+    """
+    Most recent staged installation of each package in BUILD_DIR/stage (or BUILD_DIR/hosts/HOST/stage)
+    Return a dictionary package: (version, flavor, stage path, node setup commands)
+    """
+    stages = glob.glob(os.path.join(build_dir, "stage", "*")) + \
+             glob.glob(os.path.join(build_dir, "hosts", platform.node(), "stage", "*"))
+
+    installs = {}
+    for package in packages:
+        candidates = [stage for stage in stages if os.path.basename(stage).startswith(f"{package}-")
+                      and os.path.basename(stage)[len(package) + 1:][:1].isdigit() and os.path.isdir(stage)]
+        if candidates:
+            stage = max(candidates, key=os.path.getmtime)
+            version, flavor = os.path.basename(stage)[len(package) + 1:].rsplit("-", 1)
+            node_setup = []
+            if os.path.isfile(f"{stage}.json"): # saved by Package.stage_install
+                with open(f"{stage}.json") as stage_file:
+                    node_setup = json.load(stage_file)["node_setup"]
+            installs[package] = (version, flavor, stage, node_setup)
+    return installs
+
+
+def artifact_installs(store:str, packages, *, microarch:str = None):
+    """
+    Best variant for microarch (default: this host) of each package in the artifact store
+    Return a dictionary package: (version, variant, stage path, node setup commands)
+    """
+    installs = {}
+    for package in packages:
+        for path in sorted(glob.glob(os.path.join(store, f"{package}-*"))):
+            version = os.path.basename(path)[len(package) + 1:]
+            if not version[:1].isdigit():
+                continue
+            best = best_variant(stored_variants(store, package, version), microarch)
+            if best is not False:
+                path = artifact_path(store, package, version, best)
+                with open(os.path.join(path, "manifest.json")) as manifest_file:
+                    node_setup = json.load(manifest_file)["node_setup"]
+                installs[package] = (version, best or "generic", os.path.join(path, "root"), node_setup)
+    return installs
+
+
+def merge_tree(source:str, destination:str):
+    """
+    Merge a staged tree in destination (hard links if possible)
+    """
+    def link(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+    shutil.copytree(source, destination, symlinks=True, dirs_exist_ok=True, copy_function=link)
+
+
+def build_image(installs:dict, image:str, *, compression:str = "zstd", block_size:str = "128K"):
+    """
+    Build the squashfs image of the staged installations with its manifest
+    (inside the image and in IMAGE.manifest.json). Return the manifest
+    """
+    root = tempfile.mkdtemp(prefix="hpcluster-image-")
+    try:
+        packages = []
+        for package, (version, flavor, stage, node_setup) in installs.items():
+            print_status(f"Adding {package}-{version} ({flavor}) from {stage}")
+            merge_tree(stage, root)
+            packages.append({"name": package, "version": version, "flavor": flavor, "stage": stage,
+                             "files": sum(len(files) for _, _, files in os.walk(stage)),
+                             "node_setup": node_setup})
+
+        manifest = {
+            "image": os.path.basename(image),
+            "host": platform.node(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "compression": compression,
+            "packages": packages,
+            "overlays": sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name))),
+            "entries": tree_entries(root)
+        }
+        os.makedirs(os.path.join(root, manifest_dir))
+        with open(os.path.join(root, manifest_dir, "manifest.json"), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+        print_status(f"Building {image} ({compression})")
+        subprocess.run(["mksquashfs", root, image, "-noappend", "-all-root", "-quiet",
+                        "-comp", compression, "-b", block_size], check=True, capture_output=True, text=True)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    manifest["sha256"] = file_hash(image)
+    manifest["size"] = os.path.getsize(image)
+    with open(f"{image}.manifest.json", 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest
+
+
+def verify_image(image:str, manifest:dict = None):
+    """
+    Verify the checksum of the image and its files against the manifest (extracting it with unsquashfs)
+    Return the list of problems
+    """
+    if manifest is None:
+        with open(f"{image}.manifest.json") as manifest_file:
+            manifest = json.load(manifest_file)
+
+    problems = []
+    if manifest.get("sha256") and file_hash(image) != manifest["sha256"]:
+        problems.append(f"checksum of {image} doesn't match its manifest")
+
+    work_dir = tempfile.mkdtemp(prefix="hpcluster-image-verify-")
+    try:
+        root = os.path.join(work_dir, "root")
+        subprocess.run(["unsquashfs", "-n", "-d", root, image], check=True, capture_output=True, text=True)
+        entries = tree_entries(root)
+        for relpath, expected in manifest["entries"].items():
+            if relpath not in entries:
+                problems.append(f"{relpath} is missing")
+            elif entries[relpath] != expected:
+                problems.append(f"{relpath} differs")
+        problems += [f"{relpath} isn't in the manifest" for relpath in entries if relpath not in manifest["entries"]]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return problems
+
+
+def mount_script(manifest:dict, *, image_path:str, mount_point:str = "/run/hpcluster/image"):
+    """
+    Shell script (run as root in a node) that loop mounts the image, overlays its top-level
+    directories (writes go to a tmpfs upper layer) and runs the node setup of the packages
+    """
+    lines = [
+        "#!/bin/sh",
+        f"# mount {manifest['image']} ({', '.join(package['name'] for package in manifest['packages'])})",
+        "# generated by hpcluster",
+        "set -e",
+        f"IMAGE={image_path}",
+        f"MNT={mount_point}",
+        "mkdir -p $MNT $MNT.rw",
+        "mountpoint -q $MNT || mount -o loop,ro -t squashfs $IMAGE $MNT",
+        "mountpoint -q $MNT.rw || mount -t tmpfs -o mode=755 hpcluster-rw $MNT.rw"
+    ]
+    for name in manifest["overlays"]:
+        lines += [
+            f"mkdir -p $MNT.rw/upper/{name} $MNT.rw/work/{name} /{name}",
+            f"grep -q '^hpcluster-{name} /{name} overlay ' /proc/mounts || mount -t overlay hpcluster-{name} "
+            f"-o lowerdir=$MNT/{name}:/{name},upperdir=$MNT.rw/upper/{name},workdir=$MNT.rw/work/{name} /{name}"
+        ]
+    for package in manifest["packages"]:
+        # the script can run again (e.g. useradd of an existing user), so a failed command doesn't stop it
+        for cmd in package.get("node_setup", []):
+            failed = shlex.quote(f"node setup of {package['name']} failed: {cmd}")
+            lines.append(f"sh -c {shlex.quote(cmd)} || echo {failed} >&2")
+    return "\n".join(lines) + "\n"
+
+
+def export_args():
+    parser = argparse.ArgumentParser(description="Export the staged installations as a squashfs image")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("-b", "--build-dir", dest="build_dir",
+                        help="Build directory with the staged installations (BUILD_DIR/stage)")
+    source.add_argument("--artifacts",
+                        help="Artifact store (see microarch.py)")
+    source.add_argument("--verify", metavar="IMAGE",
+                        help="Only verify an image against its manifest")
+    parser.add_argument("--microarch",
+                        help="Microarch of the nodes (variants of the artifact store, default: this host)")
+    parser.add_argument("-p", "--packages", nargs="+", default=stack,
+                        help=f"Packages of the image (default: {' '.join(stack)})")
+    parser.add_argument("-o", "--output", default="hpcluster.squashfs",
+                        help="Image file")
+    parser.add_argument("--comp", default="zstd", choices=["zstd", "xz", "lz4", "lzo", "gzip"],
+                        help="Compression of the image (lz4/zstd: faster decompression, xz: smaller image)")
+    parser.add_argument("--mount-point", dest="mount_point", default="/run/hpcluster/image",
+                        help="Mount point of the image in the nodes (used by the mount script)")
+    parser.add_argument("--image-path", dest="image_path",
+                        help="Location of the image in the nodes (default: the output path)")
+    parser.add_argument("--no-deps", dest="no_deps", action="store_true",
+                        help="Don't install squashfs-tools")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = export_args()
+
+    try:
+        if not args.no_deps:
+            install_requirements(distro.id(), pkgs=["squashfs"], avoid_build_requirements=True)
+
+        if args.verify:
+            problems = verify_image(args.verify)
+        else:
+            if args.build_dir:
+                installs = staged_installs(os.path.abspath(os.path.expanduser(args.build_dir)), args.packages)
+            else:
+                installs = artifact_installs(args.artifacts, args.packages,
+                                             microarch=args.microarch or detect_microarch())
+
+            missing = [package for package in args.packages if package not in installs]
+            if missing:
+                print_failure(f"There aren't staged installations of {', '.join(missing)} "
+                              f"(build them with --native-pkg or --artifacts)")
+            if not installs:
+                raise Exception("There isn't any staged installation to export")
+
+            image = os.path.abspath(args.output)
+            manifest = build_image(installs, image, compression=args.comp)
+            print(tabulate([[package["name"], package["version"], package["flavor"], package["files"]]
+                            for package in manifest["packages"]],
+                           headers=["Package", "Version", "Flavor", "Files"], tablefmt="pretty"))
+
+            script = f"{os.path.splitext(image)[0]}-mount.sh"
+            with open(script, 'w') as script_file:
+                script_file.write(mount_script(manifest, image_path=args.image_path or image,
+                                               mount_point=args.mount_point))
+            os.chmod(script, 0o755)
+
+            problems = verify_image(image, manifest)
+            print_successful(f"{image} ({manifest['size'] // 2**20} MB), manifest: {image}.manifest.json, "
+                             f"mount script: {script}")
+
+        for problem in problems:
+            print_failure(problem)
+        if problems:
+            exit(1)
+        print_successful("The image matches its manifest")
+
+    except subprocess.CalledProcessError as error:
+        print_failure(f"{' '.join(error.cmd)} failed: {error.stderr}")
+        exit(1)
+
+    except Exception as error:
+        print_failure(error)
+        exit(1)